@@ -0,0 +1,215 @@
+'''
+end to end numbers of the dashboard, written as JSON to compare runs:
+- ingest: frames per second through on_message_handler and the SubscriptionManager
+  into the hub buffers
+- callbacks: p50/p99 latency of add_chart and of the refresh tick (update_chart in
+  full mode, extend_chart in extend mode) for 1, 10 and 50 charts over growing
+  histories, with the serialized response size per tick
+- memory: RSS growth over a simulated hour of a 100 Hz topic
+
+callbacks are posted through the flask test client, so the timings include dash's
+request handling and JSON serialization like a browser request would
+
+    python benchmarks/bench_dashboard.py [--quick] [--out results.json]
+'''
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+import uuid
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_decode import make_frames
+from src.dashboard import dashboard
+
+DEVICE, TOPIC = 'bench', 'telemetry'
+SOURCE = json.dumps([DEVICE, TOPIC])
+COLUMNS = ['sensor.temperature', 'sensor.pressure', 'sensor.axis.x', 'sensor.axis.y', 'sensor.axis.z']
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        # peak instead of current RSS where there is no procfs, KiB on linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def percentiles(samples):
+    return {'p50_ms' : float(np.percentile(samples, 50)) * 1000, 'p99_ms' : float(np.percentile(samples, 99)) * 1000}
+
+
+'''
+posts dash callbacks of one browser session, outputs are looked up by the ids of
+their inputs since the multiplexer renames them
+'''
+class Session(object):
+    def __init__(self, dash_app) -> None:
+        super().__init__()
+        self.app = dash_app
+        self.client = dash_app.app.server.test_client()
+        self.deps = self.client.get('/_dash-dependencies').json
+        self.session_id = str(uuid.uuid4())
+        self.page2 = json.loads(json.dumps(
+            dash_app.app.layout().children[2].to_plotly_json(), cls=PlotlyJSONEncoder
+        ))['props']['children']
+        self.charts = []
+
+    def _dep(self, input_id, state_ids):
+        for dep in self.deps:
+            if [i['id'] for i in dep['inputs']] == [input_id] and [s['id'] for s in dep['state']] == state_ids:
+                return dep
+        raise KeyError(input_id)
+
+    def _post(self, dep, inputs, state, outputs):
+        body = {
+            'output' : dep['output'], 'outputs' : outputs, 'inputs' : inputs, 'state' : state,
+            'changedPropIds' : [f"{inputs[0]['id']}.{inputs[0]['property']}"]
+        }
+        start = time.perf_counter()
+        resp = self.client.post('/_dash-update-component', json=body)
+        return time.perf_counter() - start, resp
+
+    def _multiplexed(self, dep):
+        output_id = dep['output'].rsplit('.', 1)[0]
+        return output_id, {'id' : json.loads(output_id), 'property' : 'data'}
+
+    def add_chart(self, y, chart_type='Line'):
+        dep = self._dep('creat_chart', [
+            'X_point', 'Y_point', 'chart_type', 'chart_source', 'chart_range', 'chart_aggregate', 'chart_window', 'page2', 'session-id'
+        ])
+        output_id, outputs = self._multiplexed(dep)
+        state = [
+            {'id' : 'X_point', 'property' : 'value', 'value' : 'timestamp'},
+            {'id' : 'Y_point', 'property' : 'value', 'value' : y},
+            {'id' : 'chart_type', 'property' : 'value', 'value' : chart_type},
+            {'id' : 'chart_source', 'property' : 'value', 'value' : SOURCE},
+            {'id' : 'chart_range', 'property' : 'value', 'value' : 0},
+            {'id' : 'chart_aggregate', 'property' : 'value', 'value' : 'raw'},
+            {'id' : 'chart_window', 'property' : 'value', 'value' : 50},
+            {'id' : 'page2', 'property' : 'children', 'value' : self.page2},
+            {'id' : 'session-id', 'property' : 'data', 'value' : self.session_id},
+        ]
+        clicks = self.app.hub.session(self.session_id).add_chart
+        elapsed, resp = self._post(dep, [{'id' : 'creat_chart', 'property' : 'n_clicks', 'value' : clicks}], state, outputs)
+        self.page2 = resp.json['response'][output_id]['data']
+        self.charts.append({'type' : 'chart', 'index' : clicks})
+        return elapsed, len(resp.data)
+
+    def tick(self, n_intervals):
+        ''' the refresh callback of the configured chart-update-mode '''
+        inputs = [{'id' : 'interval-component', 'property' : 'n_intervals', 'value' : n_intervals}]
+        session = {'id' : 'session-id', 'property' : 'data', 'value' : self.session_id}
+        prop = 'extendData' if self.app.chart_update_mode == 'extend' else 'figure'
+        pattern = '{"index":["ALL"],"type":"chart"}'
+        dep = next(
+            dep for dep in self.deps
+            if dep['output'] == f'{pattern}.{prop}' and [i['id'] for i in dep['inputs']] == ['interval-component']
+        )
+        outputs = [{'id' : chart, 'property' : prop} for chart in self.charts]
+        state = [[{'id' : chart, 'property' : 'id', 'value' : chart} for chart in self.charts], session]
+        elapsed, resp = self._post(dep, inputs, state, outputs)
+        return elapsed, len(resp.data)
+
+
+def subscribe(dash_app):
+    asyncio.run(dash_app.subscriptions.subscribe(DEVICE, TOPIC))
+
+
+def ingest(dash_app, frames, batch=256):
+    ''' raw frames -> on_message_handler -> dispatch_batch, the path of the data_collector '''
+    handler = dash_app.ws.on_message_handler
+    async def run():
+        for start in range(0, len(frames), batch):
+            msgs = [await handler(frame) for frame in frames[start:start + batch]]
+            dash_app.subscriptions.dispatch_batch(msgs)
+    asyncio.run(run())
+
+
+def bench_ingest(dash_app, count):
+    frames = make_frames(count)
+    dash_app.hub.buffer(DEVICE, TOPIC).clear()
+    start = time.perf_counter()
+    ingest(dash_app, frames)
+    return {'frames' : count, 'msgs_per_s' : count / (time.perf_counter() - start)}
+
+
+def bench_callbacks(dash_app, charts, history, ticks, rows_per_tick=100):
+    results = {}
+    for mode in ('full', 'extend'):
+        dash_app.chart_update_mode = mode
+        buffer = dash_app.hub.buffer(DEVICE, TOPIC)
+        buffer.clear()
+        ingest(dash_app, make_frames(history))
+        session = Session(dash_app)
+        adds = [session.add_chart(COLUMNS[i % len(COLUMNS)])[0] for i in range(charts)]
+        tick_times, sizes = [], []
+        frames = make_frames(rows_per_tick)
+        for n in range(1, ticks + 1):
+            ingest(dash_app, frames)
+            elapsed, size = session.tick(n)
+            tick_times.append(elapsed)
+            sizes.append(size)
+        results[mode] = {
+            'add_chart' : percentiles(adds),
+            'tick' : percentiles(tick_times),
+            'tick_bytes' : float(np.mean(sizes)),
+        }
+        dash_app.hub.release_all(session.session_id)
+    return results
+
+
+def bench_memory(dash_app, seconds=3600, rate=100, chart_every=1):
+    ''' an hour of a 100 Hz topic in simulated time, one extend tick per simulated second '''
+    dash_app.chart_update_mode = 'extend'
+    dash_app.hub.buffer(DEVICE, TOPIC).clear()
+    session = Session(dash_app)
+    ingest(dash_app, make_frames(rate))
+    session.add_chart(COLUMNS[0])
+    frames = make_frames(rate * chart_every)
+    start_rss = rss_mb()
+    curve = []
+    for second in range(0, seconds, chart_every):
+        ingest(dash_app, frames)
+        session.tick(second + 1)
+        if second % 60 == 0:
+            curve.append(round(rss_mb(), 1))
+    end_rss = rss_mb()
+    return {
+        'simulated_s' : seconds, 'rate_hz' : rate, 'rows' : seconds * rate,
+        'rss_start_mb' : start_rss, 'rss_end_mb' : end_rss, 'rss_growth_mb' : end_rss - start_rss,
+        'rss_per_minute_mb' : curve,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='up to 10 charts, small histories and a simulated 5 minutes')
+    parser.add_argument('--out', help='also write the results to this file')
+    args = parser.parse_args()
+    histories = [1000, 10000] if args.quick else [1000, 10000, 100000]
+    ticks = 10 if args.quick else 30
+    chart_counts = (1, 10) if args.quick else (1, 10, 50)
+
+    dash_app = dashboard()
+    subscribe(dash_app)
+    results = {
+        'started' : time.time(),
+        'ingest' : bench_ingest(dash_app, 20000 if args.quick else 100000),
+        'callbacks' : {
+            f'{charts}_charts_{history}_rows' : bench_callbacks(dash_app, charts, history, ticks)
+            for history in histories for charts in chart_counts
+        },
+        'memory' : bench_memory(dash_app, seconds=300 if args.quick else 3600),
+    }
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
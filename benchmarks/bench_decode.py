@@ -0,0 +1,100 @@
+'''
+frames per second from raw websocket frame to store buffer:
+the original path (json.loads + the nested payload appended to a pandas DataFrame)
+against the decoding pipeline (fastest json backend + compiled flattener into the
+ring buffer), row by row and in micro-batches as yielded by
+NetFieldWebSocket.messages(batch=...). the baseline needs pandas, the pipeline
+only decodes faster than json with orjson (or msgspec) installed, see backend
+
+    python benchmarks/bench_decode.py [frames]
+'''
+import json
+import os
+import sys
+import time
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.buffer import RingBuffer
+from src.decoding import Decoder
+
+
+def make_frames(count):
+    return [
+        json.dumps({
+            "type" : "message",
+            "path" : "/devices/bench/platformconnector/dGVsZW1ldHJ5",
+            "message" : {"data" : {
+                "timestamp" : 1650000000 + i,
+                "status" : "ok",
+                "sensor" : {
+                    "temperature" : 20 + i % 7,
+                    "pressure" : 1.01 + i % 3 / 100,
+                    "axis" : {"x" : i % 11, "y" : i % 13, "z" : i % 17}
+                }
+            }}
+        })
+        for i in range(count)
+    ]
+
+
+def _append(data, row):
+    # DataFrame.append is gone since pandas 2, it was a concat with a one-row frame
+    if hasattr(data, 'append'):
+        return data.append(row, ignore_index=True)
+    return pd.concat([data, pd.DataFrame([row])], ignore_index=True)
+
+
+def plain(frames):
+    data = pd.DataFrame()
+    for frame in frames:
+        msg = json.loads(frame)
+        if 'message' in msg:
+            data = _append(data, msg['message']['data'])
+
+
+def pipeline(frames):
+    buffer = RingBuffer(max_rows=len(frames))
+    decoder = Decoder()
+    for frame in frames:
+        msg = decoder.loads(frame)
+        if 'message' in msg:
+            buffer.append(decoder.flatten(msg['path'], msg['message']['data']))
+
+
+def batched(frames, batch=256):
+    buffer = RingBuffer(max_rows=len(frames))
+    decoder = Decoder()
+    for start in range(0, len(frames), batch):
+        rows = []
+        for frame in frames[start:start + batch]:
+            msg = decoder.loads(frame)
+            if 'message' in msg:
+                rows.append(decoder.flatten(msg['path'], msg['message']['data']))
+        buffer.extend(rows)
+
+
+def measure(fn, frames, repeat=3):
+    best = min(_timed(fn, frames) for _ in range(repeat))
+    return len(frames) / best
+
+
+def _timed(fn, frames):
+    start = time.perf_counter()
+    fn(frames)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    # every DataFrame append copies the frame, the baseline slows down with the count
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    frames = make_frames(count)
+    results = {
+        'frames' : count,
+        'backend' : Decoder().backend,
+        'plain_fps' : measure(plain, frames),
+        'pipeline_fps' : measure(pipeline, frames),
+        'batched_fps' : measure(batched, frames),
+    }
+    results['speedup'] = results['pipeline_fps'] / results['plain_fps']
+    results['batched_speedup'] = results['batched_fps'] / results['plain_fps']
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,47 @@
+'''
+device discovery against the local fake netFIELD api: 10k devices fetched page by
+page, with the pages requested concurrently, and from the per-organisation cache
+
+    python benchmarks/bench_devices.py [devices] [latency seconds per request]
+'''
+import asyncio
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.fake_netfield import FakeNetField
+from src.ws_netfield import NetFieldWebSocket
+
+
+async def run(count, latency):
+    server = await FakeNetField(port=0, devices=count, latency=latency).start()
+    nf = NetFieldWebSocket()
+    nf.BASE_API_ENDPOINT = server.url
+    # a token issued by the fake server, without going through login (which saves it to the config)
+    nf.token = nf.auth['headers']['authorization'] = 'bench-token'
+    server.tokens[nf.token] = time.time() + 3600
+    try:
+        results = {'devices' : count, 'latency_s' : latency, 'page_size' : nf.devices_page_size}
+        concurrency = nf.http_max_connections
+        for name, connections in (('sequential', 1), ('concurrent', concurrency)):
+            nf.http_max_connections = connections
+            await nf.aclose() # the connection pool is sized when the client is created
+            start = time.perf_counter()
+            devices = await nf.get_device_list(refresh=True)
+            results[f'{name}_s'] = time.perf_counter() - start
+            assert len({device['id'] for device in devices}) == count, f'{name}: got {len(devices)} devices'
+        start = time.perf_counter()
+        await nf.get_device_list()
+        results['cached_s'] = time.perf_counter() - start
+        results['requests'] = server.requests
+        return results
+    finally:
+        await nf.aclose()
+        await server.stop()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    print(json.dumps(asyncio.run(run(count, latency)), indent=2))
@@ -0,0 +1,100 @@
+'''
+cost of the alert rules in the ingest path: hundreds of threshold / rate / missing rules
+over a 1 kHz topic, ingested in micro-batches like the websocket batching does
+(ws-batch-linger 10 ms -> 10 rows per batch). reports the evaluation time per batch,
+the share of one core it takes at 1 kHz, and the same thresholds checked row by row
+
+    python benchmarks/bench_rules.py [rules] [--seconds 10] [--out results.json]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.buffer import RingBuffer
+from src.rules import RuleEngine
+
+KEY = ('bench', 'telemetry')
+RATE = 1000 # rows per second
+
+
+def make_rules(count, columns):
+    ''' 60% thresholds, 30% rate limits, 10% missing data, spread over the columns '''
+    rules = []
+    for i in range(count):
+        column = columns[i % len(columns)]
+        if i % 10 < 6:
+            rules.append({'name' : f'threshold {i}', 'type' : 'threshold', 'column' : column, 'min' : -4.5 - i % 3, 'max' : 4.5 + i % 3})
+        elif i % 10 < 9:
+            rules.append({'name' : f'rate {i}', 'type' : 'rate', 'column' : column, 'limit' : 6.5 + i % 3})
+        else:
+            rules.append({'name' : f'missing {i}', 'type' : 'missing', 'column' : column, 'seconds' : 5})
+    return rules
+
+
+def make_batches(seconds, batch_rows, columns):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(seconds * RATE, len(columns)))
+    rows = [dict(zip(columns, row)) for row in values.tolist()]
+    return [rows[i:i + batch_rows] for i in range(0, len(rows), batch_rows)]
+
+
+def bench_engine(rules, batches):
+    buffer = RingBuffer(max_rows=100000)
+    engine = RuleEngine(lambda device, topic: buffer, rules, max_events=100000)
+    timings = []
+    for batch in batches:
+        buffer.extend(batch)
+        start = time.perf_counter()
+        engine.evaluate([KEY])
+        timings.append(time.perf_counter() - start)
+    engine.check()
+    timings = np.array(timings)
+    seconds = sum(len(batch) for batch in batches) / RATE
+    return {
+        'batches' : len(batches),
+        'batch_p50_us' : float(np.percentile(timings, 50) * 1e6),
+        'batch_p99_us' : float(np.percentile(timings, 99) * 1e6),
+        'per_row_us' : float(timings.sum() / engine.evaluated_rows * 1e6),
+        'core_share_at_1khz' : float(timings.sum() / seconds),
+        'events' : engine.last_event,
+    }
+
+
+def bench_row_by_row(rules, batches):
+    ''' the thresholds alone, every rule compared against every row in python '''
+    thresholds = [rule for rule in rules if rule['type'] == 'threshold']
+    start = time.perf_counter()
+    rows = 0
+    for batch in batches:
+        for row in batch:
+            rows += 1
+            for rule in thresholds:
+                value = row.get(rule['column'])
+                if value is not None and (value < rule['min'] or value > rule['max']):
+                    pass
+    elapsed = time.perf_counter() - start
+    return {'thresholds' : len(thresholds), 'per_row_us' : elapsed / rows * 1e6, 'core_share_at_1khz' : elapsed / (rows / RATE)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('rules', nargs='?', type=int, default=500)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--seconds', type=int, default=10, help='seconds of 1 kHz data')
+    parser.add_argument('--out', help='also write the results to this file')
+    args = parser.parse_args()
+    columns = [f'sensor.value{i}' for i in range(args.columns)]
+    rules = make_rules(args.rules, columns)
+    results = {'rules' : args.rules, 'columns' : args.columns, 'rate_hz' : RATE}
+    for batch_rows in (1, 10, 100):
+        batches = make_batches(args.seconds, batch_rows, columns)
+        results[f'vectorized_{batch_rows}_rows_per_batch'] = bench_engine(rules, batches)
+    results['row_by_row_thresholds'] = bench_row_by_row(rules, make_batches(args.seconds, 10, columns))
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
@@ -0,0 +1,90 @@
+'''
+cold start of the dashboard: fresh interpreters import app.py (which builds the
+dashboard) and serve the first page and layout, with the slow imports deferred
+(LAZY_IMPORTS=1, the default) and loaded at startup (LAZY_IMPORTS=0). reports the
+median of each phase and where the import time goes, per top level package
+(self time from python -X importtime)
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 12] [--out results.json]
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, os, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.app.server.test_client()
+assert client.get('/').status_code == 200
+assert client.get('/_dash-layout').status_code == 200
+served = time.perf_counter()
+print(json.dumps({'import_app' : imported - start, 'first_response' : served - imported, 'startup' : app.app.startup}), flush=True)
+os._exit(0)
+'''
+
+
+def import_times(stderr):
+    ''' self time in seconds per top level package from the -X importtime output '''
+    packages = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(own) / 1e6
+    return packages
+
+
+def run_once(lazy):
+    env = dict(os.environ, LAZY_IMPORTS='1' if lazy else '0', LOG_LEVEL='WARNING')
+    start = time.perf_counter()
+    child = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - start
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    return dict(result, wall=wall), import_times(child.stderr)
+
+
+def bench(lazy, runs, top):
+    phases, packages = defaultdict(list), defaultdict(list)
+    for _ in range(runs):
+        result, imports = run_once(lazy)
+        for phase in ('wall', 'import_app', 'first_response'):
+            phases[phase].append(result[phase])
+        for phase, seconds in result['startup'].items():
+            if seconds is not None:
+                phases[f'startup_{phase}'].append(seconds)
+        phases['imports_total'].append(sum(imports.values()))
+        for name, seconds in imports.items():
+            packages[name].append(seconds)
+    median = lambda values: float(np.median(values)) * 1e3
+    slowest = sorted(packages.items(), key=lambda item: -np.median(item[1]))[:top]
+    return {
+        'runs' : runs,
+        'ms' : {phase : median(values) for phase, values in phases.items()},
+        'import_ms_by_package' : {name : median(values) for name, values in slowest},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=12, help='packages listed in the import breakdown')
+    parser.add_argument('--out', help='also write the results to this file')
+    args = parser.parse_args()
+    results = {'lazy' : bench(True, args.runs, args.top), 'eager' : bench(False, args.runs, args.top)}
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
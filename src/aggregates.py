@@ -0,0 +1,119 @@
+import math
+from collections import deque
+import numpy as np
+
+
+def derived_name(agg, column, window, x=None):
+    ''' name of the virtual column, e.g. mean[50](sensor.temperature) '''
+    if agg == 'rate' and x:
+        return f'rate[{window}]({column}/{x})'
+    return f'{agg}[{window}]({column})'
+
+
+def _floats(values):
+    if values.dtype != object:
+        return values.astype(float, copy=False)
+    out = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+            out[i] = value
+    return out
+
+
+'''
+rolling aggregates over the last `window` samples, every pushed sample costs O(1)
+(amortized): the mean keeps a running sum, min/max keep a monotonic deque and the
+rate compares against the sample `window` steps back. empty samples (NaN) count
+towards the window but not into the value. subclasses define reset() and push(x, y)
+'''
+class _Rolling(object):
+    def __init__(self, window: int) -> None:
+        super().__init__()
+        self.window = max(1, int(window))
+        self.reset()
+
+    def update(self, xs, ys):
+        ''' push a batch of samples, returns the aggregate after each one '''
+        xs = [None] * len(ys) if xs is None else xs.tolist()
+        push = self.push
+        return np.array([push(x, y) for x, y in zip(xs, ys.tolist())], dtype=float)
+
+
+class RollingMean(_Rolling):
+    def reset(self):
+        self._values = deque()
+        self._sum = 0.0
+        self._count = 0
+        self._pushed = 0
+
+    def push(self, x, y):
+        values = self._values
+        values.append(y)
+        if y == y:
+            self._sum += y
+            self._count += 1
+        if len(values) > self.window:
+            old = values.popleft()
+            if old == old:
+                self._sum -= old
+                self._count -= 1
+        self._pushed += 1
+        if self._pushed % self.window == 0:
+            # the window turned over, drop the float error the running sum picked up
+            self._sum = math.fsum(value for value in values if value == value)
+        return self._sum / self._count if self._count else np.nan
+
+
+class RollingMax(_Rolling):
+    def reset(self):
+        self._deque = deque() # (sample index, value), values decreasing
+        self._index = 0
+
+    def _dominates(self, new, old):
+        return new >= old
+
+    def push(self, x, y):
+        index = self._index = self._index + 1
+        entries = self._deque
+        if y == y:
+            while entries and self._dominates(y, entries[-1][1]):
+                entries.pop()
+            entries.append((index, y))
+        while entries and entries[0][0] <= index - self.window:
+            entries.popleft()
+        return entries[0][1] if entries else np.nan
+
+
+class RollingMin(RollingMax):
+    def _dominates(self, new, old):
+        return new <= old
+
+
+class RateOfChange(_Rolling):
+    ''' (y - y_old) / (x - x_old) against the sample window steps back, per sample without x '''
+    def reset(self):
+        self._samples = deque(maxlen=self.window + 1)
+        self._index = 0
+
+    def push(self, x, y):
+        self._index += 1
+        x = self._index if x is None else x
+        samples = self._samples
+        samples.append((x, y))
+        old_x, old_y = samples[0]
+        if len(samples) < 2 or x == old_x or x != x or old_x != old_x:
+            return np.nan
+        return (y - old_y) / (x - old_x)
+
+
+AGGREGATES = {
+    'mean' : RollingMean,
+    'min' : RollingMin,
+    'max' : RollingMax,
+    'rate' : RateOfChange,
+}
+
+
+def rolling(agg, window, xs, ys):
+    ''' the aggregate over a whole series at once, e.g. for recorded history '''
+    return AGGREGATES[agg](window).update(None if xs is None else _floats(np.asarray(xs)), _floats(np.asarray(ys)))
@@ -0,0 +1,280 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+import numpy as np
+from .aggregates import AGGREGATES, derived_name, _floats
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, complex)
+
+
+'''
+fixed-capacity columnar ring buffer, one preallocated numpy array per field.
+every array holds twice the capacity and each row is written at i and i + capacity,
+so the live window is always one contiguous slice and reads are zero-copy views.
+'''
+class RingBuffer(object):
+    def __init__(self, max_rows: int = 100000, max_age: Optional[float] = None) -> None:
+        super().__init__()
+        self.max_rows = int(max_rows)
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._columns = {}
+        self._time = np.full(2 * self.max_rows, np.nan)
+        # total number of rows ever appended, doubles as a monotonic cursor and buffer version
+        self.seq = 0
+        self._floor = 0
+        # sequence numbers of the gap marker rows
+        self.gaps = deque(maxlen=1024)
+        # virtual column name -> (rolling aggregate, source column, x column)
+        self._derived = {}
+        # column name -> seq after the last write of a value to it
+        self._versions = {}
+
+    def __len__(self):
+        with self._lock:
+            return self.seq - self._first()
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def version(self, *names):
+        ''' changes whenever a value is written to one of the columns (or the buffer is cleared) '''
+        versions = self._versions
+        return max([versions.get(name, self._floor) for name in names] or [self.seq])
+
+    @property
+    def nbytes(self):
+        ''' preallocated bytes of all columns (object columns only count their references) '''
+        return self._time.nbytes + sum(arr.nbytes for arr in list(self._columns.values()))
+
+    ##############################
+    # writing
+    def append(self, row: dict, timestamp: Optional[float] = None):
+        with self._lock:
+            self._write(row, time.time() if timestamp is None else timestamp)
+
+    def extend(self, rows, timestamp: Optional[float] = None):
+        ''' bulk append, every column is written with one vectorized assignment '''
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            now = time.time() if timestamp is None else timestamp
+            if len(rows) > self.max_rows:
+                self.seq += len(rows) - self.max_rows
+                rows = rows[-self.max_rows:]
+                # the dropped rows never reach the buffer, windows restart at the kept ones
+                for agg, _, _ in self._derived.values():
+                    agg.reset()
+            count = len(rows)
+            pos = (self.seq + np.arange(count)) % self.max_rows
+            mirror = pos + self.max_rows
+            keys = dict.fromkeys(key for row in rows for key in row)
+            for key in keys:
+                values = [row.get(key) for row in rows]
+                numeric = all(value is None or _is_number(value) for value in values)
+                arr = self._columns.get(key)
+                if arr is None:
+                    arr = self._add_column(key, 0 if numeric else None)
+                elif arr.dtype != object and not numeric:
+                    arr = self._columns[key] = arr.astype(object)
+                if arr.dtype != object:
+                    col = np.array(values, dtype=float)
+                else:
+                    col = np.empty(count, dtype=object)
+                    for i, value in enumerate(values):
+                        col[i] = value
+                arr[pos] = arr[mirror] = col
+                self._versions[key] = self.seq + count
+            for key, arr in self._columns.items():
+                if key not in keys:
+                    arr[pos] = arr[mirror] = np.nan if arr.dtype != object else None
+            self._time[pos] = self._time[mirror] = now
+            self.seq += count
+            self._update_derived(self.seq - count, self.seq)
+
+    def mark_gap(self, timestamp: Optional[float] = None):
+        ''' append an all-empty row, line charts show a break there and self.gaps remembers where '''
+        with self._lock:
+            if self.seq == self._floor or (self.gaps and self.gaps[-1] == self.seq - 1):
+                return
+            self.gaps.append(self.seq)
+            # windows don't reach across a gap, the gap row itself stays empty
+            for agg, _, _ in self._derived.values():
+                agg.reset()
+            self._write({}, time.time() if timestamp is None else timestamp)
+
+    def clear(self):
+        with self._lock:
+            self._columns = {}
+            self._time[:] = np.nan
+            # seq keeps counting so cursors and versions handed out before stay comparable
+            self._floor = self.seq
+            self.gaps.clear()
+            self._versions = {}
+            for name, (agg, _, _) in self._derived.items():
+                agg.reset()
+                self._add_column(name, 0)
+
+    def _write(self, row, timestamp):
+        idx = self.seq % self.max_rows
+        mirror = idx + self.max_rows
+        columns = self._columns
+        for key, value in row.items():
+            arr = columns.get(key)
+            if arr is None:
+                # like extend(), an empty first value starts a numeric column
+                arr = self._add_column(key, 0 if value is None else value)
+            if arr.dtype != object and not _is_number(value):
+                if value is None:
+                    value = np.nan
+                else:
+                    arr = columns[key] = arr.astype(object)
+            arr[idx] = arr[mirror] = value
+            self._versions[key] = self.seq + 1
+        if len(row) < len(columns):
+            # fields missing from this row
+            for key, arr in columns.items():
+                if key not in row:
+                    arr[idx] = arr[mirror] = np.nan if arr.dtype != object else None
+        self._time[idx] = self._time[mirror] = timestamp
+        self.seq += 1
+        if self._derived:
+            self._update_derived(self.seq - 1, self.seq)
+
+    def derive(self, agg: str, column: str, window: int, x: Optional[str] = None):
+        '''
+        add a virtual column holding a rolling aggregate of column, it is computed for
+        the live rows right away and then kept up to date on every append.
+        returns the column name, deriving the same aggregate again is a no-op
+        '''
+        name = derived_name(agg, column, window, x if agg == 'rate' else None)
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = (AGGREGATES[agg](window), column, x if agg == 'rate' else None)
+                self._add_column(name, 0)
+                self._update_derived(self._first(), self.seq, only=name)
+        return name
+
+    def _update_derived(self, start, stop, only=None):
+        if not self._derived or stop <= start:
+            return
+        pos = np.arange(start, stop) % self.max_rows
+        for name, (agg, column, x) in self._derived.items():
+            if only is not None and name != only:
+                continue
+            source = self._columns.get(column)
+            ys = _floats(source[pos]) if source is not None else np.full(len(pos), np.nan)
+            xs = self._columns.get(x) if x else None
+            xs = _floats(xs[pos]) if xs is not None else None
+            arr = self._columns[name]
+            arr[pos] = arr[pos + self.max_rows] = agg.update(xs, ys)
+            self._versions[name] = stop
+
+    def _add_column(self, key, value):
+        if _is_number(value):
+            arr = np.full(2 * self.max_rows, np.nan)
+        else:
+            arr = np.full(2 * self.max_rows, None, dtype=object)
+        self._columns[key] = arr
+        return arr
+    ##############################
+
+    ##############################
+    # reading, every view is read-only and only valid until the buffer wraps past it
+    def column(self, name, last: Optional[int] = None):
+        with self._lock:
+            if name not in self._columns:
+                raise KeyError(name)
+            start, stop = self._bounds(last)
+            return self._window(self._columns[name], start, stop)
+
+    def timestamps(self, last: Optional[int] = None):
+        with self._lock:
+            start, stop = self._bounds(last)
+            return self._window(self._time, start, stop)
+
+    def tail(self, last: Optional[int] = None):
+        ''' the last N rows (all live rows by default) as a dict of column views '''
+        return self.since(0, last)[0]
+
+    def since(self, cursor: int, last: Optional[int] = None):
+        ''' rows appended after `cursor` (capped to the last N) and the cursor to resume from '''
+        with self._lock:
+            start, stop = self._bounds(last)
+            start = min(max(start, cursor), stop)
+            return {
+                name: self._window(arr, start, stop)
+                for name, arr in self._columns.items()
+            }, stop
+
+    def snapshot(self, start: Optional[float] = None, end: Optional[float] = None, columns=None):
+        '''
+        copies of the live rows received within [start, end) (seconds since the epoch),
+        e.g. for an export that outlives the views. every column is copied under its own
+        short lock so ingest keeps running, rows overwritten while copying are dropped
+        from all columns, so the result is consistent. returns (timestamps, {name: array})
+        '''
+        timestamps, data, _ = self._copy(start, end, columns)
+        return timestamps, data
+
+    def copy(self, columns=None):
+        ''' like since(0) but copies (see snapshot), safe to process while ingest continues '''
+        _, data, stop = self._copy(None, None, columns)
+        return data, stop
+
+    def _copy(self, start, end, columns):
+        with self._lock:
+            first, stop = self._bounds(None)
+            ts = self._window(self._time, first, stop)
+            lo = first + (int(np.searchsorted(ts, start, side='left')) if start is not None else 0)
+            hi = first + (int(np.searchsorted(ts, end, side='left')) if end is not None else len(ts))
+            names = [name for name in (columns or self._columns) if name in self._columns]
+            timestamps = self._window(self._time, lo, hi).copy()
+        data = {}
+        for name in names:
+            with self._lock:
+                arr = self._columns.get(name)
+                if arr is not None:
+                    data[name] = self._window(arr, lo, hi).copy()
+        with self._lock:
+            # first row that has not been overwritten (or cleared) in the meantime
+            valid = max(self._floor, self._live_seq() - self.max_rows)
+        if valid > lo:
+            skip = min(valid, hi) - lo
+            timestamps = timestamps[skip:]
+            data = {name: values[skip:] for name, values in data.items()}
+        return timestamps, data, stop
+
+    def _live_seq(self):
+        return self.seq
+
+    def _bounds(self, last):
+        start = self._first()
+        if last is not None:
+            start = max(start, self.seq - int(last))
+        return start, self.seq
+
+    def _first(self):
+        first = max(self._floor, self.seq - self.max_rows)
+        if self.max_age and self.seq > first:
+            ts = self._window(self._time, first, self.seq)
+            first += int(np.searchsorted(ts, time.time() - self.max_age, side='left'))
+        return first
+
+    def _window(self, arr, start, stop):
+        offset = start % self.max_rows
+        view = arr[offset:offset + (stop - start)]
+        view.flags.writeable = False
+        return view
+    ##############################
@@ -1,30 +1,75 @@
-from ftplib import error_perm
-import threading
+import json
 import logging
+import re
+import time
+import uuid
+from urllib.parse import urlencode
 import dash
 from dash import  html
 from dash import dcc
 import dash_bootstrap_components as dbc
 import dash_trich_components as dtc
-from dash import Input, Output, State
+import flask
+from dash_extensions import WebSocket
+from dash import Input, Output, State, ALL
+from dash.exceptions import PreventUpdate
 from dash_extensions.enrich import MultiplexerTransform, DashProxy
-from .ws_netfield import NetFieldWebSocket, config
+from .ws_netfield import NetFieldWebSocket, config, LAZY_IMPORTS
+from .hub import Hub
+from .runtime import AsyncRuntime, Collectors
+from .subscriptions import SubscriptionManager
+from .downsample import Downsampler
+from .push import PushHub
+from .recorder import Recorder, RecordingReader
+from .metrics import Metrics, SamplingProfiler, rss_bytes, process_start_time
+from .aggregates import rolling
+from .figures import FigureFactory
+from .export import FORMATS, ARROW, arrow_available
+from .rules import RuleEngine
 import asyncio
-import pandas as pd
-import plotly.graph_objs as go
-import plotly.express as px
+import numpy as np
 
 
 '''
-store some temp variables to be shared between dash callbacks
+store some temp variables to be shared between dash callbacks of one browser session
+(the data buffers themselves are shared by all sessions through the hub)
 '''
 class Store(object):
     def __init__(self) -> None:
         super().__init__()
-        self.data = pd.DataFrame()
         self.chart_position = 45
-        self.data_flag = False
         self.add_chart = 1
+        # chart registry: index -> chart type, source, axis columns, the buffer cursor it was
+        # last extended to and the column version it was last rendered at
+        self.charts = {}
+        # (device, topic) viewed by this session
+        self.subscriptions = set()
+        self.last_seen = 0
+        # id of the last rule event shown as an alert
+        self.events_seen = None
+
+
+def index_devices(devices):
+    ''' (lowercased name and id, device id) of every device, searched by match_devices '''
+    return [(f"{device['name']} {device['id']}".lower(), device['id']) for device in devices]
+
+
+def match_devices(index, search='', exclude=(), limit=50):
+    ''' ids of the first limit devices whose name or id contains search '''
+    search = (search or '').lower()
+    matches = []
+    for key, device in index:
+        if len(matches) >= limit:
+            break
+        if search in key and device not in exclude:
+            matches.append(device)
+    return matches
+
+
+def preload_imports():
+    ''' LAZY_IMPORTS=0: import the deferred modules at startup rather than on first use '''
+    import httpx # noqa: F401
+    arrow_available()
 
 
 '''
@@ -32,6 +77,7 @@ the constructor builds the layout and all dash callbacks are wrapped in a functi
 '''
 class dashboard(config):
     def __init__(self) -> None:
+        started = time.time()
         super().__init__()
         #DashProxy allows multiple IOs to the callbacks
         self.app = DashProxy(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME],
@@ -39,9 +85,79 @@ class dashboard(config):
         #silence callback exceptions because some components are added dynamically
         self.app.config.suppress_callback_exceptions=True
         self.build_base_layout()
+        #(lowercased name and id, device id) of the organisation, searched by the device picker
+        self.device_index = []
+        #callback latencies are observed while the callbacks run, the other metrics are read on scrape
+        self.metrics = Metrics()
+        self.profiler = SamplingProfiler(self.profiler_interval)
         self.wrapped_callback(self.app) # the wrapper function
+        #one event loop for all websocket/REST coroutines, collectors are started/stopped explicitly
+        self.runtime = AsyncRuntime()
+        self.collectors = Collectors(self.runtime)
         self.ws = NetFieldWebSocket()
-        self.store = Store()
+        #sessions keep their own Store, the hub fans one upstream subscription out to all of them
+        if self.ingest_mode == 'process':
+            #the ingest worker (python -m src.ingest) owns the upstream connection and writes the
+            #buffers into shared memory, every dash worker process reads them from there
+            from .ingest import RemoteUpstream # only needed in this mode
+            self.hub = Hub(self.runtime, Store, self.buffer_max_rows, self.buffer_max_age, buffer_factory=self.shared_buffer)
+            self.subscriptions = RemoteUpstream(
+                self.ws, self.hub.buffer, f'ws://{self.ingest_host}:{self.ingest_port}', poll=self.push_coalesce
+            )
+        else:
+            self.hub = Hub(self.runtime, Store, self.buffer_max_rows, self.buffer_max_age)
+            self.subscriptions = SubscriptionManager(self.ws, self.hub.buffer)
+        self.hub.upstream = self.subscriptions
+        #figures are built from the buffer arrays, layouts are cached per chart
+        self.figures = FigureFactory(webgl_threshold=self.webgl_threshold, template=self.chart_template)
+        #point budget per chart follows its width in pixels
+        self.downsampler = Downsampler(
+            budget=self.chart_pixel_width * self.chart_points_per_pixel,
+            scatter=self.scatter_sampling
+        )
+        #in push mode the browser is told about new batches instead of polling
+        self.push = PushHub(port=self.push_port, window=self.push_coalesce)
+        self.subscriptions.listeners.append(self.push.notify)
+        #alert rules are compared against every ingested batch, breaches end up in an event list
+        self.rule_engine = RuleEngine(self.hub.buffer, self.rules, max_events=self.rules_events)
+        self.subscriptions.listeners.append(self.rule_engine.evaluate)
+        #optional append-only recording of every ingested batch, charts can replay a time range of it
+        self.recorder = self.recordings = None
+        if self.recording_dir and self.ingest_mode == 'process':
+            #the ingest worker records, the dashboard only reads
+            self.recordings = RecordingReader(self.recording_dir)
+        elif self.recording_dir:
+            self.recorder = Recorder(
+                self.recording_dir, flush=self.recording_flush,
+                segment_bytes=self.recording_segment_bytes, segment_age=self.recording_segment_age,
+                retain_bytes=self.recording_retain_bytes, retain_age=self.recording_retain_age
+            )
+            self.recorder.start()
+            self.recordings = RecordingReader(self.recording_dir)
+            self.subscriptions.sinks.append(self.recorder.write)
+        self.instrument(self.app.server)
+        self.serve_exports(self.app.server)
+        self.serve_rules(self.app.server)
+        if not LAZY_IMPORTS:
+            preload_imports()
+        #process start -> here is the interpreter and the imports, then building the app
+        process_start = process_start_time()
+        self.startup = {
+            'imports' : started - process_start if process_start else None,
+            'construct' : time.time() - started,
+        }
+        logging.info(
+            f"started in {time.time() - (process_start or started):.2f}s (construct {self.startup['construct']:.2f}s), "
+            f"lazy imports {'on' if LAZY_IMPORTS else 'off'}"
+        )
+
+    def shared_buffer(self, device, topic):
+        from .shared import SharedRingView, shm_name
+        #derived columns are computed by the worker, the view asks for them over the control channel
+        derive = lambda *args: self.runtime.submit(self.subscriptions.derive(device, topic, *args))
+        return SharedRingView(
+            shm_name(self.ingest_shm_prefix, device, topic), self.buffer_max_rows, self.buffer_max_age, on_derive=derive
+        )
             
     def build_base_layout(self):
         ##################################################################################
@@ -52,7 +168,12 @@ class dashboard(config):
             hidden_components= html.Div(
                 children = [
                     dbc.Input(id = 'selected_device'),
-                    dbc.Input(id = 'Topic')
+                    dbc.Input(id = 'Topic'),
+                    html.Div(id = 'push-container'),
+                    #a new session id on every page load, the heartbeat keeps the session alive
+                    dcc.Store(id = 'session-id', data = str(uuid.uuid4())),
+                    dcc.Interval(id = 'session-heartbeat', interval = self.session_heartbeat*1000),
+                    dcc.Interval(id = 'rules-poll', interval = self.rules_poll*1000)
                     ],
                 hidden=True
                 )
@@ -72,6 +193,8 @@ class dashboard(config):
                                 id = 'interval-component',
                                 interval = 3*1000, # in milliseconds
                                 n_intervals = 0,
+                                # in push mode the interval never fires, n_intervals is bumped by the push channel
+                                max_intervals = 0 if self.chart_refresh == 'push' else -1,
                                 disabled = True
                             ),
                 ],
@@ -99,7 +222,8 @@ class dashboard(config):
                     dbc.Label('API Endpoint',className = 'margin_label_top'),
                     dcc.Dropdown(id = 'api-endpoint', options = [
                         {'label' : 'training', 'value' : 'api-training'},
-                        {'label' : 'production', 'value' : 'api'}
+                        {'label' : 'production', 'value' : 'api'},
+                        {'label' : 'local (fake_netfield)', 'value' : 'ws://localhost:6010/v1'}
                     ]),
                     dbc.Label('API Key (Optional)', className = 'margin_label_top'),
                     dbc.Input(id = 'apikey', value = ''),
@@ -115,6 +239,14 @@ class dashboard(config):
         ##################################################################################
         #construct the second page view
         def charts_tab():
+            #recorded history can only be charted with recording-dir set
+            range_options = [{'label' : 'Live', 'value' : 0}]
+            if self.recording_dir:
+                range_options += [
+                    {'label' : 'Last hour', 'value' : 3600},
+                    {'label' : 'Last day', 'value' : 86400},
+                    {'label' : 'Last week', 'value' : 604800},
+                ]
             canvas = dbc.Offcanvas(
                 children = [
                     dbc.Row(children = [
@@ -128,6 +260,18 @@ class dashboard(config):
                             ])
                         ]
                     ),
+                    dbc.Col(
+                        children = [
+                            dbc.Label('Device: '),
+                            dcc.Dropdown(id='chart_source', options=[])
+                        ]
+                    ),
+                    dbc.Col(
+                        children = [
+                            dbc.Label('Range: '),
+                            dcc.Dropdown(id='chart_range', options=range_options, value=0, clearable=False)
+                        ]
+                    ),
                     dbc.Col(
                         children = [
                             dbc.Label('X Axis: '),
@@ -140,13 +284,39 @@ class dashboard(config):
                             dcc.Dropdown(id='Y_point', options=[])
                         ]
                     ),
+                    dbc.Col(
+                        children = [
+                            dbc.Label('Aggregate: '),
+                            dcc.Dropdown(id='chart_aggregate', options=[
+                                {'label' : 'Raw values', 'value' : 'raw'},
+                                {'label' : 'Moving average', 'value' : 'mean'},
+                                {'label' : 'Moving min', 'value' : 'min'},
+                                {'label' : 'Moving max', 'value' : 'max'},
+                                {'label' : 'Rate of change (dY/dX)', 'value' : 'rate'},
+                            ], value='raw', clearable=False)
+                        ]
+                    ),
+                    dbc.Col(
+                        children = [
+                            dbc.Label('Window (samples): '),
+                            dcc.Dropdown(id='chart_window', options=[
+                                {'label' : str(window), 'value' : window} for window in (10, 50, 100, 500, 1000)
+                            ], value=50, clearable=False)
+                        ]
+                    ),
 
                     ]),
                     dbc.Row(
                         children = [
                             html.Div(children = [
                                 dbc.Button(" Create", size = "lg", color = "success", className = "botton", id = 'creat_chart')],
-                                className = 'create_chart_btn')
+                                className = 'create_chart_btn'),
+                            #download the selected device buffer, e.g. into a notebook
+                            html.Div(children = [
+                                html.A('Export CSV', id = 'export_csv', href = '', target = '_blank'),
+                                html.A('Export Arrow', id = 'export_arrow', href = '', target = '_blank',
+                                       className = 'ms-3', hidden = not ARROW)
+                            ])
                         ]
                     )
                 ],
@@ -161,12 +331,129 @@ class dashboard(config):
                 canvas
             ], hidden = True, className = 'add_chart_btn')
         ##################################################################################
-        #final app layout (this is all static, dynamic components are added in the wrapped callbacks)                        
-        self.app.layout = html.Div(children=[
-        base_layout(), configuration_tab(), charts_tab()
+        #final app layout (built per page load for a fresh session id, dynamic components are added in the wrapped callbacks)
+        self.app.layout = lambda: html.Div(children=[
+        base_layout(), configuration_tab(), charts_tab(), html.Div(id = 'rule-alerts')
         ])
     
 
+    def instrument(self, server):
+        ##################################################################################
+        #prometheus style /metrics, values are only collected when scraped
+        nf, subs, metrics = self.ws, self.subscriptions, self.metrics
+        if self.ingest_mode == 'process':
+            #frames are received and decoded by the ingest worker
+            nf = subs
+        buffers = lambda value: [
+            ({'device' : device, 'topic' : topic}, value(buffer)) for (device, topic), buffer in list(self.hub.buffers.items())
+        ]
+        metrics.counter('netfield_frames_received_total', 'websocket frames received', lambda: nf.received)
+        metrics.counter('netfield_frames_decoded_total', 'frames decoded', lambda: nf.received - nf.undecodable)
+        metrics.counter('netfield_frames_undecodable_total', 'frames that failed to decode', lambda: nf.undecodable)
+        metrics.counter('netfield_frames_dropped_total', 'empty or unroutable frames', lambda: subs.dropped)
+        metrics.counter('netfield_decode_seconds_total', 'time spent decoding frames', lambda: nf.decode_seconds)
+        metrics.counter('netfield_reconnects_total', 'websocket reconnects', lambda: subs.reconnects)
+        metrics.gauge('netfield_connected', 'upstream websocket connected', lambda: int(subs.connected))
+        metrics.gauge('netfield_subscriptions', 'upstream (device, topic) subscriptions', lambda: len(subs.active))
+        metrics.gauge('netfield_seconds_since_last_message', 'seconds since the last data frame',
+                      lambda: time.time() - subs.last_message if subs.last_message else None)
+        metrics.gauge('dashboard_buffer_rows', 'rows held per buffer', lambda: buffers(len))
+        metrics.gauge('dashboard_buffer_capacity_rows', 'capacity per buffer', lambda: buffers(lambda b: b.max_rows))
+        metrics.gauge('dashboard_buffer_bytes', 'preallocated column bytes per buffer', lambda: buffers(lambda b: b.nbytes))
+        metrics.gauge('dashboard_sessions', 'browser sessions', lambda: len(self.hub.sessions))
+        metrics.counter('dashboard_push_notifications_total', 'push notifications sent', lambda: self.push.sent)
+        metrics.gauge('process_resident_memory_bytes', 'resident memory', rss_bytes)
+        metrics.gauge('process_start_time_seconds', 'start of the process since the epoch', process_start_time)
+        metrics.gauge('dashboard_startup_seconds', 'startup time per phase',
+                      lambda: [({'phase' : phase}, seconds) for phase, seconds in self.startup.items()])
+        metrics.counter('dashboard_rule_events_total', 'rule breaches and clears', lambda: self.rule_engine.last_event)
+        metrics.counter('dashboard_rule_rows_total', 'rows evaluated against the rules', lambda: self.rule_engine.evaluated_rows)
+        metrics.counter('dashboard_rule_seconds_total', 'time spent evaluating rules', lambda: self.rule_engine.evaluate_seconds)
+        if self.recorder:
+            metrics.counter('dashboard_recorded_rows_total', 'rows written by the recorder', lambda: self.recorder.rows_written)
+            metrics.counter('dashboard_recording_dropped_rows_total', 'rows dropped by a full recorder queue', lambda: self.recorder.rows_dropped)
+
+        @server.route('/metrics')
+        def metrics_endpoint():
+            return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+        #opt-in sampling profiler: /profile/start, /profile/stop, /profile returns the folded stacks
+        if self.profiler_enabled:
+            @server.route('/profile/<action>')
+            def profile_toggle(action):
+                if action == 'start':
+                    self.profiler.start()
+                elif action == 'stop':
+                    self.profiler.stop()
+                else:
+                    flask.abort(404)
+                return flask.jsonify({'running' : self.profiler.running, 'samples' : self.profiler.samples})
+
+            @server.route('/profile')
+            def profile():
+                return flask.Response(self.profiler.folded(), mimetype='text/plain')
+        ##################################################################################
+
+    def serve_exports(self, server):
+        ##################################################################################
+        #/export?device=&topic=&format=csv|arrow streams a copy of the buffer in chunks.
+        #optional: start and end (seconds since the epoch) or seconds (the last N), columns=a,b
+        @server.route('/export')
+        def export():
+            args = flask.request.args
+            device, topic = args.get('device'), args.get('topic')
+            buffer = self.hub.buffers.get((device, topic))
+            if buffer is None:
+                flask.abort(404)
+            fmt = args.get('format', 'csv')
+            if fmt not in FORMATS:
+                flask.abort(400)
+            if fmt == 'arrow' and not arrow_available():
+                flask.abort(501)
+            try:
+                start = float(args['start']) if args.get('start') else None
+                end = float(args['end']) if args.get('end') else None
+                if args.get('seconds'):
+                    start = time.time() - float(args['seconds'])
+            except ValueError:
+                flask.abort(400)
+            columns = args['columns'].split(',') if args.get('columns') else None
+            #the copy is taken up front, streaming it never holds the buffer lock
+            timestamps, data = buffer.snapshot(start, end, columns)
+            generate, mimetype, extension = FORMATS[fmt]
+            filename = re.sub(r'[^\w.-]+', '_', f'{self.hub.device_names.get(device, device)}_{topic}')
+            return flask.Response(
+                generate(timestamps, data), mimetype=mimetype,
+                headers={'Content-Disposition' : f'attachment; filename="{filename}.{extension}"'}
+            )
+        ##################################################################################
+
+    def serve_rules(self, server):
+        ##################################################################################
+        #/rules lists the alert rules, POST a json list to replace them (saved to the config)
+        #/events?since=<id> polls the breaches and clears after the given event id
+        @server.route('/rules', methods=['GET', 'POST'])
+        def rules():
+            if flask.request.method == 'POST':
+                rules = flask.request.get_json(silent=True)
+                if not isinstance(rules, list):
+                    return flask.jsonify({'error' : 'expected a json list of rules'}), 400
+                try:
+                    self.rule_engine.set_rules(rules)
+                except (ValueError, TypeError, KeyError) as ex:
+                    return flask.jsonify({'error' : str(ex)}), 400
+                self.update_config({'rules' : rules})
+            return flask.jsonify(self.rule_engine.rules)
+
+        @server.route('/events')
+        def events():
+            try:
+                since = int(flask.request.args.get('since', 0))
+            except ValueError:
+                flask.abort(400)
+            return flask.jsonify({'events' : self.rule_engine.events(since), 'last' : self.rule_engine.last_event})
+        ##################################################################################
+
     def wrapped_callback(self,app):
         
         ##################################################################################
@@ -176,15 +463,16 @@ class dashboard(config):
             Output('page2', 'hidden'),
             Input('id_1','n_clicks'),
             Input('id_2', 'n_clicks'),
+            State('session-id', 'data'),
             )
-        def toggle(_,__):
+        def toggle(_,__, session_id):
             ctx = dash.callback_context
             page1, page2 = True, True
             if 'id_1' in ctx.triggered[0]['prop_id']:
                 return not page1, page2
             
             elif 'id_2' in ctx.triggered[0]['prop_id']:
-                self.store.chart_position = 45
+                self.hub.session(session_id).chart_position = 45
                 
                 return page1, not page2
             
@@ -198,11 +486,32 @@ class dashboard(config):
             Output('api-endpoint', 'options')
         )
         def set_endpoint(value):
-            if value  != 'None':
-                self.config_file['BASE_API_ENDPOINT'] = f'wss://{value}.netfield.io/v1'
-                self.update_config()
+            #a cleared dropdown sends None, the endpoint stays as it is
+            if not value:
+                return dash.no_update
+            #full urls are taken as is, e.g. the local fake server
+            self.update_config({'BASE_API_ENDPOINT' : value if '://' in value else f'wss://{value}.netfield.io/v1'})
             return dash.no_update
         
+        ##################################################################################
+        #the device picker only holds the matches of the typed text and the selected devices
+        @app.callback(
+            Output('selected_device', 'options'),
+            Input('selected_device', 'search_value'),
+            State('selected_device', 'value')
+        )
+        def search_devices(search, selected):
+            if search is None:
+                raise PreventUpdate
+            return device_options(selected, search)
+
+        def device_options(selected=None, search='', limit=50):
+            selected = selected or []
+            return [
+                {'label' : self.hub.device_names.get(device, device), 'value' : device}
+                for device in list(selected) + match_devices(self.device_index, search, selected, limit)
+            ]
+
         ##################################################################################
         #verify user input, add a component to the device view dynamically
         #TODO: a function should not be this long!
@@ -217,45 +526,52 @@ class dashboard(config):
                 State('org_id', 'value')
             ]
         )
+        @self.metrics.timed('verify_mailpassword')
         def verify_mailpassword(_, email, password, apikey, children, org_id):
             #check user input and update config file
             if email and password:
-                self.config_file['email'] = email
-                self.config_file['password'] = password
-                self.config_file['organisationId'] = org_id
-                self.update_config()#save the scope to a configuration file for next sessions
-                self.ws = asyncio.run(NetFieldWebSocket.from_email())
+                #save the scope to the configuration file for next sessions
+                self.update_config({'email' : email, 'password' : password, 'organisationId' : org_id})
+                #the client is kept (and its connection pool with it), only the credentials change
+                self.ws.reload()
+                self.runtime.run(self.ws.login())
             
             elif apikey:
-                self.config_file['accessToken'] = apikey
-                self.update_config()
-                self.ws = NetFieldWebSocket()
+                self.update_config({'accessToken' : apikey})
+                self.ws.reload()
             
             #Fallback to configuration file
             else:
                 if self.token:
-                    self.ws = NetFieldWebSocket()                
+                    self.ws.reload()
                 elif self.email and password:
-                    self.ws = asyncio.run(NetFieldWebSocket.from_email())
+                    self.ws.reload()
+                    self.runtime.run(self.ws.login())
                 else:
                     msg = msg_bar(error=1, msg='No configuration found...')
                     children.append(msg)
                     return children
                 
-            verify_user = asyncio.run(self.ws.verify_token())
+            verify_user = self.runtime.run(self.ws.verify_token())
             if verify_user:
                 msg = msg_bar(error = 1, msg=f'ERROR : {verify_user}')
                 children.append(msg)
                 return children
             
-            #create a device list radio items
+            #create a searchable device picker, several devices can be plotted side by side
+            #only the first matches are sent, search_devices loads the rest while typing
             try:
-                devices = asyncio.run(self.ws.get_device_list())
-                devices = [{'label' : device['name'], 'value' : device['id']} for device in devices]
+                devices = self.runtime.run(self.ws.get_device_list())
+                self.hub.device_names = {device['id'] : device['name'] for device in devices}
+                self.device_index = index_devices(devices)
                 device_list = html.Div(children = [
                     dbc.Toast(
                         children = [
-                            dcc.RadioItems(options = devices, value = devices[0]['value'], id = 'selected_device'),
+                            dcc.Dropdown(
+                                id = 'selected_device', multi = True, value = [devices[0]['id']],
+                                options = device_options([devices[0]['id']]),
+                                placeholder = f'Search {len(devices)} devices...'
+                            ),
                             dbc.Label('Topic:', className = 'margin_label_top'),
                             dbc.Input(id = 'Topic', className = 'margin_label_top')
                         ],
@@ -284,35 +600,79 @@ class dashboard(config):
             return False
         
         ##################################################################################
-        # when switched to page1 view, reset data flag to disconnect the websocket
+        # when switched to page1 view, release the session's subscriptions
+        # the websocket is disconnected once no session views anything
         @app.callback(
             Input('id_1', 'n_clicks'),
-            Output('page2', 'children')
+            Output('page2', 'children'),
+            State('session-id', 'data')
+        )
+        def leave_charts(_, session_id):
+            self.hub.release_all(session_id)
+            if not self.hub.active():
+                self.collectors.stop('netfield')
+                self.collectors.stop('rules')
+            return dash.no_update
+
+        ##################################################################################
+        # rule events of the viewed sources since the last poll are shown in one alert
+        @app.callback(
+            Input('rules-poll', 'n_intervals'),
+            Output('rule-alerts', 'children'),
+            State('session-id', 'data')
+        )
+        def show_rule_events(_, session_id):
+            store = self.hub.session(session_id)
+            if store.events_seen is None:
+                # a new page only shows what happens from now on
+                store.events_seen = self.rule_engine.last_event
+            events = self.rule_engine.events(store.events_seen)
+            if not events:
+                raise PreventUpdate
+            store.events_seen = events[-1]['id']
+            events = [event for event in events if (event['device'], event['topic']) in store.subscriptions]
+            breaches = [event for event in events if event['state'] == 'breach']
+            shown = breaches or events
+            if not shown:
+                raise PreventUpdate
+            text = '; '.join(
+                f"{self.hub.device_names.get(event['device'], event['device'])} / {event['topic']}: {event['message']}"
+                for event in shown[-3:]
+            )
+            if len(shown) > 3:
+                text += f' (+{len(shown) - 3} more)'
+            return msg_bar(error=1 if breaches else 0, msg=text)
+
+        ##################################################################################
+        # sessions that stop sending heartbeats (closed tabs) are released
+        @app.callback(
+            Input('session-heartbeat', 'n_intervals'),
+            Output('session-heartbeat', 'disabled'),
+            State('session-id', 'data')
         )
-        def reset_data_flag(_):
-            self.store.data_flag = True
+        def heartbeat(_, session_id):
+            self.hub.session(session_id)
+            expired = self.hub.reap(self.session_ttl)
+            for expired_id, session in expired.items():
+                for index in session.charts:
+                    self.downsampler.forget((expired_id, index))
+                    self.figures.forget((expired_id, index))
+            if expired and not self.hub.active():
+                self.collectors.stop('netfield')
+                self.collectors.stop('rules')
             return dash.no_update
     
         ########################    
-        #workaround to calling async functions from a dash callback
-        # an endless loop that collects data from the websocket, and assigns it to the current store scope    
-        def data_collector(id, topic):
-            async def wrapper():
-                await self.ws.init_websocket()
-                await self.ws.subscribe_to_topic(id, topic)
-                await self.ws.listen_for_messages()
-                async for msg in self.ws.ws:
-                    tmp = await self.ws.listen_for_messages()
-                    if 'message' in tmp.keys():
-                        self.store.data = self.store.data.append(tmp['message']['data'], ignore_index=True)
-                    if self.store.data_flag:
-                        break
-                await self.ws.close_websocket()
+        # an endless loop that collects data from the websocket, the subscription manager routes
+        # every frame into the store buffer of its (device, topic)
+        # runs as a task on the runtime loop until it is stopped through self.collectors
+        async def data_collector():
             try:
-                asyncio.run(wrapper())
-            except (Exception, KeyboardInterrupt) as ex:
+                await self.subscriptions.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
                 logging.error(ex)
-            return
         ########################
         
         
@@ -324,21 +684,25 @@ class dashboard(config):
             Output('page2', 'children'),
             [
                 State('selected_device', 'value'),
-                State('Topic', 'value')
+                State('Topic', 'value'),
+                State('session-id', 'data')
             ]
         )
-        def init_socket(disabled, id, topic):
+        def init_socket(disabled, ids, topic, session_id):
             if not disabled:
                 try:
-                    self.store.data_flag = False
-                    if not topic or not id:
+                    if isinstance(ids, str):
+                        ids = [ids]
+                    if not topic or not ids:
                         logging.info('device Id or topic is missing....')
                         return dash.no_update
-                    self.config_file['message-topic'] = topic
-                    self.config_file['device'] = id
-                    self.update_config()                      
-                    sub = threading.Thread(target=data_collector, args=(id, topic))
-                    sub.start()
+                    self.update_config({'message-topic' : topic, 'device' : ids[0]})
+                    #all subscriptions share one connection, the hub only sends subs/unsubs
+                    #for (device, topic) that gain their first or lose their last viewer
+                    self.hub.set_subscriptions(session_id, [(id, topic) for id in ids])
+                    self.collectors.start('netfield', data_collector)
+                    #missing data can't show up in a batch, those rules are checked on a timer
+                    self.collectors.start('rules', lambda: self.rule_engine.run(sources=self.hub.active))
                 except Exception as ex:
                     logging.exception(ex)
             return dash.no_update
@@ -354,24 +718,87 @@ class dashboard(config):
         def deactivate_interval(click):
             if click:
                 return True
+
+        ##################################################################################
+        #push mode: when the update interval is activated, mount a websocket to the push channel
+        #(the component connects once on mount, so it is removed again when leaving the tab)
+        #if the push port can't be bound the charts fall back to the interval
+        @app.callback(
+            Input('interval-component', 'disabled'),
+            Output('push-container', 'children'),
+            Output('interval-component', 'max_intervals'),
+        )
+        def connect_push(disabled):
+            if self.chart_refresh != 'push':
+                return dash.no_update, dash.no_update
+            if disabled:
+                return [], dash.no_update
+            try:
+                self.runtime.run(self.push.start())
+            except OSError as ex:
+                logging.error(f'push channel on port {self.push.port} unavailable, polling instead: {ex}')
+                return [], -1
+            host = flask.request.host.rsplit(':', 1)[0]
+            scheme = 'wss' if flask.request.scheme == 'https' else 'ws'
+            return WebSocket(id = 'push', url = f'{scheme}://{host}:{self.push.port}'), 0
+
+        # every push message bumps n_intervals, which drives the regular chart update callbacks
+        app.clientside_callback(
+            "function(message, n) { return (n || 0) + 1; }",
+            Output('interval-component', 'n_intervals'),
+            Input('push', 'message'),
+            State('interval-component', 'n_intervals'),
+        )
             
         ##################################################################################
         #active on button add new chart, the canvass prop 'is_open' is set
-        #the plot axis options are added from the dataframe in the store
+        #the device options are the subscribed (device, topic) buffers in the store
         @app.callback(
             Input('add_chart_btn', 'n_clicks'),
             Output('offcanvas-placement', 'is_open'),
+            Output('chart_source', 'options'),
+            Output('chart_source', 'value'),
+            State('session-id', 'data')
+        )
+        def show_canvas(_, session_id):
+            sources = [
+                {'label' : f'{self.hub.device_names.get(device, device)} / {topic}', 'value' : json.dumps([device, topic])}
+                for device, topic in sorted(self.hub.session(session_id).subscriptions)
+            ]
+            return True, sources, sources[0]['value'] if sources else None
+
+        ##################################################################################
+        #the plot axis options are the columns of the selected device buffer
+        @app.callback(
+            Input('chart_source', 'value'),
             Output('X_point', 'options'),
             Output('Y_point', 'options'),
         )
-        def show_canvas(_):            
-            features = self.store.data.columns
+        def show_axis_options(source):
+            if not source:
+                return [], []
+            features = list(self.hub.buffer(*json.loads(source)).columns)
+            if self.recordings:
+                features += [key for key in self.recordings.columns(*json.loads(source)) if key not in features]
             options = [
                 {'label' : key, 'value' : key}
                 for key in features
             ]
-            return True, options, options
+            return options, options
         
+        ##################################################################################
+        #the export links point at the selected device buffer
+        @app.callback(
+            Input('chart_source', 'value'),
+            Output('export_csv', 'href'),
+            Output('export_arrow', 'href'),
+        )
+        def export_links(source):
+            if not source:
+                return '', ''
+            device, topic = json.loads(source)
+            return [f'/export?{urlencode({"device" : device, "topic" : topic, "format" : fmt})}' for fmt in ('csv', 'arrow')]
+
         ##################################################################################
         # active on button create chart, reads the state of page2 children. (children are represented by a list and charts start at 2) 
         # read the state of the dropdown for the axis
@@ -384,62 +811,161 @@ class dashboard(config):
                 State('X_point', 'value'),
                 State('Y_point', 'value'),
                 State('chart_type', 'value'),
+                State('chart_source', 'value'),
+                State('chart_range', 'value'),
+                State('chart_aggregate', 'value'),
+                State('chart_window', 'value'),
                 State('page2', 'children'),
+                State('session-id', 'data'),
             ]
         )
-        def add_chart(_, x_label, y_label, chart_type,children):
-            if _ == self.store.add_chart:
-                if not x_label and not y_label:
+        @self.metrics.timed('add_chart')
+        def add_chart(_, x_label, y_label, chart_type, source, history, aggregate, window, children, session_id):
+            store = self.hub.session(session_id)
+            if _ == store.add_chart:
+                if not x_label and not y_label or not source:
                     return dash.no_update
-                self.store.add_chart += 1
-                fig = None
-                if chart_type == 'Line':
-                    fig = draw_line(x_label, y_label)
-                elif chart_type == 'Scatter':
-                    fig = draw_scatter(x_label, y_label)
-                elif chart_type == 'Bar':
-                    fig = draw_bar(x_label, y_label)
+                index = store.add_chart
+                store.add_chart += 1
+                source = tuple(json.loads(source))
+                derive = None
+                if aggregate and aggregate != 'raw' and y_label:
+                    # a virtual column of the shared buffer, kept up to date on ingest
+                    derive = {'agg' : aggregate, 'column' : y_label, 'window' : window or 50, 'x' : x_label}
+                    y_label = self.hub.buffer(*source).derive(aggregate, y_label, window or 50, x=x_label)
+                store.charts[index] = {
+                    'type' : chart_type, 'source' : source,
+                    'x' : x_label, 'y' : y_label, 'cursor' : 0,
+                    # seconds of recorded history, 0 for a live chart
+                    'range' : history or 0,
+                    'derive' : derive,
+                    # buffer version of the x/y columns when the chart was last drawn (full mode)
+                    'rendered' : None
+                }
+                # extendData is not reflected in the figure state we get back, so existing charts are redrawn
+                for child in children[2:]:
+                    chart_index = child['props'].get('id', {}).get('index')
+                    if chart_index in store.charts:
+                        child['props']['figure'] = draw_chart(session_id, chart_index)
                 
                 children.append(
-                    dcc.Graph(figure = fig, className = 'first_chart', style = {'margin-top' : f'{self.store.chart_position}%'})
+                    dcc.Graph(
+                        id = {'type' : 'chart', 'index' : index},
+                        figure = draw_chart(session_id, index),
+                        className = 'first_chart',
+                        style = {'margin-top' : f'{store.chart_position}%'}
+                    )
                 )
                 #//future charts should placed at a higher top-margin value
-                self.store.chart_position+=235
+                store.chart_position+=235
                 return children
             return dash.no_update
 
         ##################################################################################
-        # loop through the children list
-        # update the x,y properties
+        # full mode: redraw the charts whose x/y columns were written since they were last rendered
+        # the registry in the session store knows each chart's axes, type and rendered version
         @app.callback(
-            Output('page2', 'children'),
+            Output({'type' : 'chart', 'index' : ALL}, 'figure'),
             Input('interval-component', 'n_intervals'),
-            [
-                State('page2', 'children')
-            ]
+            State({'type' : 'chart', 'index' : ALL}, 'id'),
+            State('session-id', 'data')
         )
-        def update_chart(_, children):
-            for idx in range(2,len(children)):
-                labels = children[idx]['props']['figure']['data'][0]['hovertemplate'].split("=%{x}<br>")
-                x_label = labels[0]
-                y_label = labels[1][0:labels[1].index('=')]
-                X = self.store.data[x_label].to_list()
-                y = self.store.data[y_label].to_list()
-                children[idx]['props']['figure']['data'][0]['x'] = X
-                children[idx]['props']['figure']['data'][0]['y'] = y
-            return children
+        @self.metrics.timed('update_chart')
+        def update_chart(_, ids, session_id):
+            if self.chart_update_mode == 'extend' or not ids:
+                raise PreventUpdate
+            store = self.hub.session(session_id)
+            figures = []
+            for chart_id in ids:
+                chart = store.charts.get(chart_id['index'])
+                if not chart or chart['range'] or chart_version(chart) == chart['rendered']:
+                    figures.append(dash.no_update)
+                    continue
+                figures.append(draw_chart(session_id, chart_id['index']))
+            return figures
+
+        ##################################################################################
+        # delta mode: only send the points appended since each chart's cursor
+        # the browser keeps at most chart-max-points per trace
+        @app.callback(
+            Output({'type' : 'chart', 'index' : ALL}, 'extendData'),
+            Input('interval-component', 'n_intervals'),
+            State({'type' : 'chart', 'index' : ALL}, 'id'),
+            State('session-id', 'data')
+        )
+        @self.metrics.timed('extend_chart')
+        def extend_chart(_, ids, session_id):
+            if self.chart_update_mode != 'extend' or not ids:
+                raise PreventUpdate
+            store = self.hub.session(session_id)
+            updates = []
+            for chart_id in ids:
+                chart = store.charts.get(chart_id['index'])
+                if not chart or chart['range'] or chart_version(chart) <= chart['cursor']:
+                    # nothing was written to the chart's columns since its cursor
+                    updates.append(dash.no_update)
+                    continue
+                data, cursor = self.hub.buffer(*chart['source']).since(chart['cursor'], last=self.chart_max_points)
+                if cursor == chart['cursor'] or chart['x'] not in data or chart['y'] not in data:
+                    updates.append(dash.no_update)
+                    continue
+                chart['cursor'] = cursor
+                X, y = self.downsampler.apply(chart['type'], data[chart['x']], data[chart['y']])
+                updates.append([
+                    {'x' : [X.tolist()], 'y' : [y.tolist()]},
+                    [0],
+                    self.chart_max_points
+                ])
+            return updates
 
 
         ##############################
         #plot types
-        def draw_scatter(X,y):
-            return px.scatter(data_frame= self.store.data,x=X, y=y)
-        
-        def draw_line(X,y):
-            return px.line(data_frame=self.store.data, x=X, y=y)
-        
-        def draw_bar(X,y):
-            return px.bar(data_frame=self.store.data, x=X, y=y)
+        def chart_series(session_id, index):
+            # the whole buffer reduced to the point budget, cached per (chart, buffer version)
+            chart = self.hub.session(session_id).charts[index]
+            if chart['range']:
+                # history charts are drawn once from the memory mapped recording
+                now = time.time()
+                derive = chart['derive']
+                data = self.recordings.read(*chart['source'], start=now - chart['range'], end=now,
+                                            columns={chart['x'], derive['column'] if derive else chart['y']})
+                if derive and derive['column'] in data and chart['x'] in data:
+                    # aggregates aren't recorded, they are computed over the loaded range
+                    xs = data[chart['x']] if derive['agg'] == 'rate' else None
+                    data[chart['y']] = rolling(derive['agg'], derive['window'], xs, data[derive['column']])
+                if chart['x'] not in data or chart['y'] not in data:
+                    return np.empty(0), np.empty(0)
+                return self.downsampler.apply(chart['type'], data[chart['x']], data[chart['y']])
+            # copies, the downsampling runs outside the buffer lock while ingest overwrites the oldest rows
+            data, cursor = self.hub.buffer(*chart['source']).copy([chart['x'], chart['y']])
+            if chart['x'] not in data or chart['y'] not in data:
+                # the cursor stays, so the first extend brings the whole buffer once the columns exist
+                return np.empty(0), np.empty(0)
+            chart['cursor'] = cursor
+            return self.downsampler.apply(
+                chart['type'], data[chart['x']], data[chart['y']], key=(session_id, index), version=chart['cursor']
+            )
+
+        def chart_points(chart):
+            # live charts in extend mode grow up to chart-max-points in the browser
+            if not chart['range'] and self.chart_update_mode == 'extend':
+                return self.chart_max_points
+            return None
+
+        def chart_version(chart):
+            return self.hub.buffer(*chart['source']).version(chart['x'], chart['y'])
+
+        def draw_chart(session_id, index):
+            chart = self.hub.session(session_id).charts[index]
+            if not chart['range']:
+                chart['rendered'] = chart_version(chart)
+            X, y = chart_series(session_id, index)
+            device, topic = chart['source']
+            title = f'{self.hub.device_names.get(device, device)} / {topic}'
+            return self.figures.figure(
+                chart['type'], X, y, title, chart['x'], chart['y'], key=(session_id, index), points=chart_points(chart)
+            )
         ##############################
         
         ##############################
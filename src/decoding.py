@@ -0,0 +1,87 @@
+import json
+import threading
+
+#fastest json backend available, plain json is always there as a fallback
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    try:
+        import msgspec
+        loads = msgspec.json.Decoder().decode
+        JSON_BACKEND = 'msgspec'
+    except ImportError:
+        loads = json.loads
+        JSON_BACKEND = 'json'
+
+
+def _paths(data, prefix=()):
+    ''' key paths of all leaves and of all nested dicts in a payload, an empty dict has no leaves '''
+    leaves, dicts = [], [prefix]
+    for key, value in data.items():
+        if isinstance(value, dict):
+            sub_leaves, sub_dicts = _paths(value, prefix + (key,))
+            leaves += sub_leaves
+            dicts += sub_dicts
+        else:
+            leaves.append(prefix + (key,))
+    return leaves, dicts
+
+
+def compile_flattener(sample: dict):
+    '''
+    generate a function that flattens payloads shaped like sample into {'a.b.c' : value}.
+    the generated code checks the size of every nested dict, so any change in the
+    payload schema raises KeyError/TypeError and the flattener is learned again
+    '''
+    leaves, dicts = _paths(sample)
+    access = lambda path: 'd' + ''.join(f'[{key!r}]' for key in path)
+    checks = ' or '.join(f'len({access(path)}) != {len(_get(sample, path))}' for path in dicts)
+    fields = ', '.join(f"{'.'.join(map(str, path))!r} : {access(path)}" for path in leaves)
+    source = (
+        'def flatten(d):\n'
+        f'    if {checks}:\n'
+        '        raise KeyError("payload schema changed")\n'
+        f'    return {{{fields}}}\n'
+    )
+    namespace = {}
+    exec(compile(source, '<flattener>', 'exec'), namespace)
+    return namespace['flatten']
+
+
+def _get(data, path):
+    for key in path:
+        data = data[key]
+    return data
+
+
+'''
+decodes frames with the fastest backend and flattens nested message payloads.
+the payload schema of every topic is learned once, later payloads go through a
+compiled flattener so numeric leaves land in typed buffer columns
+'''
+class Decoder(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.backend = JSON_BACKEND
+        self._flatteners = {}
+        self._lock = threading.Lock()
+        self.schema_changes = 0
+
+    def loads(self, raw):
+        return loads(raw)
+
+    def flatten(self, key, data):
+        if not isinstance(data, dict):
+            return {'value' : data}
+        flatten = self._flatteners.get(key)
+        if flatten is not None:
+            try:
+                return flatten(data)
+            except (KeyError, TypeError):
+                self.schema_changes += 1
+        flatten = compile_flattener(data)
+        with self._lock:
+            self._flatteners[key] = flatten
+        return flatten(data)
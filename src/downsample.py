@@ -0,0 +1,105 @@
+import threading
+import numpy as np
+
+
+##############################
+# index selection, every function returns sorted indices into x/y
+def lttb(x, y, n):
+    ''' largest-triangle-three-buckets, keeps the visual shape of a line with n points '''
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    out = np.empty(n, dtype=int)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start, stop = edges[i], edges[i + 1]
+        nxt = slice(edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else slice(size - 1, size)
+        avg_x = x[nxt].mean()
+        avg_y = np.nanmean(y[nxt]) if not np.isnan(y[nxt]).all() else y[a]
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        out[i + 1] = a
+    return out
+
+
+def minmax(y, n):
+    ''' min and max of n/2 equally sized buckets, keeps spikes visible '''
+    size = len(y)
+    if n >= size or n < 2:
+        return np.arange(size)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, size, n // 2 + 1).astype(int)
+    low = np.where(np.isnan(y), np.inf, y)
+    high = np.where(np.isnan(y), -np.inf, y)
+    out = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            out.append(start + int(np.argmin(low[start:stop])))
+            out.append(start + int(np.argmax(high[start:stop])))
+    return np.unique(out)
+
+
+def stride(size, n):
+    if n >= size:
+        return np.arange(size)
+    return np.unique(np.linspace(0, size - 1, n).astype(int))
+
+
+def sample(size, n, seed=0):
+    if n >= size:
+        return np.arange(size)
+    return np.sort(np.random.default_rng(seed).choice(size, n, replace=False))
+##############################
+
+
+'''
+reduces every chart series to a point budget before it is serialized for the browser:
+LTTB for lines, min/max buckets for bars and stride or random sampling for scatter.
+results are cached per (chart, buffer version) so interval ticks without new data are free
+'''
+class Downsampler(object):
+    def __init__(self, budget: int = 2000, scatter: str = 'stride') -> None:
+        super().__init__()
+        self.budget = int(budget)
+        self.scatter = scatter
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def indices(self, chart_type, x, y, n=None):
+        n = n or self.budget
+        if len(y) <= n:
+            return np.arange(len(y))
+        if chart_type == 'Line':
+            # lttb needs numbers on both axes, text columns are thinned evenly
+            if x.dtype == object or y.dtype == object:
+                return stride(len(y), n)
+            return lttb(x, y, n)
+        if chart_type == 'Bar':
+            return minmax(y, n) if y.dtype != object else stride(len(y), n)
+        if self.scatter == 'random':
+            return sample(len(y), n)
+        return stride(len(y), n)
+
+    def apply(self, chart_type, x, y, key=None, version=None):
+        ''' downsampled copies of x and y, cached under key until version changes '''
+        if key is not None:
+            with self._lock:
+                cached = self._cache.get(key)
+            if cached and cached[0] == version:
+                return cached[1], cached[2]
+        idx = self.indices(chart_type, x, y)
+        xs, ys = x[idx], y[idx]
+        if key is not None:
+            with self._lock:
+                self._cache[key] = (version, xs, ys)
+        return xs, ys
+
+    def forget(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
@@ -0,0 +1,81 @@
+import csv
+import importlib.util
+import io
+
+#pyarrow is optional and enables the arrow export, it is slow to import so this only
+#looks it up, arrow_available() imports it on the first arrow export
+ARROW = importlib.util.find_spec('pyarrow') is not None
+pa = None
+
+
+def arrow_available():
+    ''' imports pyarrow once, False if it is missing or fails to import '''
+    global ARROW, pa
+    if pa is None and ARROW:
+        try:
+            import pyarrow
+            pa = pyarrow
+        except ImportError:
+            ARROW = False
+    return pa is not None
+
+
+#name of the column holding the time a row was received, next to the payload fields
+TIME_COLUMN = 'received_at'
+
+
+def _cells(values):
+    ''' one chunk of a column as python values, NaN / None become empty cells '''
+    return [None if value is None or value != value else value for value in values.tolist()]
+
+
+def iter_csv(timestamps, data, chunk_rows=10000):
+    ''' the snapshot as csv text, chunk_rows rows per yielded string '''
+    names = list(data)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow([TIME_COLUMN] + names)
+    for start in range(0, len(timestamps), chunk_rows):
+        stop = start + chunk_rows
+        columns = [timestamps[start:stop].tolist()] + [_cells(data[name][start:stop]) for name in names]
+        writer.writerows(zip(*columns))
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+
+def _arrow_column(values):
+    if values.dtype != object:
+        return pa.array(values, type=pa.float64(), from_pandas=True) # NaN -> null
+    return pa.array([None if value is None or value != value else str(value) for value in values.tolist()], type=pa.string())
+
+
+def iter_arrow(timestamps, data, chunk_rows=65536):
+    ''' the snapshot as an arrow IPC stream, one record batch per chunk_rows rows '''
+    if not arrow_available():
+        raise RuntimeError('the arrow export requires pyarrow')
+    names = [TIME_COLUMN] + list(data)
+    schema = pa.schema(
+        [(TIME_COLUMN, pa.float64())] +
+        [(name, pa.string() if values.dtype == object else pa.float64()) for name, values in data.items()]
+    )
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for start in range(0, max(len(timestamps), 1), chunk_rows):
+        stop = start + chunk_rows
+        arrays = [_arrow_column(timestamps[start:stop])] + [_arrow_column(values[start:stop]) for values in data.values()]
+        writer.write_batch(pa.record_batch(arrays, names=names))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+#format -> (chunk generator, mimetype, file extension)
+FORMATS = {
+    'csv' : (iter_csv, 'text/csv', 'csv'),
+    'arrow' : (iter_arrow, 'application/vnd.apache.arrow.stream', 'arrows'),
+}
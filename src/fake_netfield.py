@@ -0,0 +1,236 @@
+'''
+local stand-in for the netFIELD api, implements what NetFieldWebSocket uses:
+POST /auth, GET /auth/verify and GET /devices next to the websocket (hello, sub/unsub
+with base64 topic paths, message frames) on one port, with a load generator for
+the published data. point BASE_API_ENDPOINT at ws://localhost:6010/v1 to use it
+
+    python -m src.fake_netfield --devices 10 --rate 100 --fields 8 --drop-every 60
+'''
+import argparse
+import asyncio
+import base64
+import http
+import json
+import logging
+import random
+import time
+import uuid
+from typing import Optional
+import websockets
+from websockets.datastructures import Headers
+from websockets.legacy.http import read_headers, read_line
+from websockets.legacy.server import WebSocketServerProtocol
+from urllib.parse import parse_qs, urlsplit
+from .ws_netfield import api_urls
+
+
+def make_token(ttl):
+    ''' unsigned JWT-like token, NetFieldWebSocket reads the expiry from the exp claim '''
+    encode = lambda part: base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip('=')
+    claims = {'sub' : str(uuid.uuid4()), 'exp' : int(time.time() + ttl)}
+    return f"{encode({'alg' : 'none', 'typ' : 'JWT'})}.{encode(claims)}.fake"
+
+
+def make_payload(seq, fields=8, depth=1, strings=1):
+    ''' nested payload with `fields` numeric leaves spread over `depth` levels '''
+    payload = {'timestamp' : time.time(), 'seq' : seq}
+    for i in range(strings):
+        payload[f'status{i}' if i else 'status'] = 'ok' if seq % 10 else 'warn'
+    level = payload
+    for d in range(depth - 1):
+        level = level.setdefault(f'group{d}', {})
+    for i in range(fields):
+        level[f'value{i}'] = (seq % (i + 7)) + random.random()
+    return payload
+
+
+'''
+accepts the plain http requests of the REST api on the websocket port.
+websockets only parses GET requests, so the request line and body are read here
+and process_request answers everything that isn't a websocket upgrade
+'''
+class _Protocol(WebSocketServerProtocol):
+    method = 'GET'
+    body = b''
+
+    async def read_http_request(self):
+        request_line = await read_line(self.reader)
+        method, raw_path, _ = request_line.split(b' ', 2)
+        headers = await read_headers(self.reader)
+        self.method = method.decode()
+        length = int(headers.get('Content-Length', 0))
+        self.body = await self.reader.readexactly(length) if length else b''
+        self.path = raw_path.decode('ascii', 'surrogateescape')
+        self.request_headers = headers
+        return self.path, headers
+
+    async def process_request(self, path, headers):
+        # the server's handler also needs the method and body of this request
+        return await self._process_request(path, headers, self)
+
+
+class FakeNetField(object):
+    def __init__(self, host: str = 'localhost', port: int = 6010, devices: int = 10, rate: float = 10,
+                 fields: int = 8, depth: int = 1, strings: int = 1, drop_every: Optional[float] = None,
+                 token_ttl: float = 3600, latency: float = 0) -> None:
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.rate = rate # messages per second and subscription
+        self.shape = {'fields' : fields, 'depth' : depth, 'strings' : strings}
+        self.drop_every = drop_every # seconds between injected connection drops
+        self.token_ttl = token_ttl
+        self.latency = latency # seconds added to every REST response
+        self.requests = 0
+        self.devices = [{'id' : f'device-{i:05d}', 'name' : f'Device {i}'} for i in range(devices)]
+        self._device_ids = {device['id'] for device in self.devices}
+        self.tokens = {}
+        self.connections = set()
+        self.sent = 0
+        self.drops = 0
+        self._server = None
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}/v1'
+
+    async def start(self):
+        self._server = await websockets.serve(
+            self._handler, self.host, self.port, create_protocol=_Protocol, process_request=self._rest
+        )
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f'fake netFIELD listening on {self.url}')
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await asyncio.Future()
+        finally:
+            await self.stop()
+
+    ##############################
+    # REST
+    def _valid(self, token):
+        expiry = self.tokens.get(token)
+        return expiry is not None and expiry > time.time()
+
+    async def _rest(self, path, headers: Headers, request: _Protocol):
+        url = urlsplit(path)
+        if headers.get('Upgrade', '').lower() == 'websocket':
+            return None
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if url.path.endswith(api_urls['verification']):
+            if self._valid(headers.get('authorization')):
+                return self._json(http.HTTPStatus.OK, {'valid' : True})
+            return self._json(http.HTTPStatus.UNAUTHORIZED, {'error' : 'Unauthorized', 'message' : 'invalid or expired token'})
+        if url.path.endswith(api_urls['authentication']) and request.method == 'POST':
+            token = make_token(self.token_ttl)
+            self.tokens[token] = time.time() + self.token_ttl
+            return self._json(http.HTTPStatus.OK, {'accessToken' : token, 'expiresIn' : self.token_ttl})
+        if url.path.endswith(api_urls['Devices']):
+            if not self._valid(headers.get('authorization')):
+                return self._json(http.HTTPStatus.UNAUTHORIZED, {'error' : 'Unauthorized', 'message' : 'invalid or expired token'})
+            return self._json(http.HTTPStatus.OK, self._device_page(parse_qs(url.query)))
+        return self._json(http.HTTPStatus.NOT_FOUND, {'error' : 'Not Found', 'message' : url.path})
+
+    def _device_page(self, query):
+        ''' all devices without a limit, else the 1-based page of limit devices '''
+        limit = int(query.get('limit', [0])[0])
+        if not limit:
+            return {'devices' : self.devices}
+        page = max(1, int(query.get('page', [1])[0]))
+        return {
+            'devices' : self.devices[(page - 1) * limit : page * limit],
+            'pagination' : {'page' : page, 'limit' : limit, 'total' : len(self.devices)}
+        }
+
+    @staticmethod
+    def _json(status, body):
+        body = json.dumps(body).encode()
+        return status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))], body
+    ##############################
+
+    ##############################
+    # websocket
+    async def _handler(self, ws, path=None):
+        self.connections.add(ws)
+        subscriptions = {} # path -> publisher task
+        dropper = asyncio.ensure_future(self._drop_later(ws)) if self.drop_every else None
+        try:
+            hello = json.loads(await ws.recv())
+            token = hello.get('auth', {}).get('headers', {}).get('authorization')
+            if hello.get('type') != 'hello' or not self._valid(token):
+                await ws.send(json.dumps({'type' : 'error', 'id' : hello.get('id'), 'error' : 'Unauthorized'}))
+                return
+            await ws.send(json.dumps({'type' : 'hello', 'id' : hello.get('id'), 'version' : '2'}))
+            async for raw in ws:
+                msg = json.loads(raw)
+                reply = {'type' : msg.get('type'), 'id' : msg.get('id')}
+                topic_path = msg.get('path', '')
+                if msg.get('type') == 'sub':
+                    parts = topic_path.split('/')
+                    if len(parts) != 5 or parts[2] not in self._device_ids:
+                        reply.update(type='error', error=f'unknown path {topic_path}')
+                    elif topic_path not in subscriptions:
+                        subscriptions[topic_path] = asyncio.ensure_future(self._publish(ws, topic_path))
+                elif msg.get('type') == 'unsub':
+                    task = subscriptions.pop(topic_path, None)
+                    if task:
+                        task.cancel()
+                await ws.send(json.dumps(reply))
+        except (websockets.ConnectionClosed, ValueError):
+            pass
+        finally:
+            self.connections.discard(ws)
+            for task in subscriptions.values():
+                task.cancel()
+            if dropper:
+                dropper.cancel()
+
+    async def _publish(self, ws, topic_path):
+        ''' rate messages per second, sent in bursts of 10ms so high rates don't need one timer per frame '''
+        tick, seq, start = 0.01, 0, time.monotonic()
+        while True:
+            due = int((time.monotonic() - start) * self.rate)
+            while seq < due:
+                frame = {'type' : 'message', 'path' : topic_path, 'message' : {'data' : make_payload(seq, **self.shape)}}
+                await ws.send(json.dumps(frame))
+                self.sent += 1
+                seq += 1
+            await asyncio.sleep(tick)
+
+    async def _drop_later(self, ws):
+        # an abrupt network failure, the client sees the connection closed without a close frame
+        await asyncio.sleep(self.drop_every)
+        self.drops += 1
+        logging.info('dropping a connection')
+        ws.transport.abort()
+    ##############################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local fake netFIELD api and load generator')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6010)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=10, help='messages per second and subscription')
+    parser.add_argument('--fields', type=int, default=8, help='numeric fields per payload')
+    parser.add_argument('--depth', type=int, default=1, help='nesting depth of the numeric fields')
+    parser.add_argument('--strings', type=int, default=1, help='string fields per payload')
+    parser.add_argument('--drop-every', type=float, default=None, help='seconds until a connection is dropped')
+    parser.add_argument('--token-ttl', type=float, default=3600)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every REST response')
+    args = parser.parse_args()
+    server = FakeNetField(args.host, args.port, args.devices, args.rate, args.fields, args.depth,
+                          args.strings, args.drop_every, args.token_ttl, args.latency)
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,75 @@
+import functools
+import threading
+import numpy as np
+import plotly.io as pio
+
+
+@functools.lru_cache(maxsize=None)
+def _template(name):
+    # converting a template to json is expensive, every figure shares the result
+    return pio.templates[name].to_plotly_json()
+
+
+'''
+builds chart figures as plain plotly json straight from the buffer arrays, instead of
+going through plotly express and a DataFrame. the static part of a figure (layout,
+axes, template) is built once per chart and reused, redraws only replace the trace.
+lines and scatters switch from SVG to WebGL (scattergl) above webgl_threshold points
+'''
+class FigureFactory(object):
+    def __init__(self, webgl_threshold: int = 5000, template: str = 'plotly') -> None:
+        super().__init__()
+        self.webgl_threshold = int(webgl_threshold)
+        self.template = template
+        self._layouts = {}
+        self._lock = threading.Lock()
+
+    def layout(self, title, x_label, y_label, key=None):
+        if key is not None:
+            with self._lock:
+                layout = self._layouts.get(key)
+            if layout is not None:
+                return layout
+        layout = {
+            'title' : {'text' : title},
+            'xaxis' : {'title' : {'text' : x_label}},
+            'yaxis' : {'title' : {'text' : y_label}},
+            'legend' : {'tracegroupgap' : 0},
+            'margin' : {'t' : 60},
+            'template' : _template(self.template),
+        }
+        if key is not None:
+            with self._lock:
+                self._layouts[key] = layout
+        return layout
+
+    def trace(self, chart_type, x, y, x_label, y_label, points=None):
+        '''
+        one trace of the chart type, points is the number of points the trace will hold
+        (e.g. the extend limit of a live chart) and picks SVG or WebGL
+        '''
+        points = max(len(y), points or 0)
+        trace = {
+            'x' : np.asarray(x), 'y' : np.asarray(y),
+            'hovertemplate' : f'{x_label}=%{{x}}<br>{y_label}=%{{y}}<extra></extra>',
+        }
+        if chart_type == 'Bar':
+            # there is no WebGL bar trace, bars are reduced by the downsampler instead
+            trace.update(type='bar')
+        else:
+            trace.update(
+                type='scattergl' if points > self.webgl_threshold else 'scatter',
+                mode='lines' if chart_type == 'Line' else 'markers',
+            )
+        return trace
+
+    def figure(self, chart_type, x, y, title, x_label, y_label, key=None, points=None):
+        return {
+            'data' : [self.trace(chart_type, x, y, x_label, y_label, points)],
+            # the cached layout is shared, dash only serializes it
+            'layout' : self.layout(title, x_label, y_label, key),
+        }
+
+    def forget(self, key):
+        with self._lock:
+            self._layouts.pop(key, None)
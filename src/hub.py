@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from .buffer import RingBuffer
+
+
+'''
+shared broadcast hub between the upstream websocket and the browser sessions.
+every (device, topic) has one buffer and is subscribed upstream exactly once, no matter
+how many sessions view it; each session reads it through its own chart cursors.
+subscriptions are reference counted per session and dropped upstream when the last
+viewer leaves, the buffer then lets go of its data (but keeps its sequence numbers for
+the next viewer). sessions that stop sending heartbeats are released after a ttl
+'''
+class Hub(object):
+    def __init__(self, runtime, session_factory, max_rows=100000, max_age=None, buffer_factory=None) -> None:
+        super().__init__()
+        self.runtime = runtime
+        self.session_factory = session_factory
+        self.upstream = None # SubscriptionManager (or RemoteUpstream of the ingest worker)
+        self.max_rows = max_rows
+        self.max_age = max_age
+        # callable (device, topic) -> buffer, e.g. a view of the ingest worker's shared memory
+        self.buffer_factory = buffer_factory
+        self.buffers = {}  # (device, topic) -> RingBuffer
+        self.refs = {}     # (device, topic) -> set of session ids
+        self.sessions = {} # session id -> session state
+        self.device_names = {}
+        self._lock = threading.RLock()
+
+    def buffer(self, device, topic):
+        key = (device, topic)
+        if key not in self.buffers:
+            with self._lock:
+                if key not in self.buffers:
+                    if self.buffer_factory:
+                        self.buffers[key] = self.buffer_factory(device, topic)
+                    else:
+                        self.buffers[key] = RingBuffer(max_rows=self.max_rows, max_age=self.max_age)
+        return self.buffers[key]
+
+    ##############################
+    # sessions
+    def session(self, session_id):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = self.session_factory()
+            session.last_seen = time.time()
+            return session
+
+    def reap(self, ttl):
+        ''' release the sessions not seen for ttl seconds, returns them by session id '''
+        now = time.time()
+        with self._lock:
+            expired = {sid : session for sid, session in self.sessions.items() if now - session.last_seen > ttl}
+        for session_id in expired:
+            logging.info(f'session {session_id} expired')
+            self.release_all(session_id)
+            with self._lock:
+                self.sessions.pop(session_id, None)
+        return expired
+    ##############################
+
+    ##############################
+    # reference counted upstream subscriptions
+    def set_subscriptions(self, session_id, keys):
+        ''' make keys the exact set of (device, topic) the session views '''
+        keys = set(keys)
+        session = self.session(session_id)
+        for key in session.subscriptions - keys:
+            self.release(session_id, key)
+        for key in keys - session.subscriptions:
+            self.acquire(session_id, key)
+
+    def acquire(self, session_id, key):
+        with self._lock:
+            viewers = self.refs.setdefault(key, set())
+            first = not viewers
+            viewers.add(session_id)
+            self.session(session_id).subscriptions.add(key)
+            if first and not self.buffer_factory and key in self.buffers:
+                # re-subscribed before the old rows were dropped, they don't connect to the new ones
+                self.buffers[key].mark_gap()
+        if first and self.upstream:
+            self.runtime.submit(self.upstream.subscribe(*key))
+        return first
+
+    def release(self, session_id, key):
+        with self._lock:
+            viewers = self.refs.get(key, set())
+            viewers.discard(session_id)
+            session = self.sessions.get(session_id)
+            if session:
+                session.subscriptions.discard(key)
+            last = key in self.refs and not viewers
+            if last:
+                del self.refs[key]
+        if last:
+            if self.upstream:
+                self.runtime.submit(self._unsubscribe(key))
+            else:
+                self._drop(key)
+        return last
+
+    def release_all(self, session_id):
+        session = self.sessions.get(session_id)
+        if session:
+            for key in list(session.subscriptions):
+                self.release(session_id, key)
+
+    def active(self):
+        with self._lock:
+            return list(self.refs.keys())
+
+    async def _unsubscribe(self, key):
+        # no frame is routed to the buffer once the upstream unsubscribe started
+        await self.upstream.unsubscribe(*key)
+        self._drop(key)
+
+    def _drop(self, key):
+        with self._lock:
+            buffer = self.buffers.get(key)
+            if buffer is None or key in self.refs:
+                return
+            if self.buffer_factory:
+                # a view only maps the ingest worker's memory
+                buffer.detach()
+            else:
+                buffer.clear()
+    ##############################
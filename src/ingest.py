@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import websockets
+from .ws_netfield import NetFieldWebSocket
+from .subscriptions import SubscriptionManager
+from .shared import SharedRingBuffer, shm_name
+from .recorder import Recorder
+
+
+'''
+out-of-process ingestion (ingest-mode "process"): one worker process owns the
+upstream NetFieldWebSocket and writes every (device, topic) into a SharedRingBuffer,
+any number of dash worker processes read the same memory through SharedRingView.
+the dash processes talk to the worker over a small json websocket on ingest-port:
+    {"type": "auth", "token", "endpoint"}    token of the dashboard login
+    {"type": "sub" | "unsub", "device", "topic"}
+    {"type": "derive", "device", "topic", "agg", "column", "window", "x"}
+subscriptions are reference counted per control connection and released when it
+closes, the worker answers with a "stats" message every second
+
+    python -m src.ingest
+'''
+class IngestWorker(object):
+    def __init__(self, nf: NetFieldWebSocket, host: str = '127.0.0.1', port: int = 6009,
+                 prefix: str = 'netfield', stats_interval: float = 1) -> None:
+        super().__init__()
+        self.nf = nf
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.stats_interval = stats_interval
+        self.buffers = {} # (device, topic) -> SharedRingBuffer
+        self.holders = {} # (device, topic) -> set of control connections
+        self.subscriptions = SubscriptionManager(nf, self.buffer)
+        self.recorder = None
+        if nf.recording_dir:
+            self.recorder = Recorder(
+                nf.recording_dir, flush=nf.recording_flush,
+                segment_bytes=nf.recording_segment_bytes, segment_age=nf.recording_segment_age,
+                retain_bytes=nf.recording_retain_bytes, retain_age=nf.recording_retain_age
+            )
+            self.subscriptions.sinks.append(self.recorder.write)
+
+    def buffer(self, device, topic):
+        key = (device, topic)
+        if key not in self.buffers:
+            self.buffers[key] = SharedRingBuffer(
+                shm_name(self.prefix, device, topic), self.nf.buffer_max_rows, self.nf.buffer_max_age
+            )
+        return self.buffers[key]
+
+    def stats(self):
+        nf, subs = self.nf, self.subscriptions
+        return dict(
+            subs.stats(), type='stats', received=nf.received, decode_seconds=nf.decode_seconds,
+            last_message=subs.last_message, pid=os.getpid()
+        )
+
+    async def run(self):
+        ''' serve the control channel and ingest until cancelled '''
+        if self.recorder:
+            self.recorder.start()
+        try:
+            async with websockets.serve(self._control, self.host, self.port):
+                logging.info(f'ingest worker listening on {self.host}:{self.port}')
+                await self.subscriptions.run()
+        finally:
+            if self.recorder:
+                self.recorder.stop()
+            for buffer in self.buffers.values():
+                buffer.close()
+            await self.nf.aclose()
+
+    async def _control(self, ws, path=None):
+        held = set()
+        sender = asyncio.ensure_future(self._send_stats(ws))
+        try:
+            async for raw in ws:
+                try:
+                    msg = json.loads(raw)
+                    await self._command(msg, held)
+                except Exception as ex:
+                    logging.error(f'ingest control message failed: {ex}')
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            for key in held:
+                await self._release(id(held), key)
+
+    async def _command(self, msg, held):
+        kind = msg.get('type')
+        if kind == 'auth':
+            if msg.get('endpoint'):
+                self.nf.BASE_API_ENDPOINT = msg['endpoint']
+            if msg.get('token'):
+                self.nf.token = msg['token']
+                self.nf.auth['headers'] = {'authorization' : self.nf.token}
+            return
+        key = (msg['device'], msg['topic'])
+        if kind == 'sub':
+            if key not in held:
+                held.add(key)
+                self.holders.setdefault(key, set()).add(id(held))
+                # the buffer exists before the first frame, so readers attach right away
+                self.buffer(*key)
+                await self.subscriptions.subscribe(*key)
+        elif kind == 'unsub':
+            if key in held:
+                held.discard(key)
+                await self._release(id(held), key)
+        elif kind == 'derive':
+            self.buffer(*key).derive(msg['agg'], msg['column'], msg['window'], msg.get('x'))
+
+    async def _release(self, holder, key):
+        holders = self.holders.get(key, set())
+        holders.discard(holder)
+        if not holders:
+            self.holders.pop(key, None)
+            await self.subscriptions.unsubscribe(*key)
+
+    async def _send_stats(self, ws):
+        try:
+            while True:
+                await ws.send(json.dumps(self.stats()))
+                await asyncio.sleep(self.stats_interval)
+        except websockets.ConnectionClosed:
+            pass
+
+
+'''
+the dashboard side of the ingest worker, takes the place of the SubscriptionManager:
+the hub sends its reference counted subs/unsubs here and run() (the dashboard's
+netfield collector) keeps the control connection, re-sends the subscriptions and
+derived columns after a reconnect and polls the sequence counters of the viewed
+buffers to notify the listeners (the push channel) about new rows.
+the worker's counters are mirrored from its stats messages
+'''
+class RemoteUpstream(object):
+    def __init__(self, nf: NetFieldWebSocket, buffer_for, url: str, poll: float = 0.1) -> None:
+        super().__init__()
+        self.nf = nf
+        self.buffer_for = buffer_for # callable (device, topic) -> SharedRingView
+        self.url = url
+        self.poll = poll
+        self.active = set()
+        self.derived = set() # (device, topic, agg, column, window, x)
+        self.listeners = []
+        self.sinks = [] # rows are recorded by the worker
+        self.worker = {} # last stats message of the worker
+        self.reconnects = 0
+        self._ws = None
+        self._auth = None
+        self._seqs = {}
+
+    @property
+    def connected(self):
+        ''' the worker is reachable and connected upstream '''
+        return self._ws is not None and self.worker.get('connected', False)
+
+    @property
+    def dropped(self):
+        return self.worker.get('dropped', 0)
+
+    @property
+    def last_message(self):
+        return self.worker.get('last_message')
+
+    # frame counters, read by the metrics in place of the NetFieldWebSocket's own
+    @property
+    def received(self):
+        return self.worker.get('received', 0)
+
+    @property
+    def undecodable(self):
+        return self.worker.get('undecodable', 0)
+
+    @property
+    def decode_seconds(self):
+        return self.worker.get('decode_seconds', 0)
+
+    async def subscribe(self, device: str, topic: str):
+        self.active.add((device, topic))
+        return await self._send({'type' : 'sub', 'device' : device, 'topic' : topic})
+
+    async def unsubscribe(self, device: str, topic: str):
+        self.active.discard((device, topic))
+        self._seqs.pop((device, topic), None)
+        return await self._send({'type' : 'unsub', 'device' : device, 'topic' : topic})
+
+    async def derive(self, device, topic, agg, column, window, x=None):
+        self.derived.add((device, topic, agg, column, window, x))
+        return await self._send({
+            'type' : 'derive', 'device' : device, 'topic' : topic,
+            'agg' : agg, 'column' : column, 'window' : window, 'x' : x
+        })
+
+    def stats(self):
+        return dict(self.worker, subscriptions=len(self.active))
+
+    async def _send(self, msg):
+        ws = self._ws
+        if ws is None:
+            # sent by run() once connected
+            return False
+        try:
+            token = (self.nf.token, self.nf.BASE_API_ENDPOINT)
+            if token != self._auth:
+                # the worker connects upstream with the token of the dashboard login
+                self._auth = token
+                await ws.send(json.dumps({'type' : 'auth', 'token' : token[0], 'endpoint' : token[1]}))
+            await ws.send(json.dumps(msg))
+            return True
+        except websockets.ConnectionClosed:
+            return False
+
+    async def run(self):
+        delay = self.nf.reconnect_min_delay
+        connected_before = False
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    self._ws, self._auth = ws, None
+                    if connected_before:
+                        self.reconnects += 1
+                    connected_before = True
+                    delay = self.nf.reconnect_min_delay
+                    # a restarted worker created new memory, attach again
+                    for key in list(self.active):
+                        self.buffer_for(*key).detach()
+                        await self._send({'type' : 'sub', 'device' : key[0], 'topic' : key[1]})
+                    for device, topic, agg, column, window, x in list(self.derived):
+                        if (device, topic) in self.active:
+                            await self.derive(device, topic, agg, column, window, x)
+                    watcher = asyncio.ensure_future(self._watch())
+                    try:
+                        async for raw in ws:
+                            msg = json.loads(raw)
+                            if msg.get('type') == 'stats':
+                                self.worker = msg
+                    finally:
+                        watcher.cancel()
+            except (OSError, websockets.WebSocketException) as ex:
+                logging.warning(f'ingest worker at {self.url} unreachable: {ex}')
+            finally:
+                self._ws = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.nf.reconnect_max_delay)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll)
+            changed = []
+            for key in list(self.active):
+                seq = self.buffer_for(*key).version()
+                if seq != self._seqs.get(key):
+                    self._seqs[key] = seq
+                    changed.append(key)
+            if changed:
+                for listener in self.listeners:
+                    try:
+                        listener(changed)
+                    except Exception as ex:
+                        logging.error(ex)
+
+
+async def main(host=None, port=None):
+    nf = NetFieldWebSocket()
+    if not nf.token and nf.email and nf.password:
+        await nf.login()
+    worker = IngestWorker(nf, host or nf.ingest_host, port or nf.ingest_port, nf.ingest_shm_prefix)
+    try:
+        # shut down (and unlink the shared memory) on SIGTERM as well
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+    try:
+        await worker.run()
+    except asyncio.CancelledError:
+        logging.info('ingest worker stopped')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='netFIELD ingest worker writing to shared memory')
+    parser.add_argument('--host', default=None, help='control channel host (ingest-host)')
+    parser.add_argument('--port', type=int, default=None, help='control channel port (ingest-port)')
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
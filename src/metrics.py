@@ -0,0 +1,184 @@
+import bisect
+import functools
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    return repr(float(value))
+
+
+def rss_bytes():
+    ''' resident memory of this process, None where there is no procfs '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def process_start_time():
+    ''' start of this process in seconds since the epoch, None where there is no procfs '''
+    try:
+        with open('/proc/self/stat') as f:
+            # the fields after the command name, which may contain spaces
+            ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        super().__init__()
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label items -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            # le is inclusive, values above the last bound land in the +Inf slot
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def samples(self, name):
+        with self._lock:
+            series = {key : list(values) for key, values in self._series.items()}
+        for key, values in series.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values[:-1]):
+                cumulative += count
+                yield f'{name}_bucket', dict(labels, le='+Inf' if bound == math.inf else repr(bound)), cumulative
+            yield f'{name}_count', labels, cumulative
+            yield f'{name}_sum', labels, values[-1]
+
+
+'''
+registry rendered in the prometheus text format on /metrics.
+hot path values stay plain attributes of their owners (NetFieldWebSocket,
+SubscriptionManager, RingBuffer ...) and are only read by the collect functions
+when the endpoint is scraped, histograms are observed directly
+'''
+class Metrics(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self._metrics = {} # name -> (type, help, collect or Histogram)
+
+    def counter(self, name, help, collect):
+        ''' collect() returns a value or a list of (labels, value) '''
+        self._metrics[name] = ('counter', help, collect)
+
+    def gauge(self, name, help, collect):
+        self._metrics[name] = ('gauge', help, collect)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        if name not in self._metrics:
+            self._metrics[name] = ('histogram', help, Histogram(buckets))
+        return self._metrics[name][2]
+
+    def timed(self, name, **labels):
+        ''' decorator observing the run time of a callback in the dashboard_callback_seconds histogram '''
+        histogram = self.histogram('dashboard_callback_seconds', 'dash callback latency')
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, callback=name, **labels)
+            return wrapper
+        return decorator
+
+    def render(self):
+        lines = []
+        for name, (kind, help, collect) in self._metrics.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'histogram':
+                lines += [f'{sample}{_labels(labels)} {_value(value)}' for sample, labels, value in collect.samples(name)]
+                continue
+            try:
+                value = collect()
+            except Exception:
+                value = None
+            series = value if isinstance(value, list) else [({}, value)]
+            lines += [f'{name}{_labels(labels)} {_value(value)}' for labels, value in series]
+        return '\n'.join(lines) + '\n'
+
+
+'''
+opt-in sampling profiler, a background thread records the python stack of every
+other thread each interval seconds. folded() returns the stacks in the collapsed
+format of flamegraph.pl / speedscope, one "thread;frame;frame count" per line
+'''
+class SamplingProfiler(object):
+    def __init__(self, interval: float = 0.005) -> None:
+        super().__init__()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self.stacks.clear()
+            self.samples = 0
+            self.started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+        self._thread = None
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident : thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+import websockets
+
+
+'''
+pushes "new data" notifications to the browsers over a websocket,
+so charts are refreshed when data arrives instead of on a fixed poll.
+notifications are coalesced: at most one message per window, and none at all
+while no new batches arrive. runs on the dashboard's AsyncRuntime loop
+'''
+class PushHub(object):
+    def __init__(self, host: str = '0.0.0.0', port: int = 6008, window: float = 0.1) -> None:
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.window = window
+        self.clients = set()
+        self.sent = 0
+        self._server = None
+        self._loop : Optional[asyncio.AbstractEventLoop] = None
+        self._scheduled = False
+        self._updated = set()
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    async def start(self):
+        if self._server is None:
+            self._loop = asyncio.get_running_loop()
+            self._server = await websockets.serve(self._handler, self.host, self.port)
+            logging.info(f'push channel listening on {self.host}:{self.port}')
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handler(self, ws, path=None):
+        self.clients.add(ws)
+        try:
+            await ws.wait_closed()
+        finally:
+            self.clients.discard(ws)
+
+    def notify(self, keys=()):
+        ''' called for every ingested batch, may be called from any thread '''
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._mark, tuple(keys))
+
+    def _mark(self, keys):
+        self._updated.update(keys)
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_later(self.window, self._flush)
+
+    def _flush(self):
+        self._scheduled = False
+        if not self.clients:
+            self._updated.clear()
+            return
+        self.sent += 1
+        msg = json.dumps({
+            'type' : 'data',
+            'seq' : self.sent,
+            'sources' : [list(key) for key in self._updated]
+        })
+        self._updated.clear()
+        websockets.broadcast(self.clients, msg)
@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Optional
+from urllib.parse import quote, unquote
+import numpy as np
+from .buffer import _is_number
+
+
+META = 'segment.json'
+TIME = '_time.f8'
+
+
+def _source_dir(root, device, topic):
+    return os.path.join(root, quote(device, safe=''), quote(topic, safe=''))
+
+
+def _save_json(path, data):
+    # readers only trust the meta file, so it is replaced atomically after the data is written
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+'''
+one append-only segment of a (device, topic) recording.
+numeric columns are raw little-endian float64 files (.f8), anything else is one json
+document per line (.jsonl); _time.f8 holds the ingest time of every row and
+segment.json the row count, time span, column kinds and the file of every column
+(payload keys are quoted, they may contain anything)
+'''
+class Segment(object):
+    def __init__(self, path, meta=None) -> None:
+        super().__init__()
+        self.path = path
+        self.meta = meta or {'start' : None, 'end' : None, 'rows' : 0, 'columns' : {}, 'files' : {}}
+
+    @classmethod
+    def create(cls, directory, start):
+        path = os.path.join(directory, f'{int(start * 1000):015d}')
+        os.makedirs(path, exist_ok=True)
+        return cls(path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, META)) as f:
+            return cls(path, json.load(f))
+
+    @property
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+
+    def accepts(self, columns):
+        kinds = self.meta['columns']
+        return all(kinds.get(name, kind) == kind for name, (kind, _) in columns.items())
+
+    def file(self, name):
+        ''' path of a column file, segments written before the file table use the plain name '''
+        kind = self.meta['columns'][name]
+        return os.path.join(self.path, self.meta.get('files', {}).get(name, f'{name}.{kind}'))
+
+    def append(self, times, columns):
+        rows, count = self.meta['rows'], len(times)
+        # the meta only changes once every file was appended to
+        kinds = dict(self.meta['columns'])
+        files = dict(self.meta.get('files', {}))
+        sizes = {} # path -> size before this append, None for new files
+        try:
+            for name, (kind, values) in columns.items():
+                if name not in kinds:
+                    kinds[name] = kind
+                    files[name] = f'{len(kinds)}_{quote(name, safe="")[:100]}.{kind}'
+                    self._pad(files[name], kind, rows, sizes)
+                self._write(files.get(name, f'{name}.{kind}'), kind, values, sizes)
+            for name, kind in kinds.items():
+                if name not in columns:
+                    self._pad(files.get(name, f'{name}.{kind}'), kind, count, sizes)
+            self._write(TIME, 'f8', times, sizes)
+        except Exception:
+            self._rollback(sizes)
+            raise
+        self.meta['columns'], self.meta['files'] = kinds, files
+        if self.meta['start'] is None:
+            self.meta['start'] = float(times[0])
+        self.meta['end'] = float(times[-1])
+        self.meta['rows'] = rows + count
+        _save_json(os.path.join(self.path, META), self.meta)
+
+    def _write(self, file, kind, values, sizes):
+        path = os.path.join(self.path, file)
+        if path not in sizes:
+            sizes[path] = os.path.getsize(path) if os.path.exists(path) else None
+        if kind == 'f8':
+            with open(path, 'ab') as f:
+                f.write(np.asarray(values, dtype='<f8').tobytes())
+        else:
+            with open(path, 'a') as f:
+                f.writelines(json.dumps(value, default=str) + '\n' for value in values)
+
+    def _pad(self, file, kind, count, sizes):
+        if count:
+            self._write(file, kind, [np.nan if kind == 'f8' else None] * count, sizes)
+
+    def _rollback(self, sizes):
+        # cut every file back to its rows before the failed append
+        for path, size in sizes.items():
+            try:
+                if size is None:
+                    os.remove(path)
+                else:
+                    os.truncate(path, size)
+            except OSError as ex:
+                logging.error(f'rolling back {path} failed: {ex}')
+
+
+'''
+optional recorder stage of the ingest path.
+write() only queues the rows of an ingested batch, a writer thread groups them per
+(device, topic) and appends columnar batches to the current segment every flush
+seconds. segments are rotated by size and age and removed by the retention limits.
+the queue holds at most max_queue batches, when the disk can't keep up batches are
+dropped (and counted) rather than blocking ingest or growing without bound
+'''
+class Recorder(object):
+    def __init__(self, directory, flush: float = 1.0, segment_bytes: int = 64 << 20,
+                 segment_age: float = 3600, retain_bytes: Optional[int] = 1 << 30,
+                 retain_age: Optional[float] = 7 * 86400, max_queue: int = 10000) -> None:
+        super().__init__()
+        self.directory = directory
+        self.flush = flush
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.retain_bytes = retain_bytes
+        self.retain_age = retain_age
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._dropping = False
+        self._current = {} # (device, topic) -> Segment
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='netfield-recorder', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def write(self, key, rows):
+        ''' ingest path hook, O(1): the rows are written by the recorder thread '''
+        try:
+            self._queue.put_nowait((key, rows, time.time()))
+            self._dropping = False
+        except queue.Full:
+            self.rows_dropped += len(rows)
+            if not self._dropping:
+                self._dropping = True
+                logging.warning('recorder queue full, dropping batches until it catches up')
+
+    ##############################
+    # writer thread
+    def _run(self):
+        pending = {}
+        deadline = time.monotonic() + self.flush
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                if item is None:
+                    running = False
+                else:
+                    key, rows, now = item
+                    batch = pending.setdefault(key, ([], []))
+                    batch[0].extend(rows)
+                    batch[1].extend([now] * len(rows))
+            except queue.Empty:
+                pass
+            if not running or time.monotonic() >= deadline:
+                for key, (rows, times) in pending.items():
+                    try:
+                        self._append(key, rows, times)
+                    except Exception as ex:
+                        logging.error(f'recording {key} failed: {ex}')
+                pending = {}
+                self._retain()
+                deadline = time.monotonic() + self.flush
+
+    def _append(self, key, rows, times):
+        columns = {}
+        for name in dict.fromkeys(name for row in rows for name in row):
+            values = [row.get(name) for row in rows]
+            numeric = all(value is None or _is_number(value) for value in values)
+            if numeric:
+                values = [np.nan if value is None else value for value in values]
+            columns[name] = ('f8' if numeric else 'jsonl', values)
+        segment = self._current.get(key)
+        if segment is None or not segment.accepts(columns) or self._full(segment, times[0]):
+            segment = self._current[key] = Segment.create(_source_dir(self.directory, *key), times[0])
+        segment.append(times, columns)
+        self.rows_written += len(rows)
+
+    def _full(self, segment, now):
+        start = segment.meta['start']
+        too_old = start is not None and now - start >= self.segment_age
+        return too_old or segment.size >= self.segment_bytes
+
+    def _retain(self):
+        if not self.retain_bytes and not self.retain_age:
+            return
+        current = {segment.path for segment in self._current.values()}
+        segments = sorted(
+            (segment for segment in RecordingReader(self.directory).all_segments() if segment.path not in current),
+            key=lambda segment: segment.meta['end'] or 0
+        )
+        total = sum(segment.size for segment in segments) + sum(s.size for s in self._current.values())
+        cutoff = time.time() - self.retain_age if self.retain_age else None
+        for segment in segments:
+            expired = cutoff is not None and (segment.meta['end'] or 0) < cutoff
+            if not expired and (not self.retain_bytes or total <= self.retain_bytes):
+                break
+            total -= segment.size
+            shutil.rmtree(segment.path, ignore_errors=True)
+    ##############################
+
+
+'''
+reads recordings back through memory maps, numeric columns of a time range are
+views into the segment files (only ranges spanning several segments are copied)
+'''
+class RecordingReader(object):
+    def __init__(self, directory) -> None:
+        super().__init__()
+        self.directory = directory
+
+    def sources(self):
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for device in sorted(os.listdir(self.directory)):
+            device_dir = os.path.join(self.directory, device)
+            if os.path.isdir(device_dir):
+                found += [(unquote(device), unquote(topic)) for topic in sorted(os.listdir(device_dir))]
+        return found
+
+    def segments(self, device, topic):
+        directory = _source_dir(self.directory, device, topic)
+        if not os.path.isdir(directory):
+            return []
+        segments = []
+        for name in sorted(os.listdir(directory)):
+            try:
+                segments.append(Segment.load(os.path.join(directory, name)))
+            except (OSError, ValueError):
+                continue # not flushed yet or being removed
+        return segments
+
+    def columns(self, device, topic):
+        return list(dict.fromkeys(name for segment in self.segments(device, topic) for name in segment.meta['columns']))
+
+    def all_segments(self):
+        return [segment for source in self.sources() for segment in self.segments(*source)]
+
+    def read(self, device, topic, start: Optional[float] = None, end: Optional[float] = None, columns=None):
+        ''' columns (and _time) of the rows recorded between start and end '''
+        parts = []
+        for segment in self.segments(device, topic):
+            meta = segment.meta
+            if not meta['rows'] or (start is not None and meta['end'] < start) or (end is not None and meta['start'] > end):
+                continue
+            parts.append(self._read_segment(segment, start, end, columns))
+        names = dict.fromkeys(name for part in parts for name in part)
+        data = {}
+        for name in names:
+            arrays = [part.get(name) for part in parts]
+            if len(arrays) == 1:
+                data[name] = arrays[0]
+                continue
+            kind = object if any(arr is not None and arr.dtype == object for arr in arrays) else float
+            filled = [
+                arr if arr is not None else np.full(len(part['_time']), np.nan if kind is float else None, dtype=kind)
+                for arr, part in zip(arrays, parts)
+            ]
+            data[name] = np.concatenate(filled).astype(kind, copy=False)
+        return data
+
+    def _read_segment(self, segment, start, end, columns):
+        rows = segment.meta['rows']
+        times = np.memmap(os.path.join(segment.path, TIME), dtype='<f8', mode='r', shape=(rows,))
+        first = int(np.searchsorted(times, start, side='left')) if start is not None else 0
+        last = int(np.searchsorted(times, end, side='right')) if end is not None else rows
+        part = {'_time' : times[first:last]}
+        for name, kind in segment.meta['columns'].items():
+            if columns is not None and name not in columns:
+                continue
+            if kind == 'f8':
+                arr = np.memmap(segment.file(name), dtype='<f8', mode='r', shape=(rows,))
+                part[name] = arr[first:last]
+            else:
+                values = np.empty(last - first, dtype=object)
+                with open(segment.file(name)) as f:
+                    for i, line in enumerate(f):
+                        if i >= last:
+                            break
+                        if i >= first:
+                            values[i - first] = json.loads(line)
+                part[name] = values
+        return part
@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+import numpy as np
+from .aggregates import _floats
+
+
+RULE_TYPES = ('threshold', 'rate', 'missing')
+
+
+def _check(rule):
+    ''' a copy of the rule with its defaults, ValueError if it can't be evaluated '''
+    rule = dict(rule)
+    kind = rule.get('type')
+    if kind not in RULE_TYPES:
+        raise ValueError(f'rule type must be one of {", ".join(RULE_TYPES)}: {rule}')
+    if kind != 'missing' and not rule.get('column'):
+        raise ValueError(f'{kind} rule without a column: {rule}')
+    if kind == 'threshold':
+        if rule.get('min') is None and rule.get('max') is None:
+            raise ValueError(f'threshold rule without min or max: {rule}')
+        for bound in ('min', 'max'):
+            if rule.get(bound) is not None:
+                rule[bound] = float(rule[bound])
+    elif kind == 'rate':
+        rule['limit'] = float(rule['limit'])
+    else:
+        rule['seconds'] = float(rule['seconds'])
+    rule.setdefault('name', f"{kind} {rule.get('column') or 'any field'}")
+    return rule
+
+
+def _applies(rule, key):
+    device, topic = key
+    return rule.get('device', '*') in ('*', device) and rule.get('topic', '*') in ('*', topic)
+
+
+class _Source(object):
+    '''
+    the rules that apply to one (device, topic), compiled into index arrays over the
+    matrix of the columns they read, and their state (active flags, last samples)
+    '''
+    def __init__(self, rules, now) -> None:
+        super().__init__()
+        self.rules = {kind : [rule for rule in rules if rule['type'] == kind] for kind in RULE_TYPES}
+        thresholds, rates, missing = (self.rules[kind] for kind in RULE_TYPES)
+        pairs = list(dict.fromkeys((rule['column'], rule.get('x')) for rule in rates))
+        self.columns = list(dict.fromkeys(
+            [rule['column'] for rule in thresholds] + [column for pair in pairs for column in pair if column] +
+            [rule['column'] for rule in missing if rule.get('column')]
+        ))
+        index = {column : i for i, column in enumerate(self.columns)}
+        self.t_column = np.array([index[rule['column']] for rule in thresholds], dtype=int)
+        self.low = np.array([-np.inf if rule.get('min') is None else rule['min'] for rule in thresholds])
+        self.high = np.array([np.inf if rule.get('max') is None else rule['max'] for rule in thresholds])
+        # rates are computed once per (column, x) pair
+        self.r_pair = np.array([pairs.index((rule['column'], rule.get('x'))) for rule in rates], dtype=int)
+        self.limit = np.array([rule['limit'] for rule in rates])
+        self.pair_y = np.array([index[column] for column, _ in pairs], dtype=int)
+        self.pair_x = np.array([index[x] if x else 0 for _, x in pairs], dtype=int)
+        self.has_x = np.array([bool(x) for _, x in pairs], dtype=bool)
+        self.last_y = np.full(len(pairs), np.nan)
+        self.last_x = np.full(len(pairs), np.nan)
+        # a source counts as seen from the first time it was evaluated
+        self.m_column = np.array([index[rule['column']] if rule.get('column') else -1 for rule in missing], dtype=int) # -1: any column
+        self.seconds = np.array([rule['seconds'] for rule in missing])
+        self.last_seen = np.full(len(missing), now)
+        self.active = {kind : np.zeros(len(rules), dtype=bool) for kind, rules in self.rules.items()}
+
+
+'''
+alert rules, evaluated on every ingested batch (the engine is a listener of the
+subscription manager) with vectorized comparisons against the new rows of the buffer:
+the columns the rules read are stacked into one (rows x columns) matrix, all
+thresholds are one (rows x rules) comparison and all rates one forward filled diff,
+whatever the number of rules or columns. "missing" rules are checked by run().
+rules fire once when they are breached and clear once the values are back, both
+are appended to the event list
+    {"name": "hot", "type": "threshold", "column": "sensor.temp", "min": 0, "max": 80}
+    {"name": "jump", "type": "rate", "column": "sensor.temp", "limit": 5, "x": "timestamp"}
+    {"name": "silent", "type": "missing", "column": "sensor.temp", "seconds": 30}
+rate limits |dy| per sample, or |dy/dx| with x. device / topic restrict a rule to a source
+'''
+class RuleEngine(object):
+    def __init__(self, buffer_for, rules=(), max_events: int = 1000) -> None:
+        super().__init__()
+        self.buffer_for = buffer_for # callable (device, topic) -> RingBuffer
+        self.rules = []
+        self.evaluated_rows = 0
+        self.evaluate_seconds = 0.0
+        self._events = deque(maxlen=max_events)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._sources = {} # (device, topic) -> _Source
+        self._cursors = {} # (device, topic) -> buffer seq evaluated up to
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        checked = [_check(rule) for rule in rules or ()]
+        with self._lock:
+            self.rules = checked
+            self._sources = {}
+
+    ##############################
+    # event list
+    def events(self, since: int = 0):
+        ''' events with an id above since, oldest first '''
+        with self._lock:
+            return [event for event in self._events if event['id'] > since]
+
+    @property
+    def last_event(self):
+        with self._lock:
+            return self._events[-1]['id'] if self._events else 0
+
+    def _emit(self, rule, key, state, value):
+        if rule['type'] == 'threshold':
+            low, high = rule.get('min'), rule.get('max')
+            bounds = f"{'-inf' if low is None else f'{low:g}'}, {'inf' if high is None else f'{high:g}'}"
+            detail = f"{rule['column']} = {value:g}, allowed [{bounds}]"
+        elif rule['type'] == 'rate':
+            detail = f"{rule['column']} changed by {value:g} per {rule.get('x') or 'sample'}, limit {rule['limit']:g}"
+        else:
+            detail = f"no {rule.get('column') or 'data'} for {value:.0f}s, limit {rule['seconds']:g}s"
+        event = {
+            'time' : time.time(), 'rule' : rule['name'], 'type' : rule['type'], 'state' : state,
+            'device' : key[0], 'topic' : key[1], 'column' : rule.get('column'), 'value' : float(value),
+            'message' : f"{rule['name']} {'breached' if state == 'breach' else 'cleared'}: {detail}",
+        }
+        with self._lock:
+            event['id'] = next(self._ids)
+            self._events.append(event)
+        if state == 'breach':
+            logging.warning(f'{key[0]} / {key[1]}: {event["message"]}')
+    ##############################
+
+    ##############################
+    # evaluation
+    def source(self, key, now=None):
+        source = self._sources.get(key)
+        if source is None:
+            rules = [rule for rule in self.rules if _applies(rule, key)]
+            source = self._sources[key] = _Source(rules, time.time() if now is None else now)
+        return source
+
+    def evaluate(self, keys):
+        ''' listener: compare the rows appended since the last call against the rules '''
+        if not self.rules:
+            # nothing to compare, rules set later start from the rows appended after them
+            for key in keys:
+                self._cursors[key] = self.buffer_for(*key).seq
+            return
+        start = time.perf_counter()
+        now = time.time()
+        for key in keys:
+            data, self._cursors[key] = self.buffer_for(*key).since(self._cursors.get(key, 0))
+            rows = len(next(iter(data.values()))) if data else 0
+            if not rows:
+                continue
+            self.evaluated_rows += rows
+            source = self.source(key, now)
+            matrix = np.full((rows, len(source.columns)), np.nan)
+            for i, column in enumerate(source.columns):
+                if column in data:
+                    matrix[:, i] = _floats(data[column])
+            valid = matrix == matrix
+            if len(source.t_column):
+                values = matrix[:, source.t_column]
+                breached = (values < source.low) | (values > source.high)
+                self._transition(key, source, 'threshold', breached, values, valid[:, source.t_column])
+            if len(source.r_pair):
+                rates, ok = self._rates(source, matrix)
+                rates, ok = rates[:, source.r_pair], ok[:, source.r_pair]
+                self._transition(key, source, 'rate', ok & (np.abs(rates) > source.limit), rates, ok)
+            if len(source.m_column):
+                # rules without a column are satisfied by any row
+                seen = np.ones(len(source.m_column), dtype=bool)
+                named = source.m_column >= 0
+                seen[named] = valid[:, source.m_column[named]].any(axis=0)
+                source.last_seen[seen] = now
+        self.evaluate_seconds += time.perf_counter() - start
+
+    def check(self, now: Optional[float] = None, sources=None):
+        ''' the missing data rules of every source (by default all evaluated ones) '''
+        now = time.time() if now is None else now
+        for key in list(self._cursors if sources is None else sources):
+            source = self.source(key, now)
+            if len(source.m_column):
+                ages = (now - source.last_seen)[None, :]
+                self._transition(key, source, 'missing', ages > source.seconds, ages, np.ones(ages.shape, dtype=bool))
+
+    async def run(self, interval: float = 1, sources=None):
+        ''' check the missing data rules every interval seconds, sources is a callable '''
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.check(sources=sources() if sources else None)
+            except Exception as ex:
+                logging.error(ex)
+
+    def _rates(self, source, matrix):
+        '''
+        dy (or dy/dx) of every (column, x) pair against its previous valid sample, which
+        may be in an earlier batch: the row index of the last valid sample is forward
+        filled down the batch, with the last sample of the previous batch on top
+        '''
+        ys = np.vstack((source.last_y, matrix[:, source.pair_y]))
+        xs = np.vstack((source.last_x, matrix[:, source.pair_x]))
+        ok = (ys == ys) & ((xs == xs) | ~source.has_x)
+        last = np.maximum.accumulate(np.where(ok, np.arange(len(ys))[:, None], -1), axis=0)
+        previous = np.maximum(last[:-1], 0)
+        dy = ys[1:] - np.take_along_axis(ys, previous, axis=0)
+        dx = np.where(source.has_x, xs[1:] - np.take_along_axis(xs, previous, axis=0), 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = dy / dx
+        ok = ok[1:] & (last[:-1] >= 0) & np.isfinite(rates)
+        found = np.flatnonzero(last[-1] >= 0)
+        source.last_y[found] = ys[last[-1][found], found]
+        source.last_x[found] = xs[last[-1][found], found]
+        return rates, ok
+
+    def _transition(self, key, source, kind, breached, values, valid):
+        '''
+        breached, values and valid are (samples x rules). a rule fires on its first breached
+        sample unless it is already active, and clears when its last valid sample is within
+        bounds again. rules without a valid sample keep their state
+        '''
+        active = source.active[kind]
+        last = len(valid) - 1 - valid[::-1].argmax(axis=0)
+        now_active = np.where(valid.any(axis=0), breached[last, np.arange(len(last))], active)
+        fired = breached.any(axis=0) & ~active
+        cleared = (active | fired) & ~now_active
+        source.active[kind] = now_active
+        if fired.any() or cleared.any():
+            rules = source.rules[kind]
+            first = breached.argmax(axis=0)
+            for i in np.flatnonzero(fired):
+                self._emit(rules[i], key, 'breach', values[first[i], i])
+            for i in np.flatnonzero(cleared):
+                self._emit(rules[i], key, 'clear', values[last[i], i])
+    ##############################
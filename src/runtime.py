@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+
+'''
+one long-lived asyncio event loop running in a daemon thread.
+dash callbacks are plain (sync) functions, they hand coroutines to this loop
+instead of building and tearing down a new loop with asyncio.run on every call
+'''
+class AsyncRuntime(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.loop : Optional[asyncio.AbstractEventLoop] = None
+        self._thread : Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            ready = threading.Event()
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run, args=(self.loop, ready), name='netfield-runtime', daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+
+    def _run(self, loop, ready):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def submit(self, coro):
+        ''' schedule a coroutine on the runtime loop, returns a concurrent.futures.Future '''
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        ''' schedule a coroutine and block the calling thread until its result is ready '''
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        with self._lock:
+            if self.loop and self._thread and self._thread.is_alive():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self._thread.join()
+            self._thread = None
+
+
+'''
+explicit lifecycle for long running collector coroutines.
+every collector is keyed (e.g. by (device, topic)) and at most one runs per key
+'''
+class Collectors(object):
+    def __init__(self, runtime: AsyncRuntime) -> None:
+        super().__init__()
+        self.runtime = runtime
+        self._tasks = {}
+
+    def keys(self):
+        return list(self._tasks.keys())
+
+    def running(self, key):
+        task = self._tasks.get(key)
+        return task is not None and not task.done()
+
+    def start(self, key, factory):
+        ''' start factory() under key, unless a collector for key is already running '''
+        return self.runtime.run(self._start(key, factory))
+
+    def stop(self, key, timeout: Optional[float] = None):
+        return self.runtime.run(self._stop(key), timeout)
+
+    def stop_all(self, timeout: Optional[float] = None):
+        for key in self.keys():
+            self.stop(key, timeout)
+
+    def restart(self, key, factory, timeout: Optional[float] = None):
+        self.stop(key, timeout)
+        return self.start(key, factory)
+
+    async def _start(self, key, factory):
+        if self.running(key):
+            return False
+        task = asyncio.ensure_future(factory())
+        task.add_done_callback(lambda t: self._done(key, t))
+        self._tasks[key] = task
+        logging.debug(f'collector {key} started')
+        return True
+
+    async def _stop(self, key):
+        task = self._tasks.pop(key, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        logging.debug(f'collector {key} stopped')
+        return True
+
+    def _done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception():
+            logging.error(f'collector {key} failed: {task.exception()}')
@@ -0,0 +1,361 @@
+import hashlib
+import json
+import logging
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+import numpy as np
+from .aggregates import derived_name
+from .buffer import RingBuffer, _is_number
+
+
+#header slots (int64) of a shared buffer, the column versions follow at VERSIONS + segment index
+SEQ, FLOOR, CAPACITY, DIRECTORY, DIRECTORY_BYTES, WRITING = range(6)
+VERSIONS = 8
+MAX_COLUMNS = 1024
+HEADER_BYTES = (VERSIONS + MAX_COLUMNS) * 8
+#json column table behind the slots: {"time": segment, "columns": {name: segment}}
+DIRECTORY_SIZE = 1 << 16
+
+
+def shm_name(prefix, device, topic):
+    ''' shared memory name of the (device, topic) buffer, short enough for macOS (31 chars) '''
+    digest = hashlib.sha1(f'{device}\n{topic}'.encode()).hexdigest()[:16]
+    return f'{prefix}_{digest}'
+
+
+def _open(name, create=False, size=0):
+    '''
+    untracked shared memory: the resource tracker would unlink the worker's memory
+    as soon as any reader exits, the worker unlinks it itself in close()
+    '''
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False) # python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _create(name, size):
+    try:
+        return _open(name, create=True, size=size)
+    except FileExistsError:
+        # left behind by a worker that did not shut down cleanly
+        _close(_open(name), unlink=True)
+        return _open(name, create=True, size=size)
+
+
+def _close(shm, unlink=False):
+    try:
+        if unlink:
+            if getattr(shm, '_track', True):
+                # unlink() unregisters from the tracker before python 3.13, keep it balanced
+                resource_tracker.register(shm._name, 'shared_memory')
+            shm.unlink()
+        shm.close()
+    except (BufferError, FileNotFoundError):
+        # views handed out earlier still point into it, the mapping goes with them
+        pass
+
+
+class _Versions(dict):
+    ''' column -> version, every write to a shared column is mirrored into its header slot '''
+    def __init__(self, slots, segments) -> None:
+        super().__init__()
+        self._slots = slots
+        self._segments = segments
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        segment = self._segments.get(key)
+        if segment is not None and segment < MAX_COLUMNS:
+            self._slots[VERSIONS + segment] = value
+
+
+'''
+RingBuffer whose arrays live in shared memory, written by the ingest worker.
+every numeric column (and the timestamps) is one segment named <name>_<n>, the
+header segment <name> holds the sequence counter, the floor, the capacity, a
+version per column and the json table of the column segments. a batch is written
+into the arrays first and published by storing the new seq afterwards, so readers
+never see rows that are only half written. the seq the batch will reach is stored
+before, copies drop the rows it overwrites. string columns stay in the worker
+'''
+class SharedRingBuffer(RingBuffer):
+    def __init__(self, name: str, max_rows: int = 100000, max_age: Optional[float] = None) -> None:
+        self.name = name
+        self._header_shm = _create(name, HEADER_BYTES + DIRECTORY_SIZE)
+        self._header = np.ndarray(VERSIONS + MAX_COLUMNS, dtype=np.int64, buffer=self._header_shm.buf)
+        self._header[:] = 0
+        self._shm = {}      # segment -> SharedMemory
+        self._arrays = {}   # segment -> array on it
+        self._segments = {} # shared column -> segment
+        self._next = 0
+        super().__init__(max_rows, max_age)
+        self._header[CAPACITY] = self.max_rows
+        self._time_segment, self._time = self._allocate()
+        self._versions = _Versions(self._header, self._segments)
+        self._publish()
+
+    @property
+    def seq(self):
+        return int(self._header[SEQ])
+
+    @seq.setter
+    def seq(self, value):
+        self._header[SEQ] = value
+
+    @property
+    def _floor(self):
+        return int(self._header[FLOOR])
+
+    @_floor.setter
+    def _floor(self, value):
+        self._header[FLOOR] = value
+
+    def extend(self, rows, timestamp: Optional[float] = None):
+        rows = list(rows)
+        with self._lock:
+            self._header[WRITING] = self.seq + len(rows)
+            super().extend(rows, timestamp)
+            self._republish()
+
+    def _write(self, row, timestamp):
+        self._header[WRITING] = self.seq + 1
+        super()._write(row, timestamp)
+        self._republish()
+
+    def clear(self):
+        with self._lock:
+            for segment in list(self._segments.values()):
+                self._release(segment)
+            self._segments.clear()
+            super().clear()
+            self._versions = _Versions(self._header, self._segments)
+            self._publish()
+
+    def close(self):
+        ''' unlink all segments, readers keep their mappings until they detach '''
+        with self._lock:
+            for segment in list(self._shm):
+                self._release(segment)
+            _close(self._header_shm, unlink=True)
+
+    def _add_column(self, key, value):
+        if not _is_number(value) or self._next >= MAX_COLUMNS:
+            if self._next >= MAX_COLUMNS:
+                logging.warning(f'{self.name}: more than {MAX_COLUMNS} columns, {key} is not shared')
+            return super()._add_column(key, value)
+        segment, arr = self._allocate()
+        self._columns[key] = arr
+        self._segments[key] = segment
+        self._header[VERSIONS + segment] = self._floor
+        self._publish()
+        return arr
+
+    def _allocate(self):
+        segment, self._next = self._next, self._next + 1
+        shm = self._shm[segment] = _create(f'{self.name}_{segment}', 2 * self.max_rows * 8)
+        arr = self._arrays[segment] = np.ndarray(2 * self.max_rows, dtype=float, buffer=shm.buf)
+        arr[:] = np.nan
+        return segment, arr
+
+    def _release(self, segment):
+        self._arrays.pop(segment, None)
+        _close(self._shm.pop(segment), unlink=True)
+
+    def _republish(self):
+        # a column that turned into strings was replaced by a local object array
+        changed = False
+        for key, segment in list(self._segments.items()):
+            if self._columns.get(key) is not self._arrays[segment]:
+                del self._segments[key]
+                self._release(segment)
+                changed = True
+        if changed:
+            self._publish()
+
+    def _publish(self):
+        table = json.dumps({'time' : self._time_segment, 'columns' : self._segments}).encode()
+        if len(table) > DIRECTORY_SIZE:
+            raise ValueError(f'{self.name}: column table exceeds {DIRECTORY_SIZE} bytes')
+        header = self._header
+        # odd while the table is rewritten, readers retry until they read the same even version twice
+        header[DIRECTORY] += 1
+        self._header_shm.buf[HEADER_BYTES:HEADER_BYTES + len(table)] = table
+        header[DIRECTORY_BYTES] = len(table)
+        header[DIRECTORY] += 1
+
+
+'''
+read-only view of a SharedRingBuffer for the dash worker processes, every read is a
+zero-copy numpy view straight into the worker's memory. it attaches lazily (the worker
+creates the buffer once the subscription reaches it) and follows the column table.
+seq is snapshotted once per read, a read sees every row published before it started.
+derive() is forwarded to the worker through on_derive, the column shows up once the
+worker added it
+'''
+class SharedRingView(RingBuffer):
+    def __init__(self, name: str, max_rows: int = 100000, max_age: Optional[float] = None, on_derive=None) -> None:
+        self.name = name
+        self.on_derive = on_derive # callable (agg, column, window, x)
+        self._header_shm = None
+        self._header = None
+        self._shm = {}
+        self._segments = {}
+        self._directory = -1
+        self._seq = 0
+        super().__init__(max_rows, max_age)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @seq.setter
+    def seq(self, value):
+        # only RingBuffer.__init__ sets it, the worker owns the counter
+        self._seq = value
+
+    @property
+    def _floor(self):
+        return int(self._header[FLOOR]) if self._header is not None else 0
+
+    @_floor.setter
+    def _floor(self, value):
+        pass
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return super().__len__()
+
+    def __contains__(self, name):
+        with self._lock:
+            self._sync()
+            return name in self._columns
+
+    @property
+    def columns(self):
+        with self._lock:
+            self._sync()
+            return list(self._columns.keys())
+
+    def version(self, *names):
+        with self._lock:
+            self._sync()
+            if self._header is None:
+                return 0
+            segments = self._segments
+            return max([
+                int(self._header[VERSIONS + segments[name]]) if segments.get(name, MAX_COLUMNS) < MAX_COLUMNS else self._floor
+                for name in names
+            ] or [self.seq])
+
+    def column(self, name, last: Optional[int] = None):
+        with self._lock:
+            self._sync()
+            return super().column(name, last)
+
+    def timestamps(self, last: Optional[int] = None):
+        with self._lock:
+            self._sync()
+            return super().timestamps(last)
+
+    def since(self, cursor: int, last: Optional[int] = None):
+        with self._lock:
+            self._sync()
+            return super().since(cursor, last)
+
+    def snapshot(self, start: Optional[float] = None, end: Optional[float] = None, columns=None):
+        with self._lock:
+            self._sync()
+            return super().snapshot(start, end, columns)
+
+    def copy(self, columns=None):
+        with self._lock:
+            self._sync()
+            return super().copy(columns)
+
+    def _live_seq(self):
+        # the worker keeps writing while a snapshot is copied, including rows it has not published yet
+        return max(int(self._header[SEQ]), int(self._header[WRITING])) if self._header is not None else 0
+
+    def derive(self, agg: str, column: str, window: int, x: Optional[str] = None):
+        x = x if agg == 'rate' else None
+        if self.on_derive:
+            self.on_derive(agg, column, window, x)
+        return derived_name(agg, column, window, x)
+
+    def append(self, row: dict, timestamp: Optional[float] = None):
+        raise TypeError('shared buffers are written by the ingest worker')
+
+    extend = append
+
+    def mark_gap(self, timestamp: Optional[float] = None):
+        raise TypeError('shared buffers are written by the ingest worker')
+
+    def clear(self):
+        raise TypeError('shared buffers are written by the ingest worker')
+
+    def detach(self):
+        ''' drop the mappings, the next read attaches again (e.g. after the worker restarted) '''
+        with self._lock:
+            for shm in self._shm.values():
+                _close(shm)
+            if self._header_shm is not None:
+                _close(self._header_shm)
+            self._shm = {}
+            self._header_shm = self._header = None
+            self._columns = {}
+            self._segments = {}
+            self._directory = -1
+            self._seq = 0
+
+    def _sync(self):
+        if self._header is None:
+            try:
+                self._header_shm = _open(self.name)
+            except FileNotFoundError:
+                return
+            self._header = np.ndarray(VERSIONS + MAX_COLUMNS, dtype=np.int64, buffer=self._header_shm.buf)
+            self.max_rows = int(self._header[CAPACITY])
+            self._segments = {}
+        header = self._header
+        version = int(header[DIRECTORY])
+        if version != self._directory:
+            while True:
+                version = int(header[DIRECTORY])
+                table = bytes(self._header_shm.buf[HEADER_BYTES:HEADER_BYTES + int(header[DIRECTORY_BYTES])])
+                if version % 2 == 0 and version == int(header[DIRECTORY]):
+                    break
+            if not self._attach_columns(json.loads(table)):
+                # keep reading the rows of the columns attached before (if there are any)
+                if self._directory < 0:
+                    self.detach()
+                return
+            self._directory = version
+        self._seq = int(header[SEQ])
+
+    def _attach_columns(self, table):
+        ''' map the segments of the column table, False if one of them is gone already '''
+        segments = dict(table['columns'], **{'\0time' : table['time']})
+        opened = {}
+        try:
+            for segment in set(segments.values()) - set(self._shm):
+                opened[segment] = _open(f'{self.name}_{segment}')
+        except FileNotFoundError:
+            # unlinked between reading the table and opening it, the next read tries the new table
+            for shm in opened.values():
+                _close(shm)
+            return False
+        for segment in set(self._shm) - set(segments.values()):
+            _close(self._shm.pop(segment))
+        self._shm.update(opened)
+        arrays = {
+            name: np.ndarray(2 * self.max_rows, dtype=float, buffer=self._shm[segment].buf)
+            for name, segment in segments.items()
+        }
+        self._time = arrays.pop('\0time')
+        self._columns = arrays
+        self._segments = table['columns']
+        return True
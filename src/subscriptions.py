@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+import uuid
+import websockets
+from .ws_netfield import NetFieldWebSocket, topic_path
+
+
+'''
+many device/topic subscriptions multiplexed over one NetFieldWebSocket connection.
+sub/unsub requests are correlated with their acks by the generated message id,
+data frames are routed by their path into one buffer per (device, topic).
+with ws-reconnect a lost connection is retried with exponential backoff, hello and
+all active subscriptions are re-sent and a gap marker is written to every buffer
+'''
+class SubscriptionManager(object):
+    def __init__(self, nf: NetFieldWebSocket, buffer_for, ack_timeout: float = 10) -> None:
+        super().__init__()
+        self.nf = nf
+        self.buffer_for = buffer_for # callable (device, topic) -> RingBuffer
+        self.ack_timeout = ack_timeout
+        self.active = {}   # (device, topic) -> path
+        self._routes = {}  # path -> (device, topic)
+        self._pending = {} # message id -> future resolved by the ack
+        self._background = set()
+        self.connected = False
+        self.dropped = 0
+        self.reconnects = 0
+        self.reconnect_latency = None
+        self.last_message = None
+        # called with the (device, topic) keys of every ingested batch
+        self.listeners = []
+        # called with the (device, topic) key and the flattened rows of every ingested batch
+        self.sinks = []
+
+    async def subscribe(self, device: str, topic: str):
+        ''' subscribe once per (device, topic), sent right away or as soon as run() is connected '''
+        key = (device, topic)
+        if key in self.active:
+            return True
+        path = topic_path(device, topic)
+        self.active[key] = path
+        self._routes[path] = key
+        if self.connected:
+            return await self._request('sub', path)
+        return False
+
+    async def unsubscribe(self, device: str, topic: str):
+        path = self.active.pop((device, topic), None)
+        if path is None:
+            return False
+        self._routes.pop(path, None)
+        if self.connected:
+            return await self._request('unsub', path)
+        return True
+
+    async def _request(self, msg_type, path):
+        msg_id = str(uuid.uuid4())
+        ack = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = ack
+        try:
+            await self.nf._send_json({"type" : msg_type, "id" : msg_id, "path" : path})
+            res = await asyncio.wait_for(ack, self.ack_timeout)
+            if 'error' in res:
+                logging.error(f'{msg_type} {path} failed: {res.get("message", res["error"])}')
+                return False
+            logging.info(f'{msg_type} {path} acknowledged')
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f'no ack for {msg_type} {path}')
+            return False
+        except websockets.ConnectionClosed:
+            # active subscriptions are re-sent after the reconnect
+            return False
+        finally:
+            self._pending.pop(msg_id, None)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def stats(self):
+        return {
+            'connected' : self.connected,
+            'subscriptions' : len(self.active),
+            'reconnects' : self.reconnects,
+            'reconnect_latency' : self.reconnect_latency,
+            'dropped' : self.dropped,
+            'undecodable' : self.nf.undecodable,
+        }
+
+    async def run(self):
+        ''' connect, send every active subscription and route frames until cancelled '''
+        delay = self.nf.reconnect_min_delay
+        lost_at = None
+        try:
+            while True:
+                if await self.nf.init_websocket():
+                    if lost_at is not None:
+                        self.reconnects += 1
+                        self.reconnect_latency = time.time() - lost_at
+                        logging.info(f'reconnected after {self.reconnect_latency:.2f}s')
+                        lost_at = None
+                    delay = self.nf.reconnect_min_delay
+                    await self._serve()
+                if not self.nf.ws_reconnect:
+                    return
+                if lost_at is None:
+                    lost_at = time.time()
+                    for key in list(self.active):
+                        self.buffer_for(*key).mark_gap()
+                await self.nf.close_websocket()
+                logging.warning(f'websocket lost, reconnecting in {delay:.1f}s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.nf.reconnect_max_delay)
+        finally:
+            self.connected = False
+            for task in list(self._background):
+                task.cancel()
+            await self.nf.close_websocket()
+
+    async def _serve(self):
+        self.connected = True
+        try:
+            for path in list(self.active.values()):
+                # acks are resolved by the read loop below, so don't wait for them here
+                self._spawn(self._request('sub', path))
+            async for msgs in self.nf.messages(batch=self.nf.ws_batch_size, linger=self.nf.ws_batch_linger):
+                self.dispatch_batch(msgs)
+        except websockets.ConnectionClosed as ex:
+            logging.warning(f'websocket closed: {ex}')
+        finally:
+            self.connected = False
+            for ack in self._pending.values():
+                if not ack.done():
+                    ack.set_result({'error' : 'disconnected', 'message' : 'connection lost'})
+
+    def dispatch(self, msg):
+        parsed = self._parse(msg)
+        if parsed is not None:
+            key, row = parsed
+            self.buffer_for(*key).append(row)
+            self._sink(key, [row])
+            self.last_message = time.time()
+            self._notify((key,))
+
+    def dispatch_batch(self, msgs):
+        ''' route a micro-batch, every buffer gets its rows in one bulk append '''
+        rows = {}
+        for msg in msgs:
+            parsed = self._parse(msg)
+            if parsed is not None:
+                rows.setdefault(parsed[0], []).append(parsed[1])
+        for key, batch in rows.items():
+            self.buffer_for(*key).extend(batch)
+            self._sink(key, batch)
+        if rows:
+            self.last_message = time.time()
+            self._notify(rows.keys())
+
+    def _parse(self, msg):
+        ''' (key, flattened row) of a data frame, a malformed frame is dropped and never stops the read loop '''
+        try:
+            key = self._route(msg)
+            if key is None:
+                return None
+            return key, self.nf.decoder.flatten(key, msg['message']['data'])
+        except Exception as ex:
+            self.dropped += 1
+            logging.warning(f'malformed frame dropped: {ex}')
+            return None
+
+    def _sink(self, key, rows):
+        for sink in self.sinks:
+            try:
+                sink(key, rows)
+            except Exception as ex:
+                logging.error(ex)
+
+    def _notify(self, keys):
+        for listener in self.listeners:
+            try:
+                listener(keys)
+            except Exception as ex:
+                logging.error(ex)
+
+    def _route(self, msg):
+        ''' resolve acks, return the (device, topic) of a data frame '''
+        if not msg:
+            self.dropped += 1
+            return None
+        if 'message' not in msg:
+            ack = self._pending.get(msg.get('id'))
+            if ack and not ack.done():
+                ack.set_result(msg)
+            return None
+        key = self._routes.get(msg.get('path'))
+        if key is None and len(self.active) == 1:
+            # frames without a path can only belong to the single subscription
+            key = next(iter(self.active))
+        if key is None:
+            self.dropped += 1
+        return key
@@ -1,12 +1,25 @@
-import json, logging, os
-from typing import Optional
-import httpx, uuid
-import inspect
+import json, logging, os, time
+import atexit, threading, weakref
+import importlib.util
+from typing import Optional, TYPE_CHECKING
+import uuid
+import asyncio
 import websockets
 import base64
+from .decoding import Decoder
 
-DEFAULT_LOG_LEVEL = "DEBUG"
+if TYPE_CHECKING:
+    import httpx # imported on first use, see LAZY_IMPORTS
+
+#h2 enables HTTP/2 in httpx, looked up without importing it (httpx imports it when used)
+HTTP2 = importlib.util.find_spec('h2') is not None
+
+#DEBUG logs on the hot path, opt in with LOG_LEVEL=DEBUG
+DEFAULT_LOG_LEVEL = "INFO"
 LOG_LEVEL = os.environ.get("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper()
+#slow imports only needed later (httpx on Verify, pyarrow on an arrow export) are deferred
+#to their first use, LAZY_IMPORTS=0 imports them while the dashboard starts instead
+LAZY_IMPORTS = os.environ.get("LAZY_IMPORTS", "1") != "0"
 logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=LOG_LEVEL)
 api_urls = {
     "authentication" : '/auth',
@@ -15,16 +28,82 @@ api_urls = {
     "Devices" : '/devices'
 }
 
+'''
+assets/config.json, read from disk once per process and authoritative in memory afterwards.
+changes are applied under a lock to every config instance (dashboard, websocket) and
+persisted with a debounced atomic write: a temp file renamed over the original
+'''
+class ConfigStore(object):
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, path, delay: float = 0.5) -> None:
+        super().__init__()
+        self.path = path
+        self.delay = delay
+        self.writes = 0
+        self._lock = threading.RLock()
+        self._timer : Optional[threading.Timer] = None
+        self._instances = weakref.WeakSet()
+        with open(path) as f:
+            self.data = json.load(f)
+        atexit.register(self.flush)
+
+    @classmethod
+    def open(cls, path):
+        ''' one store per file, shared by all config instances '''
+        with cls._stores_lock:
+            if path not in cls._stores:
+                cls._stores[path] = cls(path)
+            return cls._stores[path]
+
+    def attach(self, instance):
+        with self._lock:
+            self._instances.add(instance)
+
+    def update(self, changes=None):
+        with self._lock:
+            if changes:
+                self.data.update(changes)
+            for instance in list(self._instances):
+                instance._apply()
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        ''' write the pending changes now '''
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer.cancel()
+            self._timer = None
+            snapshot = json.dumps(self.data, indent=4)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.writes += 1
+        logging.debug('config saved')
+
+
 class config:
     def __init__(self) -> None:
-        self.current_dir = os.path.dirname(
-            os.path.abspath(
-                inspect.getfile(inspect.currentframe())
-            )
-        )
-        self.config_file = json.load(
-            open(self.current_dir+'/assets/config.json')
-        )
+        self.current_dir = os.path.dirname(os.path.abspath(__file__))
+        self._config_store = ConfigStore.open(self.current_dir+'/assets/config.json')
+        self._config_store.attach(self)
+        self._apply()
+
+    def _apply(self):
+        #plain attributes, so reading the config in callbacks costs nothing
+        self.config_file = self._config_store.data
         self.email = self.config_file['email']
         self.password = self.config_file['password']
         self.token = self.config_file['accessToken']
@@ -32,49 +111,180 @@ class config:
         self.topic = self.config_file['message-topic']
         self.device_id = self.config_file['device']
         self.organizationId = self.config_file['organisationId']
+        self.buffer_max_rows = self.config_file.get('buffer-max-rows', 100000)
+        self.buffer_max_age = self.config_file.get('buffer-max-age')
+        self.chart_update_mode = self.config_file.get('chart-update-mode', 'extend')
+        self.chart_max_points = self.config_file.get('chart-max-points', 10000)
+        self.chart_pixel_width = self.config_file.get('chart-pixel-width', 1000)
+        self.chart_points_per_pixel = self.config_file.get('chart-points-per-pixel', 2)
+        self.scatter_sampling = self.config_file.get('scatter-sampling', 'stride')
+        self.webgl_threshold = self.config_file.get('webgl-threshold', 5000)
+        self.chart_template = self.config_file.get('chart-template', 'plotly')
+        self.chart_refresh = self.config_file.get('chart-refresh', 'push')
+        self.push_port = self.config_file.get('push-port', 6008)
+        self.push_coalesce = self.config_file.get('push-coalesce', 0.1)
+        self.session_heartbeat = self.config_file.get('session-heartbeat', 30)
+        self.session_ttl = self.config_file.get('session-ttl', 120)
+        self.http_timeout = self.config_file.get('http-timeout', 10)
+        self.http_max_connections = self.config_file.get('http-max-connections', 10)
+        self.verify_ttl = self.config_file.get('verify-ttl', 300)
+        self.devices_ttl = self.config_file.get('devices-ttl', 300)
+        self.devices_page_size = self.config_file.get('devices-page-size', 100)
+        self.token_refresh_margin = self.config_file.get('token-refresh-margin', 60)
+        self.ws_ping_interval = self.config_file.get('ws-ping-interval', 20)
+        self.ws_ping_timeout = self.config_file.get('ws-ping-timeout', 20)
+        self.ws_reconnect = self.config_file.get('ws-reconnect', True)
+        self.reconnect_min_delay = self.config_file.get('reconnect-min-delay', 0.5)
+        self.reconnect_max_delay = self.config_file.get('reconnect-max-delay', 30)
+        self.ws_batch_size = self.config_file.get('ws-batch-size', 256)
+        self.ws_batch_linger = self.config_file.get('ws-batch-linger', 0.01)
+        self.profiler_enabled = self.config_file.get('profiler-enabled', False)
+        self.profiler_interval = self.config_file.get('profiler-interval', 0.005)
+        self.recording_dir = self.config_file.get('recording-dir')
+        self.recording_flush = self.config_file.get('recording-flush', 1.0)
+        self.recording_segment_bytes = self.config_file.get('recording-segment-bytes', 67108864)
+        self.recording_segment_age = self.config_file.get('recording-segment-age', 3600)
+        self.recording_retain_bytes = self.config_file.get('recording-retain-bytes', 1073741824)
+        self.recording_retain_age = self.config_file.get('recording-retain-age', 604800)
+        self.ingest_mode = self.config_file.get('ingest-mode', 'thread')
+        self.ingest_host = self.config_file.get('ingest-host', '127.0.0.1')
+        self.ingest_port = self.config_file.get('ingest-port', 6009)
+        self.ingest_shm_prefix = self.config_file.get('ingest-shm-prefix', 'netfield')
+        self.rules = self.config_file.get('rules', [])
+        self.rules_poll = self.config_file.get('rules-poll', 2)
+        self.rules_events = self.config_file.get('rules-events', 1000)
     
-    def update_config(self):
+    def update_config(self, changes=None):
+        ''' apply changes (and edits made to self.config_file) in memory, the file is written shortly after '''
         logging.debug('updating config')
-        with open(self.current_dir+'/assets/config.json','w') as f:
-            json.dump(self.config_file,f)
-        self.__init__()
+        self._config_store.update(changes)
+
+def topic_path(deviceId: str, topic: str):
+    topic = base64.b64encode(topic.encode('ascii')).decode()
+    return f'/devices/{deviceId}/platformconnector/{topic}'
+
+
+def _token_expiry(token, resp=None):
+    ''' expiry (epoch seconds) from an auth response, or from the exp claim of a JWT '''
+    if resp and resp.get('expiresIn'):
+        return time.time() + float(resp['expiresIn'])
+    try:
+        claims = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(claims + '=' * (-len(claims) % 4)))
+        return float(claims['exp'])
+    except Exception:
+        return None
+
 
 class NetFieldWebSocket(config):
     ''' Websocket communication with netFIELD'''
     def __init__(self) -> None:
         super().__init__()
         self.ws : Optional[websockets.WebSocketClientProtocol] = None
+        self._client : Optional['httpx.AsyncClient'] = None
+        self._verified = None # (token, endpoint, checked at) of the last successful verification
+        self._devices = {} # organisation id -> (fetched at, device list)
+        self._refresh_task : Optional[asyncio.Task] = None
+        self.token_expiry = None
+        self.decoder = Decoder()
+        #frame counters, read by the /metrics endpoint
+        self.received = 0
+        self.undecodable = 0
+        self.decode_seconds = 0.0
+        self.reload()
+
+    def _apply(self):
+        # every config change (e.g. a new accessToken) reaches the auth header right away
+        config._apply(self)
         self.auth = {'auth' : {'headers':{}}}
         self.auth['headers'] = {
                 "authorization": self.token
             }
-    
+
+    def reload(self):
+        ''' pick up a new token from the config, the cached verification only holds for the same token and endpoint '''
+        self._apply()
+        if self._verified and self._verified[:2] != (self.token, self.BASE_API_ENDPOINT):
+            self._verified = None
+        self.token_expiry = _token_expiry(self.token) if self.token else None
+
     @classmethod
     async def from_email(cls):
-        await cls._gen_access_token(NetFieldWebSocket())
-        return cls()
+        nf = cls()
+        await nf.login()
+        return nf
+
+    async def login(self):
+        await self._gen_access_token()
+        self._schedule_refresh()
+
+    def _rest_endpoint(self):
+        return self.BASE_API_ENDPOINT.replace('wss://', 'https://').replace('ws://', 'http://')
+
+    def _http(self):
+        # one pooled keep-alive client per instance, must be used from a single event loop
+        if self._client is None or self._client.is_closed:
+            import httpx # deferred, see LAZY_IMPORTS
+            self._client = httpx.AsyncClient(
+                http2=HTTP2,
+                timeout=httpx.Timeout(self.http_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.http_max_connections,
+                    max_keepalive_connections=self.http_max_connections
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        await self.close_websocket()
+        if self._client:
+            await self._client.aclose()
+            self._client = None
            
     async def init_websocket(self):
         try:
-            self.ws = await websockets.connect(self.BASE_API_ENDPOINT, ping_interval=None)
+            self.ws = await websockets.connect(
+                self.BASE_API_ENDPOINT,
+                ping_interval=self.ws_ping_interval,
+                ping_timeout=self.ws_ping_timeout
+            )
             await self._send_hello()
             res = await self.ws.recv()
             logging.debug(res)
+            reply = json.loads(res)
+            if not isinstance(reply, dict) or reply.get('type') == 'error' or 'error' in reply:
+                # e.g. an expired token, the caller backs off like after a lost connection
+                logging.error(f'hello rejected: {res}')
+                await self.close_websocket()
+                return 0
             return 1
         except Exception as ex:
             logging.exception(ex)
             return 0
         
     async def verify_token(self):
-        endpoint = f"{self.BASE_API_ENDPOINT.replace('wss','https')}/auth/verify"
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(endpoint, headers=self.auth['headers'])
-            try:
-                resp = resp.json()
-                if 'error' in resp.keys():
-                    return resp["message"]
-            except:
-                return 0
+        #a success is cached per token and endpoint until verify-ttl passes or the token is about to expire
+        if self._verified and self._verified[:2] == (self.token, self.BASE_API_ENDPOINT):
+            fresh = time.time() - self._verified[2] < self.verify_ttl
+            expiring = self.token_expiry and self.token_expiry - time.time() < self.token_refresh_margin
+            if fresh and not expiring:
+                return None
+        self._verified = None
+        # the request is built from the token and endpoint the result is cached for
+        token, base = self.token, self.BASE_API_ENDPOINT
+        endpoint = f"{self._rest_endpoint()}{api_urls['verification']}"
+        resp = await self._http().get(endpoint, headers={'authorization' : token})
+        try:
+            resp = resp.json()
+            if 'error' in resp.keys():
+                return resp["message"]
+        except:
+            return 0
+        self._verified = (token, base, time.time())
+        return None
         
     async def close_websocket(self):
         if self.ws:
@@ -88,16 +298,34 @@ class NetFieldWebSocket(config):
             "email" : self.email,
             "password" : self.password
         }
-        api_endpoint = f"{self.BASE_API_ENDPOINT.replace('wss', 'https')}/auth"
-        async with httpx.AsyncClient() as client:
-            try:
-                _resp = await client.post(api_endpoint, data=payload)
-                _resp = _resp.json()
-                self.config_file["accessToken"] = _resp["accessToken"]
-                self.update_config()
-            except Exception as ex:
-                logging.exception(ex)
-                raise(ex)
+        api_endpoint = f"{self._rest_endpoint()}{api_urls['authentication']}"
+        try:
+            _resp = await self._http().post(api_endpoint, data=payload)
+            _resp = _resp.json()
+            self.update_config({"accessToken" : _resp["accessToken"]})
+            self.reload()
+            self.token_expiry = _token_expiry(self.token, _resp)
+        except Exception as ex:
+            logging.exception(ex)
+            raise(ex)
+
+    def _schedule_refresh(self):
+        #renew the token in the background shortly before it expires
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self.token_expiry and self.email and self.password:
+            delay = max(0, self.token_expiry - time.time() - self.token_refresh_margin)
+            self._refresh_task = asyncio.ensure_future(self._refresh_later(delay))
+
+    async def _refresh_later(self, delay):
+        await asyncio.sleep(delay)
+        self._refresh_task = None
+        try:
+            await self.login()
+            logging.debug('access token refreshed')
+        except Exception as ex:
+            logging.error(f'token refresh failed: {ex}')
  
     async def _send_hello(self):
         hello_msg = {
@@ -114,50 +342,125 @@ class NetFieldWebSocket(config):
                 json.dumps(msg)
             )
 
-    async def get_device_list(self):
-        query = {"organisationId" : self.organizationId}
+    async def get_device_list(self, refresh=False):
+        ''' all devices of the organisation, cached per organisation for devices-ttl seconds '''
+        cached = self._devices.get(self.organizationId)
+        if cached and not refresh and time.time() - cached[0] < self.devices_ttl:
+            return cached[1]
+        try:
+            device_list = await self._fetch_devices()
+            self._devices[self.organizationId] = (time.time(), device_list)
+            return device_list
+        except Exception as ex:
+            logging.info(ex)
+
+    async def _device_page(self, page):
+        query = {"organisationId" : self.organizationId, "page" : page, "limit" : self.devices_page_size}
         header = {"authorization" : self.token}
-        endpoint = f"{self.BASE_API_ENDPOINT.replace('wss', 'https')}/devices"
-        async with httpx.AsyncClient() as client:
-            try:
-                _resp = await client.get(endpoint, headers=header,params=query)
-                _resp = _resp.json()
-                device_list = [device for device in _resp['devices']]
+        endpoint = f"{self._rest_endpoint()}{api_urls['Devices']}"
+        _resp = await self._http().get(endpoint, headers=header, params=query)
+        return _resp.json()
+
+    async def _fetch_devices(self):
+        #the first page tells the total, the remaining pages are requested concurrently
+        limit = self.devices_page_size
+        first = await self._device_page(1)
+        device_list = list(first['devices'])
+        total = (first.get('pagination') or {}).get('total', first.get('total'))
+        if len(device_list) != limit:
+            # a short page, or an api that ignored the limit and sent everything
+            return device_list
+        if total is not None:
+            pending = asyncio.Semaphore(self.http_max_connections)
+            async def fetch(page):
+                async with pending:
+                    return await self._device_page(page)
+            pages = await asyncio.gather(*(fetch(page) for page in range(2, -(-int(total) // limit) + 1)))
+            for resp in pages:
+                device_list += resp['devices']
+            return device_list
+        #without a total the pages are walked until a short or repeated one
+        seen = {device['id'] for device in device_list}
+        page = 1
+        while True:
+            page += 1
+            devices = [device for device in (await self._device_page(page))['devices'] if device['id'] not in seen]
+            device_list += devices
+            seen.update(device['id'] for device in devices)
+            if len(devices) < limit:
                 return device_list
-            except Exception as ex:
-                logging.info(ex)
             
     async def subscribe_to_topic(self, deviceId: str, topic : str):
+        ''' send a sub request and return its id, the ack arrives with the regular frames (see SubscriptionManager) '''
         try:
-            topic = base64.b64encode(topic.encode('ascii')).decode()
-            path = f'/devices/{deviceId}/platformconnector/{topic}'
             msg = {
                 "type" : "sub",
                 "id" : str(uuid.uuid4()),
-                "path" : path
+                "path" : topic_path(deviceId, topic)
             }
             if self.ws:
                 await self._send_json(msg)
-                msg = await self.ws.recv()
                 logging.info('Subscribed to topic in config file')
+                return msg["id"]
         except Exception as ex:
             logging.exception(ex)
             
     async def listen_for_messages(self):
+        ''' receive and decode a single frame, don't mix with iterating self.ws or messages() '''
         if self.ws:
             msg = await self.ws.recv()
             return await self.on_message_handler(msg)
+
+    async def messages(self, batch: Optional[int] = None, linger: float = 0.01):
+        '''
+        decoded frames of the open websocket, every frame is received and decoded exactly once.
+        with batch, lists of up to `batch` messages are yielded instead, a batch is closed
+        early when no further frame arrives within `linger` seconds
+        '''
+        while self.ws:
+            msg = await self.on_message_handler(await self.ws.recv())
+            if not batch:
+                if msg:
+                    yield msg
+                continue
+            msgs = [msg] if msg else []
+            deadline = time.monotonic() + linger
+            try:
+                while len(msgs) < batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        raw = await asyncio.wait_for(self.ws.recv(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    msg = await self.on_message_handler(raw)
+                    if msg:
+                        msgs.append(msg)
+            except websockets.ConnectionClosed:
+                if msgs:
+                    yield msgs
+                raise
+            if msgs:
+                yield msgs
             
     async def on_message_handler(self, message_raw):
+        self.received += 1
+        start = time.perf_counter()
         try:
-            msg = json.loads(message_raw)
+            msg = self.decoder.loads(message_raw)
             return msg
         except Exception as inst:
+            self.undecodable += 1
             logging.exception(inst)
             return 0
-    async def endless_msg_handler(self):
-        for msg in self.ws:
-            m = await self.listen_for_messages()
+        finally:
+            self.decode_seconds += time.perf_counter() - start
+
+    async def endless_msg_handler(self, callback=None):
+        async for msg in self.messages():
+            if callback:
+                callback(msg)
     
     def isConnected(self):
         return self.ws.state
\ No newline at end of file
@@ -0,0 +1,17 @@
+import os
+import shutil
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import ws_netfield
+
+
+@pytest.fixture(autouse=True)
+def config_file(tmp_path, monkeypatch):
+    ''' every test reads and writes a copy of assets/config.json, never the real one '''
+    path = str(tmp_path / 'config.json')
+    shutil.copy(os.path.join(os.path.dirname(ws_netfield.__file__), 'assets', 'config.json'), path)
+    open_store = ws_netfield.ConfigStore.open.__func__
+    monkeypatch.setattr(ws_netfield.ConfigStore, 'open', classmethod(lambda cls, _: open_store(cls, path)))
+    return ws_netfield.ConfigStore.open(path)
@@ -0,0 +1,64 @@
+import numpy as np
+from src.buffer import RingBuffer
+
+WINDOW = 5
+
+
+def naive(agg, ys, start):
+    ''' the aggregate of every sample, windows don't reach back before start[i] '''
+    out = []
+    for i, y in enumerate(ys):
+        lo = max(start[i], i - WINDOW + 1)
+        window = [v for v in ys[lo:i + 1] if v == v]
+        if agg == 'rate':
+            old = max(start[i], i - WINDOW)
+            out.append((y - ys[old]) / (i - old) if i > old else np.nan)
+        elif not window:
+            out.append(np.nan)
+        else:
+            out.append({'mean' : np.mean, 'max' : max, 'min' : min}[agg](window))
+    return np.array(out, dtype=float)
+
+
+def test_derived_columns_match_a_naive_rolling_window():
+    buffer = RingBuffer(max_rows=50)
+    names = {agg: buffer.derive(agg, 'v', WINDOW) for agg in ('mean', 'max', 'min', 'rate')}
+    ys, start = [], []
+    rng = np.random.default_rng(1)
+
+    def rows(count):
+        values = rng.integers(0, 100, count).astype(float)
+        values[rng.random(count) < 0.1] = np.nan
+        return [{} if value != value else {'v' : value} for value in values]
+
+    def feed(batch, restart=False):
+        first = len(ys) if restart or not start else start[-1]
+        for row in batch:
+            ys.append(row.get('v', np.nan))
+            start.append(first)
+
+    def check():
+        for agg, name in names.items():
+            expected = naive(agg, ys, start)[-len(buffer):]
+            np.testing.assert_allclose(buffer[name], expected, equal_nan=True, err_msg=agg)
+
+    batch = rows(30)
+    buffer.extend(batch)
+    feed(batch)
+    # wraps the buffer one row at a time
+    for row in rows(40):
+        buffer.append(row)
+        feed([row])
+    check()
+    buffer.mark_gap()
+    feed([{}], restart=True)
+    batch = rows(20)
+    buffer.extend(batch)
+    feed(batch)
+    check()
+    # larger than the buffer, only the last max_rows arrive
+    batch = rows(120)
+    buffer.extend(batch)
+    feed(batch[-50:], restart=True)
+    assert len(buffer) == 50
+    check()
@@ -0,0 +1,99 @@
+import time
+import numpy as np
+from src.buffer import RingBuffer
+
+
+def test_an_empty_first_value_starts_a_numeric_column():
+    appended, extended = RingBuffer(10), RingBuffer(10)
+    appended.append({'v' : None})
+    appended.append({'v' : 1.5})
+    extended.extend([{'v' : None}, {'v' : 1.5}])
+    for buffer in (appended, extended):
+        assert buffer['v'].dtype == float
+        np.testing.assert_array_equal(buffer['v'], [np.nan, 1.5])
+
+
+def test_wrap_around_keeps_the_last_rows_in_order():
+    buffer = RingBuffer(10)
+    for i in range(25):
+        buffer.append({'v' : i}, timestamp=i)
+    buffer.extend([{'v' : i} for i in range(25, 28)], timestamp=25)
+    assert len(buffer) == 10 and buffer.seq == 28
+    assert list(buffer['v']) == list(range(18, 28))
+    assert list(buffer.timestamps()) == list(range(18, 25)) + [25] * 3
+    assert list(buffer.column('v', last=3)) == [25, 26, 27]
+    # a batch larger than the buffer keeps its last rows
+    buffer.extend([{'v' : i} for i in range(100)])
+    assert buffer.seq == 128 and list(buffer['v']) == list(range(90, 100))
+
+
+def test_rows_older_than_max_age_are_not_live():
+    buffer = RingBuffer(10, max_age=60)
+    now = time.time()
+    buffer.append({'v' : 1}, timestamp=now - 120)
+    buffer.append({'v' : 2}, timestamp=now - 30)
+    buffer.append({'v' : 3}, timestamp=now)
+    assert len(buffer) == 2
+    assert list(buffer['v']) == [2, 3]
+    assert list(buffer.tail()['v']) == [2, 3]
+
+
+def test_since_returns_the_rows_after_the_cursor():
+    buffer = RingBuffer(10)
+    data, cursor = buffer.since(0)
+    assert data == {} and cursor == 0
+    buffer.extend([{'v' : i} for i in range(4)])
+    data, cursor = buffer.since(cursor)
+    assert list(data['v']) == [0, 1, 2, 3] and cursor == 4
+    buffer.append({'v' : 4})
+    data, cursor = buffer.since(cursor)
+    assert list(data['v']) == [4] and cursor == 5
+    data, same = buffer.since(cursor)
+    assert len(data['v']) == 0 and same == cursor
+    # a cursor the buffer wrapped past resumes at the oldest live row
+    buffer.extend([{'v' : i} for i in range(5, 30)])
+    data, cursor = buffer.since(cursor)
+    assert list(data['v']) == list(range(20, 30)) and cursor == 30
+    data, _ = buffer.since(cursor - 5, last=2)
+    assert list(data['v']) == [28, 29]
+
+
+def test_clear_keeps_cursors_and_versions_comparable():
+    buffer = RingBuffer(10)
+    buffer.extend([{'v' : i} for i in range(6)])
+    _, cursor = buffer.since(0)
+    version = buffer.version('v')
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.seq == 6
+    assert buffer.since(cursor) == ({}, 6)
+    assert buffer.version('v') == version
+    buffer.extend([{'v' : 10}, {'v' : 11}])
+    data, cursor = buffer.since(cursor)
+    assert list(data['v']) == [10, 11] and cursor == 8
+    assert buffer.version('v') > version
+
+
+def test_snapshot_drops_rows_overwritten_while_copying():
+    buffer = RingBuffer(10)
+    for i in range(10):
+        buffer.append({'v' : i, 'w' : -i}, timestamp=i)
+    window = buffer._window
+    written = []
+
+    def ingest_during_copy(arr, start, stop):
+        # three rows arrive right before the first column is copied
+        if arr is not buffer._time and not written:
+            for i in range(10, 13):
+                buffer.append({'v' : i, 'w' : -i}, timestamp=i)
+                written.append(i)
+        return window(arr, start, stop)
+
+    buffer._window = ingest_during_copy
+    timestamps, data = buffer.snapshot()
+    assert written
+    assert list(timestamps) == list(range(3, 10))
+    assert list(data['v']) == list(range(3, 10))
+    assert list(data['w']) == [-i for i in range(3, 10)]
+    del buffer._window
+    timestamps, data = buffer.snapshot(start=5, end=11)
+    assert list(timestamps) == list(range(5, 11)) and list(data['v']) == list(range(5, 11))
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import socket
+import pytest
+from src.dashboard import dashboard
+
+
+@pytest.fixture
+def app():
+    return dashboard()
+
+
+def call(app, input_id, prop, value, state=None, output=''):
+    ''' fire the callback with this input (and these {id.prop: value} states) through the dash endpoint '''
+    client = app.app.server.test_client()
+    dependency = next(
+        dep for dep in client.get('/_dash-dependencies').json
+        if any(i['id'] == input_id and i['property'] == prop for i in dep['inputs'])
+        and all(f"{i['id']}.{i['property']}" in (state or {}) for i in dep['state']) and output in dep['output']
+    )
+    output = dependency['output']
+    outputs = []
+    # several outputs are joined as ..a.prop...b.prop..
+    for name in (output[2:-2].split('...') if output.startswith('..') else [output]):
+        target, prop_out = name.rsplit('.', 1)
+        if target.startswith('{'):
+            # pattern-matching id of an output shared by several callbacks
+            target = json.loads(target)
+        outputs.append({'id' : target, 'property' : prop_out})
+    body = {
+        'output' : output, 'outputs' : outputs if len(outputs) > 1 else outputs[0],
+        'inputs' : [{'id' : input_id, 'property' : prop, 'value' : value}],
+        'changedPropIds' : [f'{input_id}.{prop}'],
+        'state' : [
+            {'id' : name.rsplit('.', 1)[0], 'property' : name.rsplit('.', 1)[1], 'value' : data}
+            for name, data in (state or {}).items()
+        ],
+    }
+    return client.post('/_dash-update-component', json=body)
+
+
+def test_clearing_the_endpoint_keeps_it(app, config_file):
+    endpoint = app.BASE_API_ENDPOINT
+    assert call(app, 'api-endpoint', 'value', None).status_code == 204
+    assert app.BASE_API_ENDPOINT == endpoint
+    assert call(app, 'api-endpoint', 'value', 'api-training').status_code == 204
+    assert config_file.data['BASE_API_ENDPOINT'] == 'wss://api-training.netfield.io/v1'
+
+
+def test_leaving_the_charts_stops_the_collectors(app, config_file):
+    async def idle():
+        await asyncio.sleep(3600)
+    app.collectors.start('netfield', idle)
+    app.collectors.start('rules', idle)
+    assert call(app, 'id_1', 'n_clicks', 1, {'session-id.data' : 'session'}, '"page2"').status_code == 204
+    assert app.collectors.keys() == []
+
+
+def test_push_falls_back_to_polling_when_the_port_is_taken(config_file):
+    with socket.socket() as taken:
+        taken.bind(('0.0.0.0', 0))
+        taken.listen()
+        config_file.update({'chart-refresh' : 'push', 'push-port' : taken.getsockname()[1]})
+        app = dashboard()
+        response = call(app, 'interval-component', 'disabled', False, output='push-container')
+    assert response.status_code == 200
+    assert response.json['response'] == {'push-container' : {'children' : []}, 'interval-component' : {'max_intervals' : -1}}
@@ -0,0 +1,26 @@
+import json
+from src.decoding import Decoder
+
+KEY = '/devices/dev/platformconnector/dGVtcA=='
+
+
+def test_payloads_go_through_the_learned_flattener():
+    decoder = Decoder()
+    payload = decoder.loads(json.dumps({'t' : 1, 'sensor' : {'temp' : 20.5, 'axis' : {'x' : 1, 'y' : 2}}, 'status' : 'ok'}))
+    assert decoder.flatten(KEY, payload) == {
+        't' : 1, 'sensor.temp' : 20.5, 'sensor.axis.x' : 1, 'sensor.axis.y' : 2, 'status' : 'ok'
+    }
+    payload['sensor']['axis'] = {'x' : 1}
+    assert decoder.flatten(KEY, payload) == {'t' : 1, 'sensor.temp' : 20.5, 'sensor.axis.x' : 1, 'status' : 'ok'}
+    payload['sensor'] = 7
+    assert decoder.flatten(KEY, payload) == {'t' : 1, 'sensor' : 7, 'status' : 'ok'}
+    assert decoder.schema_changes == 2
+    assert decoder.flatten(KEY, [1, 2]) == {'value' : [1, 2]}
+
+
+def test_an_empty_dict_is_learned_again_once_it_has_keys():
+    decoder = Decoder()
+    assert decoder.flatten(KEY, {'t' : 1, 'sensor' : {}}) == {'t' : 1}
+    assert decoder.flatten(KEY, {'t' : 2, 'sensor' : {'temp' : 20.5}}) == {'t' : 2, 'sensor.temp' : 20.5}
+    assert decoder.flatten(KEY, {'t' : 3, 'sensor' : {}}) == {'t' : 3}
+    assert decoder.schema_changes == 2
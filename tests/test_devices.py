@@ -0,0 +1,37 @@
+import asyncio
+from src.dashboard import index_devices, match_devices
+from src.fake_netfield import FakeNetField
+from src.ws_netfield import NetFieldWebSocket
+
+DEVICES = 10000
+
+
+def test_device_list_is_paginated_cached_and_searchable(config_file):
+    async def main():
+        server = await FakeNetField(host='127.0.0.1', port=0, devices=DEVICES).start()
+        config_file.update({'BASE_API_ENDPOINT' : server.url, 'email' : 'a', 'password' : 'b', 'devices-page-size' : 500})
+        nf = NetFieldWebSocket()
+        try:
+            await nf.login()
+            logins = server.requests
+            devices = await nf.get_device_list()
+            assert len({device['id'] for device in devices}) == DEVICES
+            # one request per page, not one unlimited request
+            assert server.requests - logins == DEVICES // 500
+            # the second call is served from the cache, refresh goes to the api again
+            assert await nf.get_device_list() is devices
+            assert server.requests - logins == DEVICES // 500
+            await nf.get_device_list(refresh=True)
+            assert server.requests - logins == 2 * DEVICES // 500
+            return devices
+        finally:
+            await nf.aclose()
+            await server.stop()
+    devices = asyncio.run(main())
+
+    index = index_devices(devices)
+    assert match_devices(index, 'Device 9999') == ['device-09999']
+    assert match_devices(index, 'DEVICE-0999') == [f'device-0999{i}' for i in range(10)]
+    assert match_devices(index, 'device 1', exclude=['device-00001'], limit=3) == ['device-00010', 'device-00011', 'device-00012']
+    assert len(match_devices(index, '')) == 50
+    assert match_devices(index, 'no such device') == []
@@ -0,0 +1,40 @@
+import threading
+import numpy as np
+from src.buffer import RingBuffer
+from src.downsample import Downsampler
+
+
+def test_text_columns_are_thinned_by_stride():
+    down = Downsampler(budget=100)
+    x = np.arange(1000, dtype=float)
+    status = np.array(['ok', 'warn'] * 500, dtype=object)
+    xs, ys = down.apply('Line', x, status)
+    assert len(xs) == len(ys) <= 100
+    assert np.all(np.diff(xs) > 0)
+    xs, ys = down.apply('Line', status, x)
+    assert len(ys) <= 100
+
+
+def test_downsampling_a_full_buffer_while_it_is_written():
+    buffer = RingBuffer(max_rows=20000)
+    buffer.extend([{'x' : float(i), 'y' : float(i % 7)} for i in range(20000)])
+    down = Downsampler(budget=500)
+    stop = threading.Event()
+
+    def ingest():
+        i = 20000
+        while not stop.is_set():
+            buffer.extend([{'x' : float(i + j), 'y' : 1.0} for j in range(50)])
+            i += 50
+
+    writer = threading.Thread(target=ingest)
+    writer.start()
+    try:
+        for _ in range(20):
+            data, cursor = buffer.copy(['x', 'y'])
+            xs, _ = down.apply('Line', data['x'], data['y'])
+            assert np.all(np.diff(xs) > 0)
+            assert cursor >= data['x'][-1] + 1
+    finally:
+        stop.set()
+        writer.join()
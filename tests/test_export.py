@@ -0,0 +1,92 @@
+import csv
+import io
+import numpy as np
+import pytest
+from src.dashboard import dashboard
+from src.export import TIME_COLUMN, arrow_available, iter_arrow, iter_csv
+
+ROWS = 25
+
+
+@pytest.fixture
+def app():
+    app = dashboard()
+    buffer = app.hub.buffer('dev', 'temp')
+    for i in range(ROWS):
+        buffer.append({'v' : float(i), 'status' : 'ok' if i % 2 else None}, timestamp=1000.0 + i)
+    app.hub.device_names['dev'] = 'Test device'
+    return app
+
+
+def export(app, **args):
+    return app.app.server.test_client().get('/export', query_string=args)
+
+
+def read_csv(text):
+    return list(csv.reader(io.StringIO(text)))
+
+
+def test_csv_export_streams_the_buffer(app):
+    response = export(app, device='dev', topic='temp')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="Test_device_temp.csv"'
+    rows = read_csv(response.get_data(as_text=True))
+    assert rows[0] == [TIME_COLUMN, 'v', 'status']
+    assert len(rows) == ROWS + 1
+    # NaN and None are empty cells
+    assert rows[1] == ['1000.0', '0.0', ''] and rows[2] == ['1001.0', '1.0', 'ok']
+
+
+def test_start_end_and_columns_limit_the_export(app):
+    rows = read_csv(export(app, device='dev', topic='temp', start=1005, end=1010, columns='v').get_data(as_text=True))
+    assert rows[0] == [TIME_COLUMN, 'v']
+    # start is inclusive, end exclusive
+    assert [row[1] for row in rows[1:]] == ['5.0', '6.0', '7.0', '8.0', '9.0']
+    rows = read_csv(export(app, device='dev', topic='temp', start=2000).get_data(as_text=True))
+    assert rows == [[TIME_COLUMN, 'v', 'status']]
+
+
+def test_unknown_sources_and_bad_arguments_are_rejected(app):
+    assert export(app, device='other', topic='temp').status_code == 404
+    assert export(app, topic='temp').status_code == 404
+    assert export(app, device='dev', topic='temp', format='xlsx').status_code == 400
+    assert export(app, device='dev', topic='temp', start='yesterday').status_code == 400
+    assert export(app, device='dev', topic='temp', seconds='a few').status_code == 400
+
+
+def test_csv_chunks_split_at_row_boundaries():
+    timestamps = np.arange(ROWS, dtype=float)
+    data = {'v' : np.arange(ROWS, dtype=float) * 2}
+    chunks = list(iter_csv(timestamps, data, chunk_rows=10))
+    assert len(chunks) == 3
+    assert all(chunk.endswith('\n') for chunk in chunks)
+    # the header goes with the first chunk, every chunk holds whole rows
+    assert [len(read_csv(chunk)) for chunk in chunks] == [11, 10, 5]
+    assert read_csv(''.join(chunks))[1:] == [[f'{i:.1f}', f'{2 * i:.1f}'] for i in range(ROWS)]
+    assert list(iter_csv(np.empty(0), {'v' : np.empty(0)})) == [f'{TIME_COLUMN},v\r\n']
+
+
+@pytest.mark.skipif(not arrow_available(), reason='pyarrow is not available')
+def test_arrow_export_has_one_batch_per_chunk(app):
+    import pyarrow as pa
+    timestamps = np.arange(ROWS, dtype=float)
+    status = np.array([None if i % 2 else str(i) for i in range(ROWS)], dtype=object)
+    stream = b''.join(iter_arrow(timestamps, {'v' : timestamps * 2, 'status' : status}, chunk_rows=10))
+    reader = pa.ipc.open_stream(stream)
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [10, 10, 5]
+    table = pa.Table.from_batches(batches)
+    assert table.schema.names == [TIME_COLUMN, 'v', 'status']
+    assert table.column('v').to_pylist() == [2.0 * i for i in range(ROWS)]
+    assert table.column('status').null_count == 12
+
+    response = export(app, device='dev', topic='temp', format='arrow', start=1020)
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.get_data()).read_all()
+    assert table.column('v').to_pylist() == [20.0, 21.0, 22.0, 23.0, 24.0]
+
+
+@pytest.mark.skipif(arrow_available(), reason='pyarrow is available')
+def test_arrow_export_without_pyarrow(app):
+    assert export(app, device='dev', topic='temp', format='arrow').status_code == 501
@@ -0,0 +1,64 @@
+import asyncio
+from src.dashboard import Store
+from src.hub import Hub
+from src.runtime import AsyncRuntime
+
+KEY = ('dev', 'temp')
+
+
+class Upstream(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = []
+
+    async def subscribe(self, device, topic):
+        self.calls.append(('sub', device, topic))
+
+    async def unsubscribe(self, device, topic):
+        self.calls.append(('unsub', device, topic))
+
+
+def test_the_last_viewer_leaving_drops_the_buffered_rows():
+    runtime = AsyncRuntime()
+    hub = Hub(runtime, Store, max_rows=100)
+    hub.upstream = Upstream()
+    try:
+        hub.set_subscriptions('a', [KEY])
+        hub.set_subscriptions('b', [KEY])
+        buffer = hub.buffer(*KEY)
+        name = buffer.derive('mean', 'v', 3)
+        buffer.extend([{'v' : float(i)} for i in range(50)])
+        _, cursor = buffer.since(0)
+        hub.release_all('a')
+        runtime.run(asyncio.sleep(0))
+        assert len(buffer) == 50
+        hub.release_all('b')
+        # runs after the unsubscribe submitted by the release
+        runtime.run(asyncio.sleep(0))
+        assert hub.upstream.calls == [('sub', *KEY), ('unsub', *KEY)]
+        assert len(buffer) == 0 and buffer.columns == [name]
+        # the next viewer gets the same buffer, cursors handed out before still work
+        hub.set_subscriptions('c', [KEY])
+        assert hub.buffer(*KEY) is buffer
+        buffer.extend([{'v' : 100.0}])
+        data, _ = buffer.since(cursor)
+        assert list(data['v']) == [100.0] and list(data[name]) == [100.0]
+        runtime.run(asyncio.sleep(0))
+        assert hub.upstream.calls[-1] == ('sub', *KEY)
+    finally:
+        runtime.stop()
+
+
+def test_a_viewer_coming_back_before_the_drop_sees_a_gap():
+    hub = Hub(AsyncRuntime(), Store, max_rows=100)
+    hub.set_subscriptions('a', [KEY])
+    buffer = hub.buffer(*KEY)
+    buffer.extend([{'v' : 1.0}])
+    with hub._lock:
+        # released and viewed again while the unsubscribe is still on its way
+        hub.refs.pop(KEY)
+        hub.acquire('b', KEY)
+    assert list(buffer.gaps) == [1] and len(buffer) == 2
+    hub.release_all('a')
+    hub.release_all('b')
+    assert len(buffer) == 0
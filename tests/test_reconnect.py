@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import re
+import time
+from src.buffer import RingBuffer
+from src.fake_netfield import FakeNetField
+from src.subscriptions import SubscriptionManager
+from src.ws_netfield import NetFieldWebSocket
+
+KEY = ('device-00000', 'telemetry')
+
+
+async def until(condition, timeout=10):
+    ''' poll until condition() holds, fails after timeout seconds '''
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        await asyncio.sleep(0.02)
+
+
+def run(config_file, check, **fake):
+    async def main():
+        server = await FakeNetField(host='127.0.0.1', port=0, devices=1, **fake).start()
+        config_file.update({
+            'BASE_API_ENDPOINT' : server.url, 'email' : 'a', 'password' : 'b', 'accessToken' : '',
+            'reconnect-min-delay' : 0.05, 'reconnect-max-delay' : 0.4,
+        })
+        nf = NetFieldWebSocket()
+        buffers = {}
+        subs = SubscriptionManager(nf, lambda device, topic: buffers.setdefault((device, topic), RingBuffer(10000)))
+        try:
+            await check(server, nf, subs, buffers)
+        finally:
+            await nf.aclose()
+            await server.stop()
+    asyncio.run(main())
+
+
+def test_dropped_connections_reconnect_and_mark_gaps(config_file):
+    async def check(server, nf, subs, buffers):
+        await nf.login()
+        await subs.subscribe(*KEY)
+        task = asyncio.ensure_future(subs.run())
+        await until(lambda: subs.reconnects >= 2 and subs.connected)
+        assert server.drops >= 2
+        buffer = buffers[KEY]
+        assert len(buffer.gaps) >= 2
+        # data keeps arriving after every reconnect
+        rows_before = len(buffer)
+        await until(lambda: len(buffer) > rows_before)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    run(config_file, check, rate=200, drop_every=0.4)
+
+
+def test_rejected_hello_backs_off(config_file, caplog):
+    async def check(server, nf, subs, buffers):
+        nf.token = 'expired'
+        nf.auth['headers'] = {'authorization' : nf.token}
+
+        def delays():
+            return [float(d) for d in re.findall(r'reconnecting in ([\d.]+)s', caplog.text)]
+
+        with caplog.at_level(logging.WARNING):
+            task = asyncio.ensure_future(subs.run())
+            await until(lambda: len(delays()) >= 5)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # 0.05, 0.1, 0.2, 0.4, 0.4 ... rounded to one decimal in the log
+        assert delays() == sorted(delays()) and delays()[-1] == 0.4
+        assert subs.reconnects == 0 and not subs.connected
+    run(config_file, check)
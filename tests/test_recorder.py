@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pytest
+from src.recorder import Recorder, RecordingReader, Segment
+
+KEY = ('dev', 'temp')
+
+
+def test_payload_keys_are_quoted_file_names(tmp_path):
+    recorder = Recorder(str(tmp_path / 'rec'), retain_bytes=None, retain_age=None)
+    rows = [{'a/b' : 1.0, '../x' : 2.0, 'ok' : 'text'}, {'a/b' : 4.0, '../x' : 5.0, 'ok' : 'more'}]
+    recorder._append(KEY, rows, [1.0, 2.0])
+    recorder._append(KEY, rows[:1], [3.0])
+    assert not os.path.exists(tmp_path / 'x.f8')
+    data = RecordingReader(str(tmp_path / 'rec')).read(*KEY)
+    assert list(data['_time']) == [1.0, 2.0, 3.0]
+    assert list(data['a/b']) == [1.0, 4.0, 1.0]
+    assert list(data['../x']) == [2.0, 5.0, 2.0]
+    assert list(data['ok']) == ['text', 'more', 'text']
+
+
+def test_failed_append_keeps_the_columns_aligned(tmp_path):
+    segment = Segment.create(str(tmp_path), 1.0)
+    segment.append([1.0], {'a' : ('f8', [1.0]), 'b' : ('f8', [2.0])})
+    with pytest.raises(TypeError):
+        # b is written after a, the rows of a are rolled back
+        segment.append([2.0], {'a' : ('f8', [3.0]), 'b' : ('f8', [object()])})
+    assert segment.meta['rows'] == 1
+    assert all(os.path.getsize(segment.file(name)) == 8 for name in ('a', 'b'))
+    segment.append([3.0], {'a' : ('f8', [4.0]), 'c' : ('f8', [5.0])})
+    loaded = Segment.load(segment.path)
+    assert loaded.meta['rows'] == 2
+    c = np.fromfile(loaded.file('c'), dtype='<f8')
+    assert np.isnan(c[0]) and c[1] == 5.0
+
+
+def test_full_queue_drops_batches(tmp_path):
+    recorder = Recorder(str(tmp_path), max_queue=2)
+    for i in range(5):
+        recorder.write(KEY, [{'v' : i}])
+    assert recorder.rows_dropped == 3
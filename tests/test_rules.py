@@ -0,0 +1,47 @@
+import numpy as np
+from src.buffer import RingBuffer
+from src.rules import RuleEngine
+
+KEY = ('dev', 'temp')
+
+
+def make_engine(rules):
+    buffer = RingBuffer(1000)
+    return buffer, RuleEngine(lambda device, topic: buffer, rules)
+
+
+def test_missing_rule_without_a_column_is_fed_by_any_row():
+    buffer, engine = make_engine([{'name' : 'silent', 'type' : 'missing', 'seconds' : 5}])
+    engine.source(KEY, now=0)
+    buffer.extend([{'v' : 1.0}])
+    engine.evaluate([KEY])
+    assert engine.source(KEY).last_seen[0] > 0
+    engine.check(now=engine.source(KEY).last_seen[0] + 1)
+    assert engine.events() == []
+    engine.check(now=engine.source(KEY).last_seen[0] + 10)
+    assert [event['state'] for event in engine.events()] == ['breach']
+
+
+def test_missing_rules_with_and_without_a_column():
+    buffer, engine = make_engine([
+        {'name' : 'any', 'type' : 'missing', 'seconds' : 5},
+        {'name' : 'a', 'type' : 'missing', 'column' : 'a', 'seconds' : 5},
+        {'name' : 'b', 'type' : 'missing', 'column' : 'b', 'seconds' : 5},
+    ])
+    engine.source(KEY, now=0)
+    buffer.extend([{'a' : 1.0}])
+    buffer.extend([{'b' : np.nan}])
+    engine.evaluate([KEY])
+    seen = engine.source(KEY).last_seen > 0
+    assert list(seen) == [True, True, False]
+
+
+def test_rules_set_later_skip_the_rows_appended_without_rules():
+    buffer, engine = make_engine([])
+    buffer.extend([{'t' : 100.0}] * 10)
+    engine.evaluate([KEY])
+    engine.set_rules([{'name' : 'hot', 'type' : 'threshold', 'column' : 't', 'max' : 80}])
+    buffer.extend([{'t' : 20.0}])
+    engine.evaluate([KEY])
+    assert engine.evaluated_rows == 1
+    assert engine.events() == []
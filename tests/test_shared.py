@@ -0,0 +1,158 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+import numpy as np
+from src import shared
+from src.fake_netfield import FakeNetField
+from src.ingest import IngestWorker, RemoteUpstream
+from src.shared import SharedRingBuffer, SharedRingView, shm_name
+from src.ws_netfield import NetFieldWebSocket
+
+PREFIX = f'nftest{os.getpid()}'
+ROWS = 5000
+
+
+def write(name, ready, done):
+    ''' the ingest worker's side, runs in a spawned process '''
+    buffer = SharedRingBuffer(name, 1000)
+    try:
+        for start in range(0, ROWS, 100):
+            buffer.extend([{'i' : float(i), 'twice' : 2.0 * i, 'status' : 'ok'} for i in range(start, start + 100)])
+            ready.set()
+        done.wait(30)
+    finally:
+        buffer.close()
+
+
+def test_rows_written_in_another_process_are_read_consistently():
+    name = shm_name(PREFIX, 'dev', 'spawned')
+    context = multiprocessing.get_context('spawn')
+    ready, done = context.Event(), context.Event()
+    writer = context.Process(target=write, args=(name, ready, done))
+    writer.start()
+    view = SharedRingView(name)
+    try:
+        assert ready.wait(30)
+        deadline = time.monotonic() + 30
+        while view.seq < ROWS and time.monotonic() < deadline:
+            data, stop = view.copy(['i', 'twice'])
+            if len(data.get('i', ())):
+                # one consistent run of rows, whatever the writer did meanwhile
+                assert np.all(np.diff(data['i']) == 1)
+                assert np.array_equal(data['twice'], 2 * data['i'])
+                assert data['i'][-1] <= stop - 1
+        assert view.seq == ROWS
+        assert list(view['i']) == list(range(ROWS - 1000, ROWS))
+        # text stays in the worker
+        assert 'status' not in view and view.columns == ['i', 'twice']
+    finally:
+        done.set()
+        writer.join(30)
+        view.detach()
+    assert writer.exitcode == 0
+
+
+def test_a_segment_unlinked_while_attaching_is_retried(monkeypatch):
+    name = shm_name(PREFIX, 'dev', 'unlinked')
+    buffer = SharedRingBuffer(name, 100)
+    view = SharedRingView(name)
+    try:
+        buffer.extend([{'a' : 1.0}])
+        assert view.columns == ['a'] and len(view) == 1
+        buffer.extend([{'a' : 2.0, 'b' : 3.0}])
+        opened = shared._open
+
+        def gone(segment, *args, **kwargs):
+            if segment != name:
+                raise FileNotFoundError(segment)
+            return opened(segment, *args, **kwargs)
+
+        monkeypatch.setattr(shared, '_open', gone)
+        # the columns attached before stay readable
+        assert view.columns == ['a'] and list(view['a']) == [1.0]
+        monkeypatch.setattr(shared, '_open', opened)
+        assert view.columns == ['a', 'b'] and len(view) == 2
+        np.testing.assert_array_equal(view['b'], [np.nan, 3.0])
+    finally:
+        view.detach()
+        buffer.close()
+
+
+def test_a_copy_drops_the_rows_of_a_batch_still_being_written():
+    name = shm_name(PREFIX, 'dev', 'writing')
+    buffer = SharedRingBuffer(name, 10)
+    view = SharedRingView(name)
+    copies = []
+
+    class Midway(shared._Versions):
+        # set right after a column of the batch was written, before the batch is published
+        def __setitem__(self, key, value):
+            super().__setitem__(key, value)
+            if not copies:
+                copies.append(view.copy(['i']))
+
+    try:
+        buffer.extend([{'i' : float(i)} for i in range(10)])
+        buffer._versions = Midway(buffer._header, buffer._segments)
+        buffer.extend([{'i' : float(i)} for i in range(10, 13)])
+        data, stop = copies[0]
+        assert stop == 10 and list(data['i']) == list(range(3, 10))
+    finally:
+        view.detach()
+        buffer.close()
+
+
+def test_remote_upstream_reads_what_the_worker_ingests(config_file):
+    key = ('device-00000', 'telemetry')
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    async def main():
+        server = await FakeNetField(host='127.0.0.1', port=0, devices=1, rate=200).start()
+        config_file.update({'BASE_API_ENDPOINT' : server.url, 'email' : 'a', 'password' : 'b', 'accessToken' : ''})
+        dashboard_nf = NetFieldWebSocket()
+        await dashboard_nf.login()
+        worker = IngestWorker(NetFieldWebSocket(), port=port, prefix=PREFIX, stats_interval=0.1)
+        views = {}
+        upstream = RemoteUpstream(
+            dashboard_nf, lambda device, topic: views.setdefault((device, topic), SharedRingView(shm_name(PREFIX, device, topic))),
+            f'ws://127.0.0.1:{port}', poll=0.05
+        )
+        changed = []
+        upstream.listeners.append(changed.extend)
+        tasks = [asyncio.ensure_future(worker.run())]
+        try:
+            await asyncio.sleep(0.1)
+            tasks.append(asyncio.ensure_future(upstream.run()))
+            await upstream.subscribe(*key)
+
+            async def until(condition):
+                deadline = time.monotonic() + 10
+                while not condition():
+                    assert time.monotonic() < deadline
+                    await asyncio.sleep(0.05)
+
+            # the subscription is sent once the control channel is up
+            await until(lambda: len(upstream.buffer_for(*key)) > 20)
+            view = views[key]
+            assert 'value0' in view and 'status' not in view
+            assert worker.holders[key]
+            await until(lambda: upstream.connected and upstream.received > 0)
+            assert key in changed
+            name = view.derive('mean', 'value0', 5)
+            await upstream.derive(*key, 'mean', 'value0', 5)
+            await until(lambda: name in view)
+            await upstream.unsubscribe(*key)
+            await until(lambda: key not in worker.holders)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for view in views.values():
+                view.detach()
+            await dashboard_nf.aclose()
+            await server.stop()
+    asyncio.run(main())
@@ -0,0 +1,29 @@
+from src.buffer import RingBuffer
+from src.subscriptions import SubscriptionManager
+from src.ws_netfield import NetFieldWebSocket, topic_path
+
+
+def make_manager():
+    buffers = {}
+    subs = SubscriptionManager(NetFieldWebSocket(), lambda device, topic: buffers.setdefault((device, topic), RingBuffer(100)))
+    subs.active[('dev', 'temp')] = topic_path('dev', 'temp')
+    subs._routes[topic_path('dev', 'temp')] = ('dev', 'temp')
+    return subs, buffers
+
+
+def test_malformed_frames_are_dropped_not_fatal():
+    subs, buffers = make_manager()
+    path = topic_path('dev', 'temp')
+    subs.dispatch_batch([
+        {'path' : path, 'message' : {'data' : {'v' : 1}}},
+        {'path' : path, 'message' : 'oops'},
+        ['not', 'a', 'frame'],
+        {'path' : path, 'message' : {}},
+        {'path' : path, 'message' : {'data' : {'v' : 2}}},
+    ])
+    assert list(buffers[('dev', 'temp')].column('v')) == [1, 2]
+    assert subs.dropped == 3
+    subs.dispatch({'path' : path, 'message' : None})
+    subs.dispatch({'path' : path, 'message' : {'data' : {'v' : 3}}})
+    assert list(buffers[('dev', 'temp')].column('v')) == [1, 2, 3]
+    assert subs.dropped == 4
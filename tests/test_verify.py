@@ -0,0 +1,90 @@
+import asyncio
+import json
+from src.ws_netfield import NetFieldWebSocket
+
+
+class StandIn(object):
+    ''' keep-alive HTTP/1.1 stand-in for /auth/verify, counts connections and requests and keeps the tokens sent '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.connections = 0
+        self.requests = 0
+        self.tokens = []
+        self.body = json.dumps({'valid' : True}).encode()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return f'ws://127.0.0.1:{self._server.sockets[0].getsockname()[1]}/v1'
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while await reader.readline():
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    if name.lower() == 'authorization':
+                        self.tokens.append(value.strip())
+                self.requests += 1
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n' +
+                    f'Content-Length: {len(self.body)}\r\n\r\n'.encode() + self.body
+                )
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+def run(config_file, check):
+    async def main():
+        server = StandIn()
+        config_file.update({'BASE_API_ENDPOINT' : await server.start(), 'accessToken' : 'token-a'})
+        nf = NetFieldWebSocket()
+        try:
+            await check(server, nf)
+        finally:
+            await nf.aclose()
+            await server.stop()
+    asyncio.run(main())
+
+
+def test_verification_is_cached_across_reload(config_file):
+    async def check(server, nf):
+        assert await nf.verify_token() is None
+        # the dashboard reloads the config before every verify
+        nf.reload()
+        assert await nf.verify_token() is None
+        assert server.requests == 1
+        config_file.update({'accessToken' : 'token-b'})
+        nf.reload()
+        assert await nf.verify_token() is None
+        # a token set in the config without reload() is the one sent and cached
+        config_file.update({'accessToken' : 'token-c'})
+        assert nf.auth['headers']['authorization'] == 'token-c'
+        assert await nf.verify_token() is None
+        assert await nf.verify_token() is None
+        assert server.requests == 3
+        assert server.tokens == ['token-a', 'token-b', 'token-c']
+        # one pooled keep-alive connection for all of them
+        assert server.connections == 1
+    run(config_file, check)
+
+
+def test_failed_verification_is_not_cached(config_file):
+    async def check(server, nf):
+        server.body = b'<html>bad gateway</html>'
+        assert await nf.verify_token() == 0
+        assert await nf.verify_token() == 0
+        assert server.requests == 2
+        server.body = json.dumps({'error' : 'Unauthorized', 'message' : 'expired'}).encode()
+        assert await nf.verify_token() == 'expired'
+        assert await nf.verify_token() == 'expired'
+        assert server.requests == 4
+    run(config_file, check)